@@ -0,0 +1,125 @@
+"""
+Agent Jobs
+
+Records and storage for long-running tasks delegated between agents. Instead of
+holding a request/reply inbox open for a multi-minute book chapter, a requester
+submits a job, gets a job ID back immediately and either subscribes to the job's
+progress events or fetches the result later.
+
+- Job records are persisted in a JetStream Key-Value bucket on a NATS server
+- With inproc:// URLs they are kept in a local in-memory store shared by the process
+"""
+
+import json
+import asyncio
+import logging
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from nats.js.errors import BucketNotFoundError, KeyNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+# Job states; the last three are terminal
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+TERMINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+
+
+@dataclass
+class Job:
+    """A long-running task submitted to an agent"""
+
+    job_id: str
+    agent: str
+    submitted_by: str
+    status: str = JOB_QUEUED
+    progress: float = 0.0  # 0.0 to 1.0
+    message: str = ""
+    result: Optional[str] = None
+    result_ref: Optional[Dict[str, Any]] = None  # claim check for large results (see agent_payloads)
+    error: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    updated_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Job':
+        """Create from dictionary"""
+        return cls(**data)
+
+    def event(self) -> Dict[str, Any]:
+        """The job record without its result, for progress events"""
+        data = self.to_dict()
+        data.pop("result")
+        return data
+
+
+class LocalJobStore:
+    """In-memory job store used with the in-process transport"""
+
+    def __init__(self):
+        self._jobs: Dict[str, str] = {}
+
+    async def put(self, job: Job):
+        self._jobs[job.job_id] = json.dumps(job.to_dict())
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        data = self._jobs.get(job_id)
+        return Job.from_dict(json.loads(data)) if data else None
+
+
+class KVJobStore:
+    """Job store backed by a JetStream Key-Value bucket"""
+
+    def __init__(self, nats_client, bucket: str, ttl: Optional[float] = None):
+        self.bucket = bucket
+        self.ttl = ttl
+        self._js = nats_client.jetstream()
+        self._kv = None
+        self._lock = asyncio.Lock()
+
+    async def _key_value(self):
+        async with self._lock:
+            if self._kv is None:
+                try:
+                    self._kv = await self._js.key_value(self.bucket)
+                except BucketNotFoundError:
+                    self._kv = await self._js.create_key_value(
+                        bucket=self.bucket,
+                        description="Agent job records",
+                        ttl=self.ttl,
+                    )
+            return self._kv
+
+    async def put(self, job: Job):
+        kv = await self._key_value()
+        await kv.put(job.job_id, json.dumps(job.to_dict()).encode('utf-8'))
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        kv = await self._key_value()
+        try:
+            entry = await kv.get(job_id)
+        except KeyNotFoundError:
+            return None
+        return Job.from_dict(json.loads(entry.value.decode('utf-8')))
+
+
+_local_stores: Dict[str, LocalJobStore] = {}
+
+
+def get_local_job_store(url: str) -> LocalJobStore:
+    """Get (or create) the job store shared by every agent on an inproc:// URL"""
+    return _local_stores.setdefault(url, LocalJobStore())
@@ -0,0 +1,175 @@
+"""
+Agent Loop
+
+The act-until-done loop shared by the agents' agentic_run(). Each iteration is
+a single completion: the model either calls tools (their results go back to it
+in the next iteration) or answers, and that turn itself decides whether the
+loop continues. There is no separate "should we continue? yes/no" completion
+and no copy of the history per iteration.
+
+The loop stops when:
+- the model calls the `finish` tool (for agents that offer FINISH_TOOL), or
+- the model answers without calling tools (finish_reason "stop"), unless the
+  agent requires an explicit finish, or
+- max_iterations or the token budget is reached.
+
+An agent only needs `messages`, `prompt(messages) -> messages` (one completion
+plus its tool calls, with the assistant turn appended) and `last_completion`
+(the completion prompt() just made, as returned by the OpenAI client or as a dict;
+{"finish_reason": "error"} if the completion failed, which stops the loop).
+prompt() must answer every tool call of the turn; any it leaves unanswered get
+an error result, so the next completion still sees a valid history.
+"""
+
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+FINISH_TOOL_NAME = "finish"
+
+FINISH_TOOL = {
+    "type": "function",
+    "function": {
+        "name": FINISH_TOOL_NAME,
+        "description": "Call this once the original task is fully complete, with a summary of the result for the user.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "summary": {
+                    "type": "string",
+                    "description": "What was done and where the results are",
+                }
+            },
+            "required": ["summary"],
+        },
+    },
+}
+
+CONTINUE_PROMPT = "Continue where you left off."
+FINISH_PROMPT = "Continue with the next step of the original task, and call finish once it is complete."
+
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def completion_turn(completion: Any) -> Tuple[Optional[str], List[Any], int]:
+    """(finish_reason, tool_calls, total tokens) of an OpenAI completion or an lm_client-style dict"""
+    if isinstance(completion, dict):
+        finish_reason = completion.get("finish_reason")
+        tool_calls = completion.get("tool_calls") or []
+    else:
+        choice = completion.choices[0]
+        finish_reason = choice.finish_reason
+        tool_calls = choice.message.tool_calls or []
+    usage = _field(completion, "usage")
+    return finish_reason, list(tool_calls), _field(usage, "total_tokens", 0) or 0
+
+
+def tool_call_name(tool_call: Any) -> str:
+    return _field(_field(tool_call, "function"), "name", "")
+
+
+def assistant_message(message: Any, content: Optional[str] = None) -> Dict[str, Any]:
+    """The assistant turn as a plain message dict, keeping its tool calls so tool results can follow it"""
+    entry: Dict[str, Any] = {
+        "role": "assistant",
+        "content": _field(message, "content") if content is None else content,
+    }
+    tool_calls = _field(message, "tool_calls")
+    if tool_calls:
+        entry["tool_calls"] = [
+            {
+                "id": _field(tool_call, "id"),
+                "type": "function",
+                "function": {
+                    "name": tool_call_name(tool_call),
+                    "arguments": _field(_field(tool_call, "function"), "arguments", "{}"),
+                },
+            }
+            for tool_call in tool_calls
+        ]
+    return entry
+
+
+def finish_summary(tool_call: Any) -> str:
+    """The summary passed to a finish tool call"""
+    try:
+        arguments = json.loads(_field(_field(tool_call, "function"), "arguments", "{}") or "{}")
+    except json.JSONDecodeError:
+        return ""
+    return arguments.get("summary", "") if isinstance(arguments, dict) else ""
+
+
+def fill_missing_tool_results(messages: List[Any], agent: str = "agent") -> List[Any]:
+    """
+    Answer every tool call in the last assistant turn that has no tool result.
+
+    A chat API rejects a history where a tool call isn't followed by its result,
+    so a prompt() that handled only some calls would break every later completion.
+    """
+    for index in range(len(messages) - 1, -1, -1):
+        if _field(messages[index], "role") == "assistant":
+            break
+    else:
+        return messages
+    answered = {_field(message, "tool_call_id") for message in messages[index + 1:]
+                if _field(message, "role") == "tool"}
+    for tool_call in _field(messages[index], "tool_calls") or []:
+        if _field(tool_call, "id") not in answered:
+            logger.warning(f"{agent}: no result for tool call {tool_call_name(tool_call)}; reporting it as not run")
+            messages.append({
+                "role": "tool",
+                "tool_call_id": _field(tool_call, "id"),
+                "content": f"Tool '{tool_call_name(tool_call)}' was not run.",
+            })
+    return messages
+
+
+def run_until_done(agent, max_iterations: int = 10, token_budget: Optional[int] = None,
+                   require_finish: bool = False, continue_prompt: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Prompt `agent` until the model says it is done; returns agent.messages.
+
+    With `require_finish`, a plain answer is not the end of the task: the model
+    is nudged with `continue_prompt` until it calls the finish tool.
+    """
+    continue_prompt = continue_prompt or (FINISH_PROMPT if require_finish else CONTINUE_PROMPT)
+    name = getattr(agent, "name", "agent")
+    tokens_used = 0
+    for iteration in range(1, max_iterations + 1):
+        agent.messages = fill_missing_tool_results(agent.prompt(agent.messages), name)
+        finish_reason, tool_calls, tokens = completion_turn(agent.last_completion)
+        tokens_used += tokens
+
+        if finish_reason == "error":
+            logger.warning(f"{name} stopped after a failed completion")
+            return agent.messages
+
+        finish = next((call for call in tool_calls if tool_call_name(call) == FINISH_TOOL_NAME), None)
+        if finish is not None:
+            summary = finish_summary(finish)
+            if summary:
+                agent.messages.append({"role": "assistant", "content": summary})
+            logger.info(f"{name} finished after {iteration} iteration(s), {tokens_used} tokens")
+            return agent.messages
+
+        if not tool_calls:
+            if finish_reason != "length" and not require_finish:
+                logger.info(f"{name} answered after {iteration} iteration(s), {tokens_used} tokens")
+                return agent.messages
+            if iteration < max_iterations:
+                # Truncated answer, or an agent that must call finish: ask for the next step
+                agent.messages.append({"role": "user", "content": continue_prompt})
+
+        if token_budget is not None and tokens_used >= token_budget:
+            logger.warning(f"{name} stopped at its token budget ({tokens_used}/{token_budget} tokens)")
+            return agent.messages
+
+    logger.warning(f"{name} reached maximum iterations ({max_iterations})")
+    return agent.messages
@@ -0,0 +1,192 @@
+"""
+Agent Metrics
+
+This module provides Prometheus instrumentation for the agent mesh.
+It covers the "Monitoring Points" listed in NATS_ARCHITECTURE.md: messages
+sent and received, request/response latency, LLM and tool latency, error
+rates and queued/in-flight work.
+
+All metrics are labelled by agent name so several agents can share one
+process (and one /metrics endpoint).
+"""
+
+import time
+import logging
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# Buckets sized for the latency ranges in NATS_ARCHITECTURE.md
+# (NATS hops ~1ms, tools 10-1000ms, LLM inference 100-5000ms+)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+MESSAGES_PUBLISHED = Counter(
+    "agent_messages_published_total",
+    "NATS messages published by an agent",
+    ["agent", "message_type"],
+)
+MESSAGES_RECEIVED = Counter(
+    "agent_messages_received_total",
+    "NATS messages received by an agent",
+    ["agent", "message_type"],
+)
+MESSAGES_DROPPED = Counter(
+    "agent_messages_dropped_total",
+    "Messages dropped from headers alone, without decoding the body",
+    ["agent", "reason"],
+)
+PAYLOAD_BYTES = Counter(
+    "agent_payload_bytes_total",
+    "Bytes of large message content moved through the payload store",
+    ["agent", "op"],  # stored, deduplicated, fetched
+)
+REQUESTS = Counter(
+    "agent_requests_total",
+    "request_from_agent round-trips per target agent, by status",
+    ["agent", "target", "status"],  # ok, timeout, error, no_responders, failover
+)
+REQUEST_LATENCY = Histogram(
+    "agent_request_latency_seconds",
+    "Latency of request_from_agent calls per target agent",
+    ["agent", "target", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+PEER_DETECTION_TIME = Histogram(
+    "agent_peer_failure_detection_seconds",
+    "Time from a peer's last heartbeat until it was suspected dead",
+    ["agent", "peer"],
+    buckets=LATENCY_BUCKETS,
+)
+FAILOVERS = Counter(
+    "agent_request_failovers_total",
+    "Pending or new requests to a dead peer, rerouted or failed fast",
+    ["agent", "target", "outcome"],  # rerouted, failed_fast
+)
+HEDGED_REQUESTS = Counter(
+    "agent_hedged_requests_total",
+    "Duplicate requests sent to a second replica, and which copy answered first",
+    ["agent", "target", "outcome"],  # sent, won (the hedge answered first), lost, over_budget, no_target
+)
+LLM_LATENCY = Histogram(
+    "agent_llm_latency_seconds",
+    "Latency of LLM chat completion calls",
+    ["agent", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_FIRST_TOKEN = Histogram(
+    "agent_llm_time_to_first_token_seconds",
+    "Time from sending a streamed LLM request to its first content token",
+    ["agent", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_INFLIGHT = Gauge(
+    "agent_llm_inflight_requests",
+    "LLM requests in flight through the process-wide gateway, per backend",
+    ["backend"],
+)
+LLM_QUEUED = Gauge(
+    "agent_llm_queued_requests",
+    "LLM requests waiting for a concurrency slot in the gateway, per backend",
+    ["backend"],
+)
+LLM_RETRIES = Counter(
+    "agent_llm_retries_total",
+    "LLM requests retried by the gateway after a 429/5xx, timeout or connection error",
+    ["backend", "reason"],  # HTTP status, timeout, connection
+)
+LLM_TOKENS = Counter(
+    "agent_llm_tokens_total",
+    "Tokens consumed by LLM calls",
+    ["agent", "model", "kind"],
+)
+TOOL_LATENCY = Histogram(
+    "agent_tool_latency_seconds",
+    "Latency of tool executions",
+    ["agent", "tool"],
+    buckets=LATENCY_BUCKETS,
+)
+TOOL_CALLS = Counter(
+    "agent_tool_calls_total",
+    "Tool executions by outcome",
+    ["agent", "tool", "status"],  # ok, error, memoized (answered without executing)
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "agent_embedding_batch_size",
+    "Texts encoded per embedding forward pass",
+    ["agent"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+EMBEDDING_CACHE = Counter(
+    "agent_embedding_cache_total",
+    "Texts served from the embedding cache (or an identical in-flight text) vs encoded",
+    ["agent", "result"],  # hit, miss
+)
+PROMPT_PREFIX_TOKENS = Counter(
+    "agent_prompt_prefix_tokens_total",
+    "Estimated prompt tokens that repeat the start of the agent's previous prompt (KV-cache reusable) vs new",
+    ["agent", "kind"],  # reused, new
+)
+CONTEXT_PRUNED = Counter(
+    "agent_context_pruned_total",
+    "Old tool outputs and arguments pruned from an agent's context, by rule",
+    ["agent", "rule"],  # superseded, truncated, arguments
+)
+ERRORS = Counter(
+    "agent_errors_total",
+    "Errors raised while handling agent work",
+    ["agent", "where"],
+)
+INFLIGHT_WORK = Gauge(
+    "agent_inflight_work",
+    "Requests and kickoffs currently being processed by an agent",
+    ["agent"],
+)
+QUEUED_WORK = Gauge(
+    "agent_queued_messages",
+    "Messages delivered by NATS but not yet handled by an agent's subscriptions",
+    ["agent"],
+)
+
+_metrics_server_port: Optional[int] = None
+
+
+def start_metrics_server(port: int) -> None:
+    """Expose /metrics over HTTP. Safe to call once per agent; only the first call binds."""
+    global _metrics_server_port
+    if _metrics_server_port is not None:
+        if _metrics_server_port != port:
+            logger.warning(f"Metrics server already running on port {_metrics_server_port}, ignoring port {port}")
+        return
+    start_http_server(port)
+    _metrics_server_port = port
+    logger.info(f"Prometheus metrics exposed on :{port}/metrics")
+
+
+def record_completion(agent: str, model: str, started: float, completion: Any) -> None:
+    """Record latency and token usage for a chat completion started at `started` (perf_counter)"""
+    LLM_LATENCY.labels(agent, model).observe(time.perf_counter() - started)
+    usage = getattr(completion, "usage", None)
+    if usage is None and isinstance(completion, dict):
+        usage = completion.get("usage")
+    if usage is not None:
+        LLM_TOKENS.labels(agent, model, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+        LLM_TOKENS.labels(agent, model, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+@contextmanager
+def track_tool_call(agent: str, tool: str):
+    """Time a tool execution and count it as ok/error"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        TOOL_CALLS.labels(agent, tool, "error").inc()
+        raise
+    else:
+        TOOL_CALLS.labels(agent, tool, "ok").inc()
+    finally:
+        TOOL_LATENCY.labels(agent, tool).observe(time.perf_counter() - started)
@@ -0,0 +1,230 @@
+"""
+Agent Payloads
+
+Claim-check storage for large message content. Instead of pushing a chapter or
+CSV through a NATS subject, the sender stores the bytes once and sends only a
+reference in AgentMessage.metadata["payload_ref"]; the receiver fetches the
+content lazily, chunk by chunk, when it actually handles the message.
+
+- Blobs are content-addressed (sha256), so a payload handed to many agents is stored once
+- On a NATS server the blobs live in a JetStream Object Store bucket
+- With inproc:// URLs they live in a local in-memory store shared by the process
+- Blobs expire after a TTL (NATSConfig.payload_ttl), so the bucket doesn't grow
+  without bound; a duplicate put refreshes a blob that is past half its TTL
+- If JetStream is unavailable, the store says so at once for a backoff period
+  instead of every large message waiting out a JetStream API timeout
+
+A bucket created before payload_ttl was set keeps its old (unlimited) TTL;
+recreate it or update it with `nats object` to apply one.
+"""
+
+import re
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from nats.js import api
+from nats.js.errors import BucketNotFoundError, ObjectNotFoundError
+
+logger = logging.getLogger(__name__)
+
+
+PAYLOAD_METADATA_KEY = "payload_ref"
+
+UNAVAILABLE_BACKOFF = 5.0  # seconds before retrying JetStream after a failure, doubled per failure
+UNAVAILABLE_BACKOFF_MAX = 300.0
+
+
+class PayloadStoreUnavailable(Exception):
+    """The payload store can't be reached; send content inline"""
+
+
+@dataclass
+class PayloadRef:
+    """Reference to content stored out of band"""
+
+    digest: str  # sha256 hex of the encoded content
+    size: int
+    bucket: str
+    encoding: str = "utf-8"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'PayloadRef':
+        """Create from dictionary"""
+        return cls(**data)
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[Dict[str, Any]]) -> Optional['PayloadRef']:
+        """Read a payload reference from message metadata, if there is one"""
+        if not metadata or not isinstance(metadata.get(PAYLOAD_METADATA_KEY), dict):
+            return None
+        return cls.from_dict(metadata[PAYLOAD_METADATA_KEY])
+
+
+def content_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _age(mtime: Optional[str]) -> Optional[float]:
+    """Seconds since an object's mtime (RFC 3339, up to nanosecond precision), or None if unreadable"""
+    if not mtime:
+        return None
+    try:
+        stamp = datetime.fromisoformat(re.sub(r"(\.\d{6})\d+", r"\1", mtime).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if stamp.tzinfo is None:
+        stamp = stamp.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - stamp).total_seconds()
+
+
+class LocalPayloadStore:
+    """In-memory content-addressed store used with the in-process transport"""
+
+    def __init__(self, bucket: str, chunk_size: int, ttl: Optional[float] = None):
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self._blobs: Dict[str, Tuple[float, bytes]] = {}  # digest -> (stored at, data)
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        cutoff = time.monotonic() - self.ttl
+        for digest in [digest for digest, (stored_at, _) in self._blobs.items() if stored_at < cutoff]:
+            del self._blobs[digest]
+
+    async def put(self, data: bytes) -> Tuple[PayloadRef, bool]:
+        """Store a blob; returns (PayloadRef, stored) where stored is False for a duplicate"""
+        self._expire()
+        digest = content_digest(data)
+        stored = digest not in self._blobs
+        self._blobs[digest] = (time.monotonic(), data)
+        return PayloadRef(digest=digest, size=len(data), bucket=self.bucket), stored
+
+    async def iter_chunks(self, ref: PayloadRef) -> AsyncIterator[bytes]:
+        self._expire()
+        data = self._blobs.get(ref.digest, (None, None))[1]
+        if data is None:
+            raise KeyError(f"Payload {ref.digest} not found in bucket {ref.bucket}")
+        view = memoryview(data)
+        for offset in range(0, len(data), self.chunk_size):
+            yield bytes(view[offset:offset + self.chunk_size])
+
+
+class _ChunkWriter:
+    """File-like sink for ObjectStore.get that hands chunks to the event loop as they arrive"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self._loop = loop
+        self._queue = queue
+
+    def write(self, data: bytes):
+        # Called from an executor thread
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, bytes(data))
+        return len(data)
+
+
+class ObjectStorePayloadStore:
+    """Content-addressed store backed by a JetStream Object Store bucket"""
+
+    def __init__(self, nats_client, bucket: str, chunk_size: int, ttl: Optional[float] = None):
+        self.bucket = bucket
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self._js = nats_client.jetstream()
+        self._store = None
+        self._known: Dict[str, float] = {}  # digest -> when we last knew it was fresh in the bucket
+        self._lock = asyncio.Lock()
+        self._failures = 0
+        self._retry_at = 0.0  # while JetStream is unavailable, don't try again before this (monotonic)
+
+    async def _object_store(self):
+        async with self._lock:
+            if self._store is None:
+                if time.monotonic() < self._retry_at:
+                    raise PayloadStoreUnavailable(f"JetStream unavailable, retrying in {self._retry_at - time.monotonic():.0f}s")
+                try:
+                    try:
+                        self._store = await self._js.object_store(self.bucket)
+                    except BucketNotFoundError:
+                        self._store = await self._js.create_object_store(
+                            self.bucket,
+                            description="Large agent message payloads (claim check)",
+                            ttl=self.ttl,
+                        )
+                except Exception as error:
+                    self._failures += 1
+                    backoff = min(UNAVAILABLE_BACKOFF_MAX, UNAVAILABLE_BACKOFF * 2 ** (self._failures - 1))
+                    self._retry_at = time.monotonic() + backoff
+                    logger.warning(f"Payload bucket {self.bucket} unavailable, sending content inline "
+                                   f"for the next {backoff:.0f}s: {error}")
+                    raise PayloadStoreUnavailable(str(error)) from error
+                self._failures = 0
+            return self._store
+
+    def _fresh(self, digest: str) -> bool:
+        """Whether we know the blob is stored and has at least half its TTL left"""
+        known_at = self._known.get(digest)
+        return known_at is not None and (self.ttl is None or time.monotonic() - known_at < self.ttl / 2)
+
+    async def put(self, data: bytes) -> Tuple[PayloadRef, bool]:
+        """Store a blob unless a fresh blob with the same digest already exists"""
+        store = await self._object_store()
+        digest = content_digest(data)
+        ref = PayloadRef(digest=digest, size=len(data), bucket=self.bucket)
+        if self._fresh(digest):
+            return ref, False
+        try:
+            info = await store.get_info(digest)
+            age = _age(info.mtime)
+            # Re-storing restarts the TTL, so receivers of this message can still fetch it
+            stale = self.ttl is not None and (age is None or age > self.ttl / 2)
+        except ObjectNotFoundError:
+            stale = True
+        if stale:
+            meta = api.ObjectMeta(
+                name=digest,
+                options=api.ObjectMetaOptions(max_chunk_size=self.chunk_size),
+            )
+            await store.put(digest, data, meta=meta)
+            age = 0.0
+        self._known[digest] = time.monotonic() - (age or 0.0)
+        return ref, stale
+
+    async def iter_chunks(self, ref: PayloadRef) -> AsyncIterator[bytes]:
+        store = await self._object_store()
+        queue: asyncio.Queue = asyncio.Queue()
+        writer = _ChunkWriter(asyncio.get_running_loop(), queue)
+        fetch = asyncio.create_task(store.get(ref.digest, writeinto=writer))
+        fetch.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+            # Surfaces ObjectNotFoundError / DigestMismatchError
+            await fetch
+        finally:
+            if not fetch.done():
+                fetch.cancel()
+
+
+_local_stores: Dict[str, LocalPayloadStore] = {}
+
+
+def get_local_store(url: str, bucket: str, chunk_size: int, ttl: Optional[float] = None) -> LocalPayloadStore:
+    """Get (or create) the local store shared by every agent on an inproc:// URL"""
+    key = f"{url}#{bucket}"
+    if key not in _local_stores:
+        _local_stores[key] = LocalPayloadStore(bucket, chunk_size, ttl)
+    return _local_stores[key]
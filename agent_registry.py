@@ -0,0 +1,173 @@
+"""
+Agent Registry
+
+Tracks peer agents from their announcements and heartbeats, and decides when a
+peer should be considered dead using a phi-accrual failure detector
+(Hayashibara et al.). Instead of a fixed "no heartbeat for N seconds" rule,
+phi measures how unlikely the current silence is given the heartbeat
+inter-arrival times seen so far, so it adapts to the configured interval and
+to jitter on the network.
+
+Common thresholds: phi 1 ~ 10% chance the peer is merely late, phi 8 ~ 1e-8.
+"""
+
+import math
+import time
+import statistics
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from nats_config import AgentMetadata
+
+
+class PhiAccrualDetector:
+    """Phi-accrual failure detector for one peer's heartbeat stream"""
+
+    def __init__(self, expected_interval: float, window: int = 100, min_std: Optional[float] = None,
+                 acceptable_pause: float = 0.0):
+        self.expected_interval = expected_interval
+        self.min_std = min_std if min_std is not None else expected_interval * 0.1
+        self.acceptable_pause = acceptable_pause
+        # Seed with the expected interval so the first missed heartbeat is already suspicious
+        self.intervals = deque([expected_interval], maxlen=window)
+        self.last_heartbeat: Optional[float] = None
+
+    def heartbeat(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        if self.last_heartbeat is not None:
+            self.intervals.append(now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def phi(self, now: Optional[float] = None) -> float:
+        """Suspicion level; grows without bound as the silence gets longer"""
+        if self.last_heartbeat is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        elapsed = now - self.last_heartbeat
+        mean = statistics.fmean(self.intervals) + self.acceptable_pause
+        std = max(statistics.pstdev(self.intervals), self.min_std)
+
+        # Logistic approximation of the normal CDF (as used by Akka/Cassandra)
+        y = (elapsed - mean) / std
+        exponent = -y * (1.5976 + 0.070566 * y * y)
+        if exponent > 700:
+            return 0.0  # far sooner than expected; exp() would overflow
+        e = math.exp(exponent)
+        if elapsed > mean:
+            # After a long silence e underflows to 0: certainly dead
+            return -math.log10(e / (1.0 + e)) if e > 0 else math.inf
+        return -math.log10(1.0 - 1.0 / (1.0 + e))
+
+
+@dataclass
+class PeerState:
+    """What we know about one instance of a peer"""
+
+    metadata: AgentMetadata
+    detector: PhiAccrualDetector
+    suspected: bool = False
+    offline: bool = False
+
+    @property
+    def available(self) -> bool:
+        return not self.down and self.metadata.status == "available"
+
+    @property
+    def down(self) -> bool:
+        return self.suspected or self.offline
+
+
+@dataclass
+class PeerRegistry:
+    """
+    Live view of the other agents on the mesh.
+
+    Replicas of an agent share its name (and queue group), so each instance is
+    tracked separately: a name is down only once all of its instances are, and
+    available while any of them is.
+    """
+
+    heartbeat_interval: float = 5.0
+    phi_threshold: float = 8.0
+    peers: Dict[str, Dict[str, PeerState]] = field(default_factory=dict)  # name -> instance id -> state
+
+    def observe(self, metadata: AgentMetadata, now: Optional[float] = None):
+        """Record an announcement or heartbeat from a peer instance"""
+        instances = self.peers.setdefault(metadata.name, {})
+        peer = instances.get(metadata.instance_id)
+        if peer is None:
+            peer = PeerState(metadata=metadata, detector=PhiAccrualDetector(self.heartbeat_interval))
+            instances[metadata.instance_id] = peer
+        peer.metadata = metadata
+        peer.detector.heartbeat(now)
+        peer.suspected = False
+        peer.offline = metadata.status == "offline"
+        self._forget_down(metadata.name)
+
+    def mark_offline(self, name: str, instance_id: Optional[str] = None):
+        """A peer instance announced it is going away; without an instance id, all of them"""
+        for key, peer in self.peers.get(name, {}).items():
+            if instance_id is None or key == instance_id:
+                peer.offline = True
+        self._forget_down(name)
+
+    def _forget_down(self, name: str):
+        # Replaced replicas come back with a new instance id; keep the last one so the name stays known
+        instances = self.peers.get(name, {})
+        if any(not peer.down for peer in instances.values()):
+            for key in [key for key, peer in instances.items() if peer.down]:
+                del instances[key]
+
+    def check(self, now: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        Re-evaluate every peer instance.
+
+        Returns (name, seconds since its last heartbeat) for peers whose last
+        live instance became suspected in this check.
+        """
+        now = time.monotonic() if now is None else now
+        newly_down = []
+        for name, instances in self.peers.items():
+            newly_suspected = []
+            for peer in instances.values():
+                if not peer.down and peer.detector.phi(now) >= self.phi_threshold:
+                    peer.suspected = True
+                    newly_suspected.append(peer)
+            if newly_suspected and self.is_down(name):
+                last_heartbeat = max(peer.detector.last_heartbeat for peer in newly_suspected)
+                newly_down.append((name, now - last_heartbeat))
+        return newly_down
+
+    def is_available(self, name: str) -> bool:
+        """False if every instance of the peer is dead, offline or draining; unknown peers get the benefit of the doubt"""
+        instances = self.peers.get(name)
+        return not instances or any(peer.available for peer in instances.values())
+
+    def available_instances(self, name: str) -> List[str]:
+        """Instance ids of the peer's available replicas (agents without instance ids aren't addressable)"""
+        return [key for key, peer in self.peers.get(name, {}).items() if key and peer.available]
+
+    def is_down(self, name: str) -> bool:
+        """True if every instance of the peer is suspected dead or announced it went offline"""
+        instances = self.peers.get(name)
+        return bool(instances) and all(peer.down for peer in instances.values())
+
+    def _capabilities(self, name: str) -> set:
+        return {capability for peer in self.peers.get(name, {}).values() for capability in peer.metadata.capabilities}
+
+    def find_alternative(self, name: str, exclude: Iterable[str] = ()) -> Optional[str]:
+        """An available peer sharing a capability with `name`, preferring the most overlap"""
+        wanted = self._capabilities(name)
+        if not wanted:
+            return None
+        excluded = set(exclude) | {name}
+        candidates = [
+            (len(wanted & self._capabilities(other_name)), other_name)
+            for other_name in self.peers
+            if other_name not in excluded and self.is_available(other_name)
+        ]
+        candidates = [c for c in candidates if c[0] > 0]
+        if not candidates:
+            return None
+        return max(candidates)[1]
@@ -0,0 +1,361 @@
+"""
+Agent Mesh Simulator
+
+Discrete-event simulation of the agent mesh for tuning settings without a live LLM.
+
+The real NATSAgentMixin code (queue groups, request/reply, hedging, failure
+detection) runs on the in-process transport inside an asyncio event loop
+whose clock is virtual: whenever every task is waiting on a timer, the clock
+jumps straight to the next timer instead of sleeping. Agent work is modelled
+as LLM calls (contending for a shared LLM server's slots) and tool calls
+drawn from latency distributions, so hours of synthetic traffic run in seconds,
+and the same seed always gives the same result.
+
+Usage:
+    python agent_simulator.py --duration 3600 --rps 1.5 --replicas 1,2,4 --hedge off,on
+    python agent_simulator.py --llm-median 0.8 --llm-p95 5 --llm-slots 2 --output sim.json
+
+Wall-clock features are not modelled: AgentMessage deadlines (epoch time) and
+tracing timestamps still use real time.
+"""
+
+import sys
+import json
+import math
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+import selectors
+import statistics
+import uuid
+from dataclasses import dataclass, asdict
+from typing import Any, Dict, List, Optional
+
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+logger = logging.getLogger(__name__)
+
+
+class _VirtualClockSelector(selectors.DefaultSelector):
+    """Selector that advances the loop's virtual clock instead of blocking on timers"""
+
+    def __init__(self):
+        super().__init__()
+        self.loop: Optional["VirtualClockLoop"] = None
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            # No timers pending: only real I/O or another thread can wake the loop
+            return super().select(None)
+        self.loop.advance(timeout)
+        return []
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time() is a virtual clock that jumps to the next timer"""
+
+    def __init__(self, start: float = 0.0):
+        selector = _VirtualClockSelector()
+        super().__init__(selector)
+        selector.loop = self
+        self._now = start
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float):
+        self._now += seconds
+
+
+@dataclass
+class Latency:
+    """
+    A latency distribution in seconds.
+
+    "lognormal" is fitted to a median and p95 (LLM calls have a long tail),
+    "exponential" uses the median as its mean, "constant" always returns the median.
+    """
+
+    median: float
+    p95: Optional[float] = None
+    kind: str = "lognormal"
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "constant":
+            return self.median
+        if self.kind == "exponential":
+            return rng.expovariate(1.0 / self.median)
+        sigma = math.log((self.p95 or self.median * 3) / self.median) / 1.645
+        return rng.lognormvariate(math.log(self.median), sigma)
+
+
+@dataclass
+class AgentProfile:
+    """How one kind of agent spends its time per request"""
+
+    name: str
+    llm: Latency
+    tool: Latency
+    llm_calls: int = 2  # LLM round-trips per request (e.g. act, then answer)
+    tool_calls: int = 1  # tool calls after each LLM call except the last
+    weight: float = 1.0  # share of the traffic
+
+
+@dataclass
+class Policy:
+    """Settings under test"""
+
+    replicas: int = 1
+    hedge: bool = False
+    hedge_budget: float = 0.05
+    hedge_percentile: float = 95.0
+
+    @property
+    def label(self) -> str:
+        hedge = f"hedge {self.hedge_budget:.0%}@p{self.hedge_percentile:g}" if self.hedge else "no hedge"
+        return f"replicas={self.replicas}, {hedge}"
+
+
+@dataclass
+class Scenario:
+    """Workload and environment"""
+
+    agents: List[AgentProfile]
+    rps: float = 0.2
+    duration: float = 3600.0  # virtual seconds of traffic
+    llm_slots: int = 4  # concurrent generations the shared LLM server handles
+    timeout: float = 300.0
+
+
+class LLMServer:
+    """A shared inference server with a fixed number of generation slots"""
+
+    def __init__(self, slots: int):
+        self.slots = asyncio.Semaphore(slots)
+        self.capacity = slots
+        self.busy_time = 0.0
+        self.waits: List[float] = []
+
+
+class SimulatedAgent(NATSAgentMixin):
+    """A mesh agent whose work is simulated time instead of real LLM/tool calls"""
+
+    def __init__(self, profile: AgentProfile, server: LLMServer, rng: random.Random, stats: Dict[str, Any],
+                 nats_config: NATSConfig):
+        self.name = profile.name
+        self.tools = []
+        self.profile = profile
+        self.server = server
+        self.rng = rng
+        self.stats = stats
+        super().__init__(nats_config=nats_config)
+
+    def run(self, kickoff_message):
+        raise RuntimeError("SimulatedAgent only runs inside the simulator's event loop")
+
+    async def _run_agent(self, content: str) -> str:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        sent_at = self.stats["sent_at"].get(content)
+        if sent_at is not None:
+            self.stats["queue_delays"].append(started - sent_at)
+
+        for call in range(self.profile.llm_calls):
+            waiting = loop.time()
+            async with self.server.slots:
+                self.server.waits.append(loop.time() - waiting)
+                generation = self.profile.llm.sample(self.rng)
+                await asyncio.sleep(generation)
+                self.server.busy_time += generation
+            if call < self.profile.llm_calls - 1:
+                for _ in range(self.profile.tool_calls):
+                    await asyncio.sleep(self.profile.tool.sample(self.rng))
+
+        self.stats["busy"][self.profile.name] = self.stats["busy"].get(self.profile.name, 0.0) + loop.time() - started
+        return "done"
+
+
+def _summary(values: List[float]) -> Dict[str, Optional[float]]:
+    def pct(p: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered), max(1, math.ceil(p / 100 * len(ordered)))) - 1], 4)
+    return {
+        "p50": pct(50),
+        "p95": pct(95),
+        "p99": pct(99),
+        "mean": round(statistics.fmean(values), 4) if values else None,
+    }
+
+
+async def _simulate(scenario: Scenario, policy: Policy, seed: int) -> Dict[str, Any]:
+    loop = asyncio.get_running_loop()
+    rng = random.Random(seed)  # arrivals and targets, identical across policies
+    service_rng = random.Random(seed + 1)  # LLM and tool latencies
+    random.seed(seed)  # queue group member selection in the in-process broker
+
+    cfg = NATSConfig(
+        nats_url=f"inproc://sim-{uuid.UUID(int=rng.getrandbits(128)).hex}",
+        metrics_port=None,
+        hedge_requests=policy.hedge,
+        hedge_budget=policy.hedge_budget,
+        hedge_percentile=policy.hedge_percentile,
+    )
+    server = LLMServer(scenario.llm_slots)
+    stats: Dict[str, Any] = {"sent_at": {}, "queue_delays": [], "busy": {}}
+
+    agents = [
+        SimulatedAgent(profile, server, service_rng, stats, nats_config=cfg)
+        for profile in scenario.agents
+        for _ in range(policy.replicas)
+    ]
+    for agent in agents:
+        await agent.connect_nats(capabilities=[agent.profile.name], description="Simulated agent")
+    client = SimulatedAgent(AgentProfile("Sim-Client", Latency(0), Latency(0)), server, service_rng, stats,
+                            nats_config=cfg)
+    await client.connect_nats(capabilities=["load_generation"], description="Simulated traffic")
+
+    latencies: List[float] = []
+    outcomes = {"sent": 0, "ok": 0, "failed": 0}
+    targets = [profile.name for profile in scenario.agents]
+    weights = [profile.weight for profile in scenario.agents]
+    counter = itertools.count()
+
+    async def one_request():
+        request_id = f"req-{next(counter)}"
+        target = rng.choices(targets, weights)[0]
+        sent = loop.time()
+        stats["sent_at"][request_id] = sent
+        outcomes["sent"] += 1
+        response = await client.request_from_agent(target, request_id, timeout=scenario.timeout)
+        if response is None:
+            outcomes["failed"] += 1
+        else:
+            outcomes["ok"] += 1
+            latencies.append(loop.time() - sent)
+        stats["sent_at"].pop(request_id, None)
+
+    start = loop.time()
+    end = start + scenario.duration
+    in_flight = set()
+    while True:
+        await asyncio.sleep(rng.expovariate(scenario.rps))
+        if loop.time() >= end:
+            break
+        task = asyncio.create_task(one_request())
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.wait(in_flight)
+    elapsed = loop.time() - start
+
+    hedges = client._hedge_counts["hedges"]
+    for agent in agents + [client]:
+        await agent.disconnect_nats(drain=False)
+
+    return {
+        "policy": asdict(policy),
+        "label": policy.label,
+        "requests": outcomes,
+        "virtual_seconds": round(elapsed, 1),
+        "throughput_rps": round(outcomes["ok"] / elapsed, 4) if elapsed else 0.0,
+        "latency_s": _summary(latencies),
+        "queueing_delay_s": _summary(stats["queue_delays"]),
+        "llm_wait_s": _summary(server.waits),
+        "utilization": {
+            "llm_server": round(server.busy_time / (server.capacity * elapsed), 4) if elapsed else 0.0,
+            **{
+                name: round(stats["busy"].get(name, 0.0) / (policy.replicas * elapsed), 4) if elapsed else 0.0
+                for name in targets
+            },
+        },
+        "hedges_sent": int(hedges),
+    }
+
+
+def simulate(scenario: Scenario, policy: Policy, seed: int = 0) -> Dict[str, Any]:
+    """Run one policy against a scenario on a fresh virtual-clock loop"""
+    with asyncio.Runner(loop_factory=VirtualClockLoop) as runner:
+        return runner.run(_simulate(scenario, policy, seed))
+
+
+def compare_policies(scenario: Scenario, policies: List[Policy], seed: int = 0) -> List[Dict[str, Any]]:
+    """Simulate every policy with the same seed (same arrivals and latencies per request order)"""
+    return [simulate(scenario, policy, seed) for policy in policies]
+
+
+def render_table(results: List[Dict[str, Any]]) -> str:
+    header = f"{'policy':<36}{'thru/s':>8}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'queue p95':>11}{'llm util':>10}{'hedges':>8}"
+    lines = [header, "-" * len(header)]
+    fmt = lambda v: "-" if v is None else f"{v:.2f}"
+    for r in results:
+        lines.append(
+            f"{r['label']:<36}{r['throughput_rps']:>8.3f}{fmt(r['latency_s']['p50']):>8}"
+            f"{fmt(r['latency_s']['p95']):>8}{fmt(r['latency_s']['p99']):>8}"
+            f"{fmt(r['queueing_delay_s']['p95']):>11}{r['utilization']['llm_server']:>10.1%}{r['hedges_sent']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Simulate the agent mesh on a virtual clock")
+    parser.add_argument("--duration", type=float, default=3600.0, help="Virtual seconds of traffic")
+    parser.add_argument("--rps", type=float, default=0.2, help="Mean request arrival rate (Poisson)")
+    parser.add_argument("--agents", default="Weather-Bot,Trip-Planner", help="Comma-separated agent names")
+    parser.add_argument("--llm-median", type=float, default=1.0, help="Median LLM call latency (s)")
+    parser.add_argument("--llm-p95", type=float, default=3.0, help="p95 LLM call latency (s)")
+    parser.add_argument("--llm-calls", type=int, default=2, help="LLM calls per request")
+    parser.add_argument("--llm-slots", type=int, default=4, help="Concurrent generations on the LLM server")
+    parser.add_argument("--tool-median", type=float, default=0.1, help="Median tool call latency (s)")
+    parser.add_argument("--tool-p95", type=float, default=1.0, help="p95 tool call latency (s)")
+    parser.add_argument("--replicas", default="1,2", help="Replica counts to compare, e.g. 1,2,4")
+    parser.add_argument("--hedge", default="off,on", help="Hedging settings to compare: off,on")
+    parser.add_argument("--hedge-budget", type=float, default=0.05)
+    parser.add_argument("--hedge-percentile", type=float, default=95.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results to this file")
+    args = parser.parse_args(argv)
+
+    # Timeouts and failures are counted in the results instead of logged per request
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("nats_agent_mixin").setLevel(logging.ERROR)
+
+    scenario = Scenario(
+        agents=[
+            AgentProfile(
+                name=name.strip(),
+                llm=Latency(args.llm_median, args.llm_p95),
+                tool=Latency(args.tool_median, args.tool_p95),
+                llm_calls=args.llm_calls,
+            )
+            for name in args.agents.split(",") if name.strip()
+        ],
+        rps=args.rps,
+        duration=args.duration,
+        llm_slots=args.llm_slots,
+    )
+    policies = [
+        Policy(replicas=int(replicas), hedge=hedge == "on", hedge_budget=args.hedge_budget,
+               hedge_percentile=args.hedge_percentile)
+        for replicas in args.replicas.split(",")
+        for hedge in args.hedge.split(",")
+    ]
+
+    results = compare_policies(scenario, policies, seed=args.seed)
+    print(render_table(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"scenario": asdict(scenario), "seed": args.seed, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
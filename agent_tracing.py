@@ -0,0 +1,243 @@
+"""
+Agent Tracing
+
+Lightweight distributed tracing for the agent mesh. A trace follows one user
+request as it fans out into LLM calls, tool calls and NATS hops to other agents.
+
+- Trace context (trace_id + parent span_id) travels in AgentMessage.metadata["trace"]
+- Spans are written as one JSON object per line to AGENT_TRACE_FILE (disabled when unset)
+- Run this module as a script to render a per-request waterfall:
+
+    python agent_tracing.py traces.jsonl                 # list recent traces
+    python agent_tracing.py traces.jsonl --trace <id>    # waterfall for one trace
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+
+TRACE_METADATA_KEY = "trace"
+
+
+@dataclass
+class Span:
+    """A timed operation within a trace"""
+
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: Optional[str] = None
+    agent: Optional[str] = None
+    start: float = field(default_factory=time.time)
+    end: Optional[float] = None
+    status: str = "ok"
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to dictionary for JSON serialization"""
+        data = asdict(self)
+        data["duration_ms"] = round(((self.end or time.time()) - self.start) * 1000, 3)
+        return data
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("agent_current_span", default=None)
+
+
+class Tracer:
+    """Creates spans, tracks the active span per task/thread and writes finished spans to a JSONL sink"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    @contextmanager
+    def span(self, name: str, agent: Optional[str] = None, parent: Optional[Dict[str, str]] = None, **attributes):
+        """
+        Open a span as a child of the current span (or of `parent`, a propagated trace context).
+
+        A new trace is started when there is neither.
+        """
+        current = _current_span.get()
+        trace_id, parent_id = self._resolve_parent(parent)
+        span = Span(
+            name=name,
+            trace_id=trace_id,
+            parent_id=parent_id,
+            agent=agent or (current.agent if current else None),
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.status = "error"
+            span.attributes["error"] = str(error) or type(error).__name__
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end = time.time()
+            self.export(span)
+
+    def record(self, name: str, start: float, end: float, agent: Optional[str] = None,
+               parent: Optional[Dict[str, str]] = None, **attributes) -> Span:
+        """Record an already-finished span, e.g. time a message spent queued before handling"""
+        trace_id, parent_id = self._resolve_parent(parent)
+        span = Span(name=name, trace_id=trace_id, parent_id=parent_id, agent=agent,
+                    start=start, end=end, attributes=attributes)
+        self.export(span)
+        return span
+
+    def _resolve_parent(self, parent: Optional[Dict[str, str]]):
+        """Pick (trace_id, parent_span_id) from an explicit context, the current span, or a new trace"""
+        current = _current_span.get()
+        if parent:
+            return parent.get("trace_id"), parent.get("span_id")
+        if current:
+            return current.trace_id, current.span_id
+        return uuid.uuid4().hex, None
+
+    def export(self, span: Span):
+        """Append a finished span to the JSONL sink"""
+        if not self.path:
+            return
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def inject(self, metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """Add the current trace context to outgoing message metadata"""
+        current = _current_span.get()
+        if current:
+            metadata[TRACE_METADATA_KEY] = {"trace_id": current.trace_id, "span_id": current.span_id}
+        return metadata
+
+    @staticmethod
+    def extract(metadata: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+        """Read a propagated trace context from incoming message metadata"""
+        if not metadata:
+            return None
+        context = metadata.get(TRACE_METADATA_KEY)
+        if isinstance(context, dict) and context.get("trace_id"):
+            return context
+        return None
+
+
+def message_sent_at(timestamp: str) -> Optional[float]:
+    """Convert an AgentMessage timestamp (naive UTC isoformat) to epoch seconds"""
+    try:
+        return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+# Global tracer instance
+tracer = Tracer(path=os.getenv("AGENT_TRACE_FILE"))
+
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    """Load spans from a JSONL trace file, skipping malformed lines"""
+    spans = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return spans
+
+
+def render_waterfall(spans: List[Dict[str, Any]], width: int = 50) -> str:
+    """Render the spans of one trace as an indented text waterfall"""
+    if not spans:
+        return "No spans."
+
+    trace_start = min(s["start"] for s in spans)
+    trace_end = max(s["end"] or s["start"] for s in spans)
+    total = max(trace_end - trace_start, 1e-9)
+
+    by_parent: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    span_ids = {s["span_id"] for s in spans}
+    for s in spans:
+        # Spans whose parent was never exported (e.g. lives in another trace file) are shown as roots
+        parent = s["parent_id"] if s["parent_id"] in span_ids else None
+        by_parent.setdefault(parent, []).append(s)
+    for children in by_parent.values():
+        children.sort(key=lambda s: s["start"])
+
+    lines = [f"trace {spans[0]['trace_id']}  total {total * 1000:.1f} ms"]
+
+    def walk(parent_id: Optional[str], depth: int):
+        for s in by_parent.get(parent_id, []):
+            offset = s["start"] - trace_start
+            duration = (s["end"] or s["start"]) - s["start"]
+            bar_start = int(offset / total * width)
+            bar_len = max(1, int(duration / total * width))
+            bar = " " * bar_start + "#" * min(bar_len, width - bar_start)
+            label = f"{'  ' * depth}{s['name']}"
+            if s.get("agent"):
+                label += f" [{s['agent']}]"
+            if s.get("status") != "ok":
+                label += f" !{s['status']}"
+            lines.append(f"{offset * 1000:9.1f}ms {duration * 1000:9.1f}ms |{bar:<{width}}| {label}")
+            walk(s["span_id"], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Render agent traces as a waterfall")
+    parser.add_argument("trace_file", help="JSONL file written via AGENT_TRACE_FILE")
+    parser.add_argument("--trace", help="Trace ID to render (default: list traces)")
+    parser.add_argument("--limit", type=int, default=20, help="Number of traces to list")
+    args = parser.parse_args(argv)
+
+    spans = load_spans(args.trace_file)
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        traces.setdefault(s["trace_id"], []).append(s)
+
+    if args.trace:
+        matches = [t for t in traces if t.startswith(args.trace)]
+        if not matches:
+            print(f"Trace '{args.trace}' not found")
+            return 1
+        print(render_waterfall(traces[matches[0]]))
+        return 0
+
+    summaries = []
+    for trace_id, trace_spans in traces.items():
+        start = min(s["start"] for s in trace_spans)
+        end = max(s["end"] or s["start"] for s in trace_spans)
+        roots = [s for s in trace_spans if s["parent_id"] is None] or trace_spans
+        summaries.append((start, trace_id, (end - start) * 1000, len(trace_spans), roots[0]["name"]))
+
+    for start, trace_id, duration_ms, count, root in sorted(summaries, reverse=True)[:args.limit]:
+        when = datetime.fromtimestamp(start).strftime("%H:%M:%S")
+        print(f"{when}  {trace_id}  {duration_ms:9.1f} ms  {count:4d} spans  {root}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
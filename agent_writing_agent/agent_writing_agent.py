@@ -6,9 +6,14 @@ import subprocess
 import re
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
+from typing import Dict, List, Any, Literal, Optional
 from tavily import TavilyClient
+from agent_loop import FINISH_TOOL, assistant_message, run_until_done
+from llm_gateway import llm_client
+from context_pruning import PruningPolicy, prune_tool_outputs
+from conversation import Conversation, PrefixReuse
+from rolling_summary import RollingSummarizer, openai_summarizer
+from tool_registry import ToolRegistry, tool
 try:
     from .config import AgentWritingConfig, AGENT_TEMPLATES
 except ImportError:
@@ -148,8 +153,8 @@ You can create custom agents by combining and modifying these templates based on
 Please generate tool calls as needed to research, design, and implement agents. Remember to respect all security constraints.
 """
         
-        # Initialize OpenAI client
-        self.client = OpenAI(
+        # OpenAI-compatible client from the process-wide gateway (pooled connections, retries)
+        self.client = llm_client(
             base_url=AgentWritingConfig.OPENAI_BASE_URL,
             api_key=AgentWritingConfig.OPENAI_API_KEY
         )
@@ -163,157 +168,22 @@ Please generate tool calls as needed to research, design, and implement agents.
             logger.warning("TAVILY_API_KEY not found in environment variables")
         
         # Initialize messages with system prompt
-        self.messages = [
-            {"role": "system", "content": self.instructions}
-        ]
+        self.messages = Conversation(self.instructions)
+        self.prefix_reuse = PrefixReuse(self.name)
         
-        # Define tools
-        self.tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "web_search",
-                    "description": "Search the web for information using Tavily API",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The search query to find information about"
-                            },
-                            "max_results": {
-                                "type": "integer",
-                                "description": "Maximum number of search results to return (default: 5)"
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_url",
-                    "description": "Fetch the contents of a URL",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "url": {
-                                "type": "string",
-                                "description": "The URL to fetch"
-                            }
-                        },
-                        "required": ["url"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "read_file",
-                    "description": "Read the contents of a file. SECURITY: File must be within the working directory. Paths with '..' or absolute paths outside working directory will be rejected.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "The name of the file to read (relative to working directory)"
-                            }
-                        },
-                        "required": ["filename"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "write_file",
-                    "description": "Write content to a file. SECURITY: File must be within the working directory. Paths with '..' or absolute paths outside working directory will be rejected.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "The name of the file to write to (relative to working directory)"
-                            },
-                            "content": {
-                                "type": "string",
-                                "description": "The content to write to the file"
-                            }
-                        },
-                        "required": ["filename", "content"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "list_files",
-                    "description": "List all files in the working directory",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "run_terminal_command",
-                    "description": "Execute a terminal command. SECURITY: Dangerous commands (rm -rf, mkfs, dd, shutdown, etc.) are BLOCKED. For pip install, use virtual environment: source venv/bin/activate && pip install <package>. Working directory must be within workspace.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "command": {
-                                "type": "string",
-                                "description": "The terminal command to execute. For pip: use 'source venv/bin/activate && pip install <package>'"
-                            },
-                            "working_directory": {
-                                "type": "string",
-                                "description": "Optional working directory (must be within workspace, defaults to agent's working directory)"
-                            }
-                        },
-                        "required": ["command"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "create_agent",
-                    "description": "Create a new AI agent based on specifications",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "agent_name": {
-                                "type": "string",
-                                "description": "Name of the agent to create"
-                            },
-                            "agent_description": {
-                                "type": "string",
-                                "description": "Description of what the agent should do"
-                            },
-                            "template_type": {
-                                "type": "string",
-                                "enum": ["basic_agent", "web_enabled_agent"],
-                                "description": "Type of agent template to use"
-                            },
-                            "tools": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "List of tools the agent should have"
-                            },
-                            "instructions": {
-                                "type": "string",
-                                "description": "Detailed instructions for the agent's behavior"
-                            }
-                        },
-                        "required": ["agent_name", "agent_description", "template_type", "instructions"]
-                    }
-                }
-            }
-        ]
+        # Old tool output is pruned by rule first, then the oldest turns are summarized in the
+        # background; consolidate_context() remains the backstop
+        self.pruning_policy = PruningPolicy(threshold_tokens=AgentWritingConfig.PRUNE_THRESHOLD)
+        self.summarizer = RollingSummarizer(
+            openai_summarizer(self.client, self.model, agent=self.name),
+            threshold_tokens=AgentWritingConfig.ROLLING_SUMMARY_THRESHOLD,
+            name=self.name,
+        )
+        
+        # Tool schemas are generated from the @tool methods below
+        self.registry = ToolRegistry.from_object(self)
+        self.registry.register(lambda summary: "Task marked complete.", schema=FINISH_TOOL)
+        self.tools = self.registry.schemas
 
     def _setup_virtual_environment(self):
         """Set up a Python virtual environment for isolated package installation"""
@@ -382,8 +252,15 @@ Please generate tool calls as needed to research, design, and implement agents.
 
         return True, ""
 
+    @tool
     def web_search(self, query: str, max_results: int = 5) -> str:
-        """Perform web search using Tavily API"""
+        """
+        Search the web for information using Tavily API
+
+        Args:
+            query: The search query to find information about
+            max_results: Maximum number of search results to return (default: 5)
+        """
         if not self.tavily_client:
             return "Error: Tavily API client not initialized. Please set TAVILY_API_KEY environment variable."
 
@@ -408,8 +285,14 @@ Please generate tool calls as needed to research, design, and implement agents.
             logger.error(f"Web search error: {e}")
             return f"Error performing web search: {str(e)}"
 
+    @tool
     def fetch_url(self, url: str) -> str:
-        """Fetch the contents of a URL"""
+        """
+        Fetch the contents of a URL
+
+        Args:
+            url: The URL to fetch
+        """
         try:
             response = requests.get(url, timeout=30)
             response.raise_for_status()
@@ -418,8 +301,15 @@ Please generate tool calls as needed to research, design, and implement agents.
             logger.error(f"URL fetch error: {e}")
             return f"Error fetching URL: {str(e)}"
 
+    @tool
     def read_file(self, filename: str) -> str:
-        """Read file from working directory with path validation"""
+        """
+        Read the contents of a file. SECURITY: File must be within the working directory.
+        Paths with '..' or absolute paths outside working directory will be rejected.
+
+        Args:
+            filename: The name of the file to read (relative to working directory)
+        """
         try:
             # Validate path is within working directory
             file_path = self._validate_path(filename)
@@ -435,8 +325,16 @@ Please generate tool calls as needed to research, design, and implement agents.
             logger.error(f"File read error: {e}")
             return f"Error reading file '{filename}': {str(e)}"
 
+    @tool
     def write_file(self, filename: str, content: str) -> str:
-        """Write content to file in working directory with path validation"""
+        """
+        Write content to a file. SECURITY: File must be within the working directory.
+        Paths with '..' or absolute paths outside working directory will be rejected.
+
+        Args:
+            filename: The name of the file to write to (relative to working directory)
+            content: The content to write to the file
+        """
         try:
             # Validate path is within working directory
             file_path = self._validate_path(filename)
@@ -452,8 +350,9 @@ Please generate tool calls as needed to research, design, and implement agents.
             logger.error(f"File write error: {e}")
             return f"Error writing to file '{filename}': {str(e)}"
 
+    @tool
     def list_files(self) -> str:
-        """List all files in working directory"""
+        """List all files in the working directory"""
         try:
             files = []
             for file_path in self.working_directory.rglob('*'):
@@ -469,8 +368,17 @@ Please generate tool calls as needed to research, design, and implement agents.
             logger.error(f"List files error: {e}")
             return f"Error listing files: {str(e)}"
 
+    @tool
     def run_terminal_command(self, command: str, working_directory: str = None) -> str:
-        """Execute a terminal command with security validation"""
+        """
+        Execute a terminal command. SECURITY: Dangerous commands (rm -rf, mkfs, dd, shutdown, etc.) are BLOCKED.
+        For pip install, use virtual environment: source venv/bin/activate && pip install <package>.
+        Working directory must be within workspace.
+
+        Args:
+            command: The terminal command to execute. For pip: use 'source venv/bin/activate && pip install <package>'
+            working_directory: Optional working directory (must be within workspace, defaults to agent's working directory)
+        """
         try:
             # Validate the command for dangerous patterns
             is_valid, error_msg = self._validate_command(command)
@@ -542,9 +450,20 @@ Please generate tool calls as needed to research, design, and implement agents.
                 "success": False
             }, indent=2)
 
-    def create_agent(self, agent_name: str, agent_description: str, template_type: str, 
-                    tools: List[str] = None, instructions: str = "") -> str:
-        """Create a new AI agent based on specifications"""
+    @tool
+    def create_agent(self, agent_name: str, agent_description: str,
+                     template_type: Literal["basic_agent", "web_enabled_agent"],
+                     instructions: str, tools: List[str] = None) -> str:
+        """
+        Create a new AI agent based on specifications
+
+        Args:
+            agent_name: Name of the agent to create
+            agent_description: Description of what the agent should do
+            template_type: Type of agent template to use
+            instructions: Detailed instructions for the agent's behavior
+            tools: List of tools the agent should have
+        """
         try:
             if tools is None:
                 tools = []
@@ -733,110 +652,61 @@ Make sure to set up the required environment variables:
 
     def handle_tool_call(self, tool_call, messages: List[Dict]) -> List[Dict]:
         """Handle tool calls and return updated messages"""
-        function_name = tool_call.function.name
-        arguments = json.loads(tool_call.function.arguments)
-        
-        result = ""
-        
-        if function_name == "web_search":
-            result = self.web_search(
-                query=arguments.get("query"),
-                max_results=arguments.get("max_results", 5)
-            )
-        elif function_name == "fetch_url":
-            result = self.fetch_url(url=arguments.get("url"))
-        elif function_name == "read_file":
-            result = self.read_file(filename=arguments.get("filename"))
-        elif function_name == "write_file":
-            result = self.write_file(
-                filename=arguments.get("filename"),
-                content=arguments.get("content")
-            )
-        elif function_name == "list_files":
-            result = self.list_files()
-        elif function_name == "run_terminal_command":
-            result = self.run_terminal_command(
-                command=arguments.get("command"),
-                working_directory=arguments.get("working_directory")
-            )
-        elif function_name == "create_agent":
-            result = self.create_agent(
-                agent_name=arguments.get("agent_name"),
-                agent_description=arguments.get("agent_description"),
-                template_type=arguments.get("template_type"),
-                tools=arguments.get("tools", []),
-                instructions=arguments.get("instructions", "")
-            )
-        else:
-            result = f"Unknown function: {function_name}"
-        
-        # Add tool result to messages
-        messages.append({
-            "role": "tool",
-            "tool_call_id": tool_call.id,
-            "content": result
-        })
-        
-        return messages
+        return self.registry.handle_tool_call(tool_call, messages)
 
     def consolidate_context(self, messages: List[Dict]) -> List[Dict]:
         """Consolidate context when messages get too long"""
+        # The instruction goes after the history, so the history is served from the KV cache
+        request = messages.with_control(
+            "Consolidate the conversation above into a concise summary that preserves all important "
+            "information, decisions, and context about agent creation and management."
+        )
+        self.prefix_reuse.observe(request, self.tools)
         completion = self.client.chat.completions.create(
             model=self.model,
-            messages=[{
-                "role": "user", 
-                "content": f"Consolidate the following conversation into a concise summary that preserves all important information about agent creation and management: {json.dumps([msg.get('content', '') for msg in messages])}"
-            }]
+            messages=request,
+            tools=self.tools,
+            tool_choice="auto"
         )
         
-        consolidated_messages = [
-            {"role": "system", "content": self.instructions},
-            {"role": "user", "content": completion.choices[0].message.content}
-        ]
-        
-        return consolidated_messages
+        return messages.consolidated(completion.choices[0].message.content)
 
     def prompt(self, messages: List[Dict]) -> List[Dict]:
-        """Send prompt to language model and handle response"""
+        """Send one prompt to the language model and run the tool calls it returns"""
+        # Prune stale tool output (no LLM call), then fold the oldest turns into summaries
+        # without waiting; consolidate only if still too long
+        if not self.summarizer.pending:
+            messages = prune_tool_outputs(messages, self.pruning_policy, agent=self.name)
+        messages = self.summarizer.compact(messages)
+        if messages.tokens > AgentWritingConfig.CONTEXT_CONSOLIDATION_THRESHOLD:
+            logger.info("Consolidating context due to length")
+            messages = self.consolidate_context(messages)
+        
         try:
+            self.prefix_reuse.observe(messages, self.tools)
             completion = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 tools=self.tools,
                 tool_choice="auto"
             )
+            self.last_completion = completion
             
             response_message = completion.choices[0].message
             
-            # Add assistant response to messages
-            messages.append({
-                "role": "assistant",
-                "content": response_message.content,
-                "tool_calls": response_message.tool_calls
-            })
+            # Add assistant response (with its tool calls) to messages
+            messages.append(assistant_message(response_message))
             
-            # Handle tool calls if present
+            # Handle tool calls if present; their results go back to the model on the next prompt
             if response_message.tool_calls:
                 for tool_call in response_message.tool_calls:
                     messages = self.handle_tool_call(tool_call, messages)
-                
-                # Get follow-up response after tool calls
-                follow_up = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    tools=self.tools,
-                    tool_choice="auto"
-                )
-                
-                messages.append({
-                    "role": "assistant",
-                    "content": follow_up.choices[0].message.content
-                })
             
             return messages
             
         except Exception as e:
             logger.error(f"Prompt error: {e}")
+            self.last_completion = {"finish_reason": "error"}
             messages.append({
                 "role": "assistant",
                 "content": f"Error processing request: {str(e)}"
@@ -844,57 +714,26 @@ Make sure to set up the required environment variables:
             return messages
 
     def run(self, kickoff_message: str) -> List[Dict]:
-        """Run a single interaction"""
+        """Run a single interaction (one more completion if the model called tools)"""
         self.messages.append({"role": "user", "content": kickoff_message})
-        self.messages = self.prompt(self.messages)
-        return self.messages
+        return run_until_done(self, max_iterations=2)
 
-    def agentic_run(self, kickoff_message: str, max_iterations: int = 20) -> List[Dict]:
-        """Run the agent autonomously until task completion"""
-        # Initial run
-        self.messages.append({"role": "user", "content": kickoff_message})
-        self.messages = self.prompt(self.messages)
-        
-        # Autonomous loop
-        iterations = 0
-        while iterations < max_iterations:
-            # Check if task is complete
-            check_messages = self.messages.copy()
-            check_messages.append({
-                "role": "user", 
-                "content": "Has the original agent creation task been completed, or should we continue? Respond with only 'yes' (continue) or 'no' (stop) with no other text."
-            })
-            
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=check_messages
-            )
-            
-            continue_flag = completion.choices[0].message.content.lower().strip()
-            
-            if continue_flag == "no":
-                logger.info("Task completed successfully")
-                break
-            
-            # Continue with the task
-            self.messages.append({
-                "role": "user", 
-                "content": "Please continue with the agent creation task. Focus on the next logical step."
-            })
-            self.messages = self.prompt(self.messages)
-            
-            iterations += 1
-            
-            # Consolidate context if messages get too long
-            if len(" ".join([json.dumps(message.get("content", "")) for message in self.messages])) > AgentWritingConfig.CONTEXT_CONSOLIDATION_THRESHOLD:
-                logger.info("Consolidating context due to length")
-                self.messages = self.consolidate_context(self.messages)
-        
-        if iterations >= max_iterations:
-            logger.warning(f"Reached maximum iterations ({max_iterations})")
+    def agentic_run(self, kickoff_message: str, max_iterations: int = 20,
+                    token_budget: Optional[int] = None) -> List[Dict]:
+        """
+        Run the agent autonomously until it calls the finish tool.
         
-        return self.messages
-
+        One completion per iteration, capped by max_iterations and token_budget (total tokens).
+        """
+        self.messages.append({"role": "user", "content": kickoff_message})
+        return run_until_done(
+            self,
+            max_iterations=max_iterations,
+            token_budget=token_budget,
+            require_finish=True,
+            continue_prompt="Please continue with the agent creation task. Focus on the next logical step, "
+                            "and call finish once the whole task is complete."
+        )
 
 def create_agent_writing_agent(working_directory: str = "./agent_workspace") -> AgentWritingAgent:
     """Factory function to create an agent writing agent"""
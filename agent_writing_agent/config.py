@@ -10,7 +10,7 @@ class AgentWritingConfig:
     """Configuration class for Agent Writing Agent"""
     
     # API Configuration
-    OPENAI_BASE_URL ="https://api.groq.com/openai/v1"
+    OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "https://api.groq.com/openai/v1")
     OPENAI_API_KEY = os.environ.get("GROQ_API_KEY")
     TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
     
@@ -19,7 +19,9 @@ class AgentWritingConfig:
     
     # Agent Configuration
     MAX_ITERATIONS = 30
-    CONTEXT_CONSOLIDATION_THRESHOLD = 50000  # characters
+    CONTEXT_CONSOLIDATION_THRESHOLD = 12500  # tokens (about 50,000 characters)
+    ROLLING_SUMMARY_THRESHOLD = 8000  # tokens; older turns are summarized in the background past this
+    PRUNE_THRESHOLD = 6000  # tokens; stale tool output is pruned past this
     MAX_SEARCH_RESULTS = 10
     
     # File Configuration
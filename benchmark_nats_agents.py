@@ -0,0 +1,338 @@
+"""
+NATS Agent Mesh Benchmark
+
+Load-generation and latency benchmark for NATSAgentMixin-based agents.
+
+This script:
+- Starts N agents (NATSOODAAgent or TripPlannerAgent) on an in-process broker or a local nats-server
+- Replaces the LM Studio client with a fake LLM with configurable latency and token rate
+- Drives closed-loop (fixed concurrency) or open-loop (target RPS) request/reply traffic
+- Reports throughput, p50/p95/p99 latency, queue depth and CPU per agent as JSON
+
+Usage:
+    python benchmark_nats_agents.py --agents 3 --mode open --rps 20 --duration 30
+    python benchmark_nats_agents.py --transport nats --mode closed --concurrency 8 --output bench.json
+
+CPU per agent is the thread CPU time spent inside the agent's run() (the agent
+loop, prompt building and tool dispatch), which is where mixin/agent-loop
+regressions show up; fake LLM time is sleep and costs no CPU.
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import asyncio
+import logging
+import argparse
+import contextlib
+import statistics
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+import nats_ooda_agent
+import trip_planner_agent
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+from nats_ooda_agent import NATSOODAAgent, tools as weather_tools
+from trip_planner_agent import TripPlannerAgent, trip_planner_tools
+
+logger = logging.getLogger(__name__)
+
+
+class FakeLLMClient:
+    """
+    Drop-in for the OpenAI client used by the agents.
+
+    Each completion takes `latency` seconds (time to first token) plus
+    `output_tokens / tokens_per_sec` seconds, and returns plain text. With
+    stream=True the text arrives as chunks at the token rate.
+    """
+
+    def __init__(self, latency: float = 0.2, tokens_per_sec: float = 50.0, output_tokens: int = 40,
+                 jitter: float = 0.0):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model: str = "fake", messages: Optional[List[Dict]] = None, stream: bool = False,
+                **kwargs: Any):
+        self.calls += 1
+        scale = random.uniform(1 - self.jitter, 1 + self.jitter) if self.jitter else 1.0
+        prompt_tokens = len(json.dumps(messages or [], default=str)) // 4
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=self.output_tokens,
+            total_tokens=prompt_tokens + self.output_tokens,
+        )
+        if stream:
+            return self._stream(model, scale, usage)
+
+        time.sleep(max(0.0, (self.latency + self.output_tokens / self.tokens_per_sec) * scale))
+        content = "<think>ok</think>" + " ".join(["token"] * self.output_tokens)
+        message = SimpleNamespace(role="assistant", content=content, tool_calls=None)
+        return SimpleNamespace(
+            id=f"fake-{uuid.uuid4().hex[:8]}",
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+            usage=usage,
+        )
+
+    def _stream(self, model: str, scale: float, usage: SimpleNamespace):
+        def chunk(content: Optional[str] = None, finish_reason: Optional[str] = None, **fields: Any):
+            delta = SimpleNamespace(content=content, tool_calls=None)
+            return SimpleNamespace(model=model, choices=[SimpleNamespace(index=0, delta=delta,
+                                                                          finish_reason=finish_reason)], **fields)
+
+        time.sleep(max(0.0, self.latency * scale))
+        yield chunk("<think>ok</think>")
+        for index in range(self.output_tokens):
+            time.sleep(max(0.0, scale / self.tokens_per_sec))
+            yield chunk(" token" if index else "token")
+        yield chunk(finish_reason="stop", usage=usage)
+
+
+class BenchClient(NATSAgentMixin):
+    """Traffic generator that talks to the mesh like any other agent"""
+
+    def __init__(self, name: str, nats_config: NATSConfig):
+        self.name = name
+        self.tools = []
+        super().__init__(nats_config=nats_config)
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def instrument_cpu(agent) -> Dict[str, float]:
+    """Wrap agent.run to accumulate the thread CPU time it consumes"""
+    stats = {"cpu_seconds": 0.0, "requests": 0}
+    original_run = agent.run
+
+    def run(kickoff_message):
+        started = time.thread_time()
+        try:
+            return original_run(kickoff_message)
+        finally:
+            stats["cpu_seconds"] += time.thread_time() - started
+            stats["requests"] += 1
+
+    agent.run = run
+    return stats
+
+
+def create_agents(count: int, agent_type: str, cfg: NATSConfig) -> List[Any]:
+    agents = []
+    for index in range(count):
+        if agent_type == "trip":
+            agent = TripPlannerAgent(
+                name=f"Bench-Trip-{index}",
+                instructions="You are a trip planner.",
+                model="qwen/qwen3-32b",
+                tools=trip_planner_tools,
+                nats_config=cfg,
+            )
+        else:
+            agent = NATSOODAAgent(
+                name=f"Bench-Weather-{index}",
+                instructions="You are a weather assistant.",
+                model="qwen/qwen3-32b",
+                tools=weather_tools,
+                nats_config=cfg,
+            )
+        agents.append(agent)
+    return agents
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.transport == "inproc":
+        nats_url = f"inproc://bench-{uuid.uuid4().hex[:8]}"
+    else:
+        nats_url = args.nats_url
+    cfg = NATSConfig(nats_url=nats_url, metrics_port=None)
+
+    fake_llm = FakeLLMClient(
+        latency=args.llm_latency,
+        tokens_per_sec=args.llm_tokens_per_sec,
+        output_tokens=args.llm_output_tokens,
+        jitter=args.llm_jitter,
+    )
+    nats_ooda_agent.client = fake_llm
+    trip_planner_agent.client = fake_llm
+
+    agents = create_agents(args.agents, args.agent_type, cfg)
+    cpu_stats = {agent.name: instrument_cpu(agent) for agent in agents}
+    queue_samples: Dict[str, List[int]] = {agent.name: [] for agent in agents}
+
+    for agent in agents:
+        await agent.connect_nats(capabilities=["benchmark"], description="Benchmark agent")
+    client = BenchClient("Bench-Client", cfg)
+    await client.connect_nats(capabilities=["load_generation"], description="Benchmark client")
+
+    latencies: List[float] = []
+    outcomes = {"sent": 0, "ok": 0, "timeout": 0}
+    measuring = False
+    counter = 0
+
+    async def one_request():
+        nonlocal counter
+        target = agents[counter % len(agents)].name
+        counter += 1
+        started = time.perf_counter()
+        response = await client.request_from_agent(target, "What's the weather in Boston?", timeout=args.timeout)
+        elapsed = time.perf_counter() - started
+        if not measuring:
+            return
+        outcomes["sent"] += 1
+        if response is None:
+            outcomes["timeout"] += 1
+        else:
+            outcomes["ok"] += 1
+            latencies.append(elapsed)
+
+    async def sample_queues():
+        while True:
+            await asyncio.sleep(args.sample_interval)
+            if measuring:
+                for agent in agents:
+                    queue_samples[agent.name].append(agent._queued_message_count())
+
+    async def closed_loop(deadline: float):
+        async def worker():
+            while time.perf_counter() < deadline:
+                await one_request()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+
+    async def open_loop(deadline: float):
+        in_flight = set()
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            task = asyncio.create_task(one_request())
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            gap = 1.0 / args.rps
+            next_at += random.expovariate(1.0 / gap) if args.arrival == "poisson" else gap
+        if in_flight:
+            await asyncio.wait(in_flight, timeout=args.timeout + 1)
+
+    drive = closed_loop if args.mode == "closed" else open_loop
+    sampler = asyncio.create_task(sample_queues())
+
+    if args.warmup > 0:
+        await drive(time.perf_counter() + args.warmup)
+    for stats in cpu_stats.values():
+        stats["cpu_seconds"], stats["requests"] = 0.0, 0
+
+    measuring = True
+    process_cpu_start = time.process_time()
+    started = time.perf_counter()
+    await drive(started + args.duration)
+    elapsed = time.perf_counter() - started
+    process_cpu = time.process_time() - process_cpu_start
+    measuring = False
+
+    sampler.cancel()
+    await client.disconnect_nats()
+    for agent in agents:
+        await agent.disconnect_nats()
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        "config": {
+            "transport": args.transport,
+            "agents": args.agents,
+            "agent_type": args.agent_type,
+            "mode": args.mode,
+            "rps": args.rps if args.mode == "open" else None,
+            "arrival": args.arrival if args.mode == "open" else None,
+            "concurrency": args.concurrency if args.mode == "closed" else None,
+            "duration_s": args.duration,
+            "llm": {
+                "latency_s": args.llm_latency,
+                "tokens_per_sec": args.llm_tokens_per_sec,
+                "output_tokens": args.llm_output_tokens,
+                "jitter": args.llm_jitter,
+            },
+        },
+        "requests": outcomes,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(outcomes["ok"] / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "mean": ms(statistics.fmean(latencies)) if latencies else None,
+            "max": ms(max(latencies)) if latencies else None,
+        },
+        "process_cpu_seconds": round(process_cpu, 3),
+        "agents": {
+            name: {
+                "requests": cpu_stats[name]["requests"],
+                "cpu_seconds": round(cpu_stats[name]["cpu_seconds"], 4),
+                "queue_depth_max": max(queue_samples[name], default=0),
+                "queue_depth_mean": round(statistics.fmean(queue_samples[name]), 3) if queue_samples[name] else 0.0,
+            }
+            for name in cpu_stats
+        },
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the NATS agent mesh")
+    parser.add_argument("--transport", choices=["inproc", "nats"], default="inproc")
+    parser.add_argument("--nats-url", default=os.getenv("NATS_URL", "nats://localhost:4222"))
+    parser.add_argument("--agents", type=int, default=2, help="Number of agents to start")
+    parser.add_argument("--agent-type", choices=["ooda", "trip"], default="ooda")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--concurrency", type=int, default=4, help="Closed-loop concurrent requesters")
+    parser.add_argument("--rps", type=float, default=10.0, help="Open-loop target requests/sec")
+    parser.add_argument("--arrival", choices=["uniform", "poisson"], default="poisson")
+    parser.add_argument("--duration", type=float, default=10.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Unmeasured warmup seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="Queue depth sampling interval")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake LLM time to first token (s)")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--llm-output-tokens", type=int, default=40)
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Relative latency jitter, e.g. 0.5")
+    parser.add_argument("--output", help="Write JSON results to this file (default: stdout)")
+    parser.add_argument("--verbose", action="store_true", help="Keep agent logs and prints")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+    with quiet:
+        results = asyncio.run(run_benchmark(args))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,10 +3,19 @@ import json
 import logging
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Any, Optional
-from openai import OpenAI
+from typing import Dict, List, Any, Literal, Optional
 from tavily import TavilyClient
 import requests
+from agent_loop import FINISH_TOOL, assistant_message, run_until_done
+from llm_gateway import llm_client
+from context_pruning import PruningPolicy, prune_tool_outputs
+from conversation import Conversation, PrefixReuse
+from rolling_summary import RollingSummarizer, openai_summarizer
+from tool_registry import ToolRegistry, tool
+try:
+    from .config import BookWriterConfig
+except ImportError:
+    from config import BookWriterConfig
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -74,9 +83,9 @@ Please generate a tool call if needed.
 """
         
         
-        # Initialize OpenAI client (LM Studio)
-        self.client = OpenAI(
-            base_url="https://api.groq.com/openai/v1",
+        # OpenAI-compatible client from the process-wide gateway (pooled connections, retries)
+        self.client = llm_client(
+            base_url=os.environ.get("OPENAI_BASE_URL", "https://api.groq.com/openai/v1"),
             api_key=os.environ.get("GROQ_API_KEY")
         )
         
@@ -89,130 +98,32 @@ Please generate a tool call if needed.
             logger.warning("TAVILY_API_KEY not found in environment variables")
         
         # Initialize messages with system prompt
-        self.messages = [
-            {"role": "system", "content": self.instructions}
-        ]
+        self.messages = Conversation(self.instructions)
+        self.prefix_reuse = PrefixReuse(self.name)
         
-        # Define tools
-        self.tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "web_search",
-                    "description": "Search the web for information using Tavily API",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "query": {
-                                "type": "string",
-                                "description": "The search query to find information about"
-                            },
-                            "max_results": {
-                                "type": "integer",
-                                "description": "Maximum number of search results to return (default: 5)"
-                            }
-                        },
-                        "required": ["query"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "read_file",
-                    "description": "Read the contents of a file in the working directory",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "The name of the file to read"
-                            }
-                        },
-                        "required": ["filename"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "write_file",
-                    "description": "Write content to a file in the working directory",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "The name of the file to write to"
-                            },
-                            "content": {
-                                "type": "string",
-                                "description": "The content to write to the file"
-                            }
-                        },
-                        "required": ["filename", "content"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "update_file",
-                    "description": "Update or append content to an existing file",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "filename": {
-                                "type": "string",
-                                "description": "The name of the file to update"
-                            },
-                            "content": {
-                                "type": "string",
-                                "description": "The content to append or update"
-                            },
-                            "mode": {
-                                "type": "string",
-                                "enum": ["append", "replace"],
-                                "description": "Whether to append to or replace the file content"
-                            }
-                        },
-                        "required": ["filename", "content", "mode"]
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "list_files",
-                    "description": "List all files in the working directory",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {},
-                        "required": []
-                    }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "fetch_url",
-                    "description": "Fetch the contents of a URL",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "url": {
-                                "type": "string",
-                                "description": "The URL to fetch"
-                            }
-                        },
-                        "required": ["url"]
-                    }
-                } 
-            }
-        ]
+        # Old tool output is pruned by rule first, then the oldest turns are summarized in the
+        # background; consolidate_context() remains the backstop
+        self.pruning_policy = PruningPolicy(threshold_tokens=BookWriterConfig.PRUNE_THRESHOLD)
+        self.summarizer = RollingSummarizer(
+            openai_summarizer(self.client, self.model, agent=self.name),
+            threshold_tokens=BookWriterConfig.ROLLING_SUMMARY_THRESHOLD,
+            name=self.name,
+        )
+        
+        # Tool schemas are generated from the @tool methods below
+        self.registry = ToolRegistry.from_object(self)
+        self.registry.register(lambda summary: "Task marked complete.", schema=FINISH_TOOL)
+        self.tools = self.registry.schemas
 
+    @tool
     def web_search(self, query: str, max_results: int = 5) -> str:
-        """Perform web search using Tavily API"""
+        """
+        Search the web for information using Tavily API
+
+        Args:
+            query: The search query to find information about
+            max_results: Maximum number of search results to return (default: 5)
+        """
         if not self.tavily_client:
             return "Error: Tavily API client not initialized. Please set TAVILY_API_KEY environment variable."
         
@@ -237,8 +148,14 @@ Please generate a tool call if needed.
             logger.error(f"Web search error: {e}")
             return f"Error performing web search: {str(e)}"
     
+    @tool
     def fetch_url(self, url: str) -> str:
-        """Fetch the contents of a URL"""
+        """
+        Fetch the contents of a URL
+
+        Args:
+            url: The URL to fetch
+        """
         try:
             response = requests.get(url)
             return response.text
@@ -246,8 +163,14 @@ Please generate a tool call if needed.
             logger.error(f"URL fetch error: {e}")
             return f"Error fetching URL: {str(e)}"
 
+    @tool
     def read_file(self, filename: str) -> str:
-        """Read file from working directory"""
+        """
+        Read the contents of a file in the working directory
+
+        Args:
+            filename: The name of the file to read
+        """
         try:
             file_path = self.working_directory / filename
             if file_path.exists():
@@ -259,8 +182,15 @@ Please generate a tool call if needed.
             logger.error(f"File read error: {e}")
             return f"Error reading file '{filename}': {str(e)}"
 
+    @tool
     def write_file(self, filename: str, content: str) -> str:
-        """Write content to file in working directory"""
+        """
+        Write content to a file in the working directory
+
+        Args:
+            filename: The name of the file to write to
+            content: The content to write to the file
+        """
         try:
             file_path = self.working_directory / filename
             with open(file_path, 'w') as f:
@@ -270,8 +200,16 @@ Please generate a tool call if needed.
             logger.error(f"File write error: {e}")
             return f"Error writing to file '{filename}': {str(e)}"
 
-    def update_file(self, filename: str, content: str, mode: str) -> str:
-        """Update file content (append or replace)"""
+    @tool
+    def update_file(self, filename: str, content: str, mode: Literal["append", "replace"]) -> str:
+        """
+        Update or append content to an existing file
+
+        Args:
+            filename: The name of the file to update
+            content: The content to append or update
+            mode: Whether to append to or replace the file content
+        """
         try:
             file_path = self.working_directory / filename
             
@@ -289,8 +227,9 @@ Please generate a tool call if needed.
             logger.error(f"File update error: {e}")
             return f"Error updating file '{filename}': {str(e)}"
 
+    @tool
     def list_files(self) -> str:
-        """List all files in working directory"""
+        """List all files in the working directory"""
         try:
             files = []
             for file_path in self.working_directory.iterdir():
@@ -307,104 +246,62 @@ Please generate a tool call if needed.
 
     def handle_tool_call(self, tool_call, messages: List[Dict]) -> List[Dict]:
         """Handle tool calls and return updated messages"""
-        function_name = tool_call.function.name
-        arguments = json.loads(tool_call.function.arguments)
-        
-        result = ""
-        
-        if function_name == "web_search":
-            result = self.web_search(
-                query=arguments.get("query"),
-                max_results=arguments.get("max_results", 5)
-            )
-        elif function_name == "read_file":
-            result = self.read_file(filename=arguments.get("filename"))
-        elif function_name == "write_file":
-            result = self.write_file(
-                filename=arguments.get("filename"),
-                content=arguments.get("content")
-            )
-        elif function_name == "update_file":
-            result = self.update_file(
-                filename=arguments.get("filename"),
-                content=arguments.get("content"),
-                mode=arguments.get("mode")
-            )
-        elif function_name == "list_files":
-            result = self.list_files()
-        else:
-            result = f"Unknown function: {function_name}"
-        
-        # Add tool result to messages
-        messages.append({
-            "role": "tool",
-            "tool_call_id": tool_call.id,
-            "content": result
-        })
-        
-        return messages
+        return self.registry.handle_tool_call(tool_call, messages)
 
     def consolidate_context(self, messages: List[Dict]) -> List[Dict]:
         """Consolidate context when messages get too long"""
+        # The instruction goes after the history, so the history is served from the KV cache
+        request = messages.with_control(
+            "Consolidate the conversation above into a concise summary that preserves all important "
+            "information, decisions, and context about the book writing project."
+        )
+        self.prefix_reuse.observe(request, self.tools)
         completion = self.client.chat.completions.create(
             model=self.model,
-            messages=[{
-                "role": "user", 
-                "content": f"Consolidate the following conversation into a concise summary that preserves all important information, decisions, and context about the book writing project: {". ".join([json.dumps(message.get("content")) for message in messages])}"
-            }],
+            messages=request,
             tools=self.tools,
             tool_choice="auto"
         )
         
-        consolidated_messages = [
-            {"role": "system", "content": self.instructions},
-            {"role": "user", "content": completion.choices[0].message.content}
-        ]
-        
-        return consolidated_messages
+        return messages.consolidated(completion.choices[0].message.content)
 
     def prompt(self, messages: List[Dict]) -> List[Dict]:
-        """Send prompt to language model and handle response"""
+        """Send one prompt to the language model and run the tool calls it returns"""
+        # Prune stale tool output (no LLM call), then fold the oldest turns into summaries
+        # without waiting; consolidate only if still too long
+        if not self.summarizer.pending:
+            messages = prune_tool_outputs(messages, self.pruning_policy, agent=self.name)
+        messages = self.summarizer.compact(messages)
+        if messages.tokens > BookWriterConfig.CONTEXT_CONSOLIDATION_THRESHOLD:
+            logger.info("Consolidating context due to length")
+            messages = self.consolidate_context(messages)
+        
         try:
+            self.prefix_reuse.observe(messages, self.tools)
             completion = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
                 tools=self.tools,
                 tool_choice="auto"
             )
+            self.last_completion = completion
             print(completion.choices[0].message)
             
             response_message = completion.choices[0].message
             
-            # Add assistant response to messages
-            messages.append({
-                "role": "assistant",
-                "content": response_message.content,
-                "tool_calls": response_message.tool_calls
-            })
+            # Add assistant response (with its tool calls) to messages
+            messages.append(assistant_message(response_message))
             
-            # Handle tool calls if present
+            # Handle tool calls if present; their results go back to the model on the next prompt
             if response_message.tool_calls:
                 for tool_call in response_message.tool_calls:
                     messages = self.handle_tool_call(tool_call, messages)
-                
-                # Get follow-up response after tool calls
-                follow_up = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=messages,
-                    tools=self.tools,
-                    tool_choice="auto"
-                )
-                
-                messages.append({
-                    "role": "assistant",
-                    "content": follow_up.choices[0].message.content
-                })
             
             return messages
             
         except Exception as e:
             logger.error(f"Prompt error: {e}")
+            self.last_completion = {"finish_reason": "error"}
             messages.append({
                 "role": "assistant",
                 "content": f"Error processing request: {str(e)}"
@@ -412,57 +309,26 @@ Please generate a tool call if needed.
             return messages
 
     def run(self, kickoff_message: str) -> List[Dict]:
-        """Run a single interaction"""
+        """Run a single interaction (one more completion if the model called tools)"""
         self.messages.append({"role": "user", "content": kickoff_message})
-        self.messages = self.prompt(self.messages)
-        return self.messages
+        return run_until_done(self, max_iterations=2)
 
-    def agentic_run(self, kickoff_message: str, max_iterations: int = 20) -> List[Dict]:
-        """Run the agent autonomously until task completion"""
-        # Initial run
-        self.messages.append({"role": "user", "content": kickoff_message})
-        self.messages = self.prompt(self.messages)
+    def agentic_run(self, kickoff_message: str, max_iterations: int = 20,
+                    token_budget: Optional[int] = None) -> List[Dict]:
+        """
+        Run the agent autonomously until it calls the finish tool.
         
-        # Autonomous loop
-        iterations = 0
-        while iterations < max_iterations:
-            # Check if task is complete
-            check_messages = self.messages.copy()
-            check_messages.append({
-                "role": "user", 
-                "content": "Has the original book writing task been completed, or should we continue? Respond with only 'yes' (continue) or 'no' (stop) with no other text."
-            })
-            
-            completion = self.client.chat.completions.create(
-                model=self.model,
-                messages=check_messages
-            )
-            
-            continue_flag = completion.choices[0].message.content.lower().strip()
-            
-            if continue_flag == "no":
-                logger.info("Task completed successfully")
-                break
-            
-            # Continue with the task
-            self.messages.append({
-                "role": "user", 
-                "content": "Please continue with the book writing task. Focus on the next logical step in your plan."
-            })
-            self.messages = self.prompt(self.messages)
-            
-            iterations += 1
-            
-            # Consolidate context if messages get too long
-            if len(" ".join([json.dumps(message.get("content")) for message in self.messages])) > 50000:  # Rough token estimate
-                logger.info("Consolidating context due to length")
-                self.messages = self.consolidate_context(self.messages)
-        
-        if iterations >= max_iterations:
-            logger.warning(f"Reached maximum iterations ({max_iterations})")
-        
-        return self.messages
-
+        One completion per iteration, capped by max_iterations and token_budget (total tokens).
+        """
+        self.messages.append({"role": "user", "content": kickoff_message})
+        return run_until_done(
+            self,
+            max_iterations=max_iterations,
+            token_budget=token_budget,
+            require_finish=True,
+            continue_prompt="Please continue with the book writing task. Focus on the next logical step, "
+                            "and call finish once the whole task is complete."
+        )
 
 def create_book_writer_agent(topic: str, working_directory: str = "./book_workspace") -> BookWriterAgent:
     """Factory function to create a book writer agent for a specific topic"""
@@ -19,7 +19,9 @@ class BookWriterConfig:
     
     # Agent Configuration
     MAX_ITERATIONS = 50
-    CONTEXT_CONSOLIDATION_THRESHOLD = 50000  # characters
+    CONTEXT_CONSOLIDATION_THRESHOLD = 12500  # tokens (about 50,000 characters)
+    ROLLING_SUMMARY_THRESHOLD = 8000  # tokens; older turns are summarized in the background past this
+    PRUNE_THRESHOLD = 6000  # tokens; stale tool output is pruned past this
     MAX_SEARCH_RESULTS = 10
     
     # File Configuration
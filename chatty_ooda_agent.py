@@ -1,5 +1,5 @@
-from openai import OpenAI
-client = OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="lm-studio")
+from llm_gateway import llm_client
+client = llm_client()  # shared, pooled client for LM_STUDIO_BASE_URL
 import json
 import random
 
@@ -118,7 +118,6 @@ agent = Agent(
     instructions=f"""
     You are a helpful assistant that can use function tools to help the user.
     You can use the get_current_weather tool for real-time access to the weather.
-    {tools}
     """,
     model="qwen/qwen3-32b",
     tools=tools
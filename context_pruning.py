@@ -0,0 +1,187 @@
+"""
+Context Pruning
+
+Deterministic, LLM-free pruning of stale tool traffic, which is most of what
+makes agent contexts grow (search results, file contents, listings, command
+output). Once a Conversation passes PruningPolicy.threshold_tokens, tool
+outputs older than keep_turns assistant turns are rewritten:
+
+- superseded outputs are replaced by a stub: a call repeated later with the
+  same arguments (e.g. list_files), or a file read when the same file was read
+  or written again later
+- long outputs are cut to their first head_chars characters
+- long string arguments of old tool calls (e.g. a chapter passed to write_file)
+  are replaced by a stub; the arguments stay valid JSON
+
+Every stub says how to get the content back (call the tool again, or read the
+file). Pruning rewrites the middle of the conversation, which invalidates the
+server's cached prompt prefix from the first changed message on (see
+conversation.py), so it works with hysteresis: once the conversation passes
+threshold_tokens, it is pruned down to target_tokens (keeping fewer recent
+turns, down to min_keep_turns, if that's what it takes), and then left alone
+until it grows past threshold_tokens again. If even that can't get under
+target_tokens, each later prune only touches the turn that has just aged out,
+at the end of the conversation.
+"""
+
+import json
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from agent_metrics import CONTEXT_PRUNED
+from conversation import Conversation
+from tool_executor import memo_key
+
+logger = logging.getLogger(__name__)
+
+
+PRUNED_MARKER = "[pruned"
+
+
+@dataclass
+class PruningPolicy:
+    """When and how much of old tool traffic to prune"""
+
+    threshold_tokens: int = 6000  # prune once the conversation is larger than this (high-water mark)
+    target_tokens: Optional[int] = None  # ...down to this (low-water mark); default 60% of threshold_tokens
+    keep_turns: int = 3  # tool traffic from the last N assistant turns is left alone...
+    min_keep_turns: int = 1  # ...unless more is needed to reach target_tokens; never fewer than this
+    max_chars: int = 1200  # older outputs and arguments longer than this are cut
+    head_chars: int = 400  # what is kept of a cut output
+    file_argument: str = "filename"
+    file_readers: Tuple[str, ...] = ("read_file",)
+    file_writers: Tuple[str, ...] = ("write_file", "update_file")
+
+    @property
+    def low_water(self) -> int:
+        return self.target_tokens if self.target_tokens is not None else int(self.threshold_tokens * 0.6)
+
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _arguments(raw: Any) -> Dict[str, Any]:
+    try:
+        parsed = json.loads(raw) if isinstance(raw, str) else raw
+    except (TypeError, ValueError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
+
+
+def _prune_arguments(raw: str, name: str, policy: PruningPolicy) -> Optional[str]:
+    """The call's arguments with long strings stubbed out, or None if nothing changes"""
+    arguments = _arguments(raw)
+    changed = False
+    for key, value in arguments.items():
+        if isinstance(value, str) and len(value) > policy.max_chars and not value.startswith(PRUNED_MARKER):
+            hint = ""
+            if name in policy.file_writers and policy.file_argument in arguments:
+                hint = f"; read_file('{arguments[policy.file_argument]}') for the file's current contents"
+            arguments[key] = f"{PRUNED_MARKER} {len(value)} chars{hint}]"
+            changed = True
+    return json.dumps(arguments) if changed else None
+
+
+def _replacements(conversation: Conversation, policy: PruningPolicy,
+                  keep_turns: int) -> Dict[int, Tuple[Dict[str, Any], List[str]]]:
+    """index -> (pruned message, rules applied) for the tool traffic older than keep_turns"""
+    # Index the tool calls: id -> (assistant message index, name, arguments)
+    calls: Dict[str, Tuple[int, str, Dict[str, Any]]] = {}
+    last_same_call: Dict[str, int] = {}
+    last_file_use: Dict[str, int] = {}
+    turns = 0
+    turn_of: Dict[int, int] = {}
+    for index, message in enumerate(conversation):
+        if message.get("role") != "assistant":
+            continue
+        turns += 1
+        turn_of[index] = turns
+        for call in message.get("tool_calls") or []:
+            function = _field(call, "function")
+            name = _field(function, "name", "")
+            raw = _field(function, "arguments", "{}")
+            arguments = _arguments(raw)
+            calls[_field(call, "id")] = (index, name, arguments)
+            last_same_call[memo_key(name, raw)] = index
+            if name in policy.file_readers + policy.file_writers and policy.file_argument in arguments:
+                last_file_use[str(arguments[policy.file_argument])] = index
+
+    def is_old(index: int) -> bool:
+        return turns - turn_of[index] >= keep_turns
+
+    replacements: Dict[int, Tuple[Dict[str, Any], List[str]]] = {}
+    for index, message in enumerate(conversation):
+        role = message.get("role")
+        if role == "assistant" and message.get("tool_calls") and is_old(index):
+            tool_calls = []
+            rules = []
+            for call in message["tool_calls"]:
+                function = _field(call, "function")
+                raw = _field(function, "arguments", "{}")
+                pruned = _prune_arguments(raw, _field(function, "name", ""), policy) if isinstance(raw, str) else None
+                if pruned is not None:
+                    rules.append("arguments")
+                    call = {**call, "function": {**function, "arguments": pruned}}
+                tool_calls.append(call)
+            if rules:
+                replacements[index] = ({**message, "tool_calls": tool_calls}, rules)
+            continue
+
+        content = message.get("content")
+        if role != "tool" or not isinstance(content, str) or content.startswith(PRUNED_MARKER):
+            continue
+        call = calls.get(message.get("tool_call_id"))
+        if call is None or not is_old(call[0]):
+            continue
+        call_index, name, arguments = call
+        filename = str(arguments.get(policy.file_argument, ""))
+
+        if name in policy.file_readers and last_file_use.get(filename, call_index) > call_index:
+            stub, rule = f"{PRUNED_MARKER}: {filename} was read or written again later; call {name} for its current contents]", "superseded"
+        elif last_same_call.get(memo_key(name, json.dumps(arguments)), call_index) > call_index:
+            stub, rule = f"{PRUNED_MARKER}: {name} was called again later with the same arguments; see the later result]", "superseded"
+        elif len(content) > policy.max_chars:
+            stub = (f"{content[:policy.head_chars]}\n{PRUNED_MARKER} {len(content) - policy.head_chars} more chars of "
+                    f"this {name} output; call {name} again with the same arguments for all of it]")
+            rule = "truncated"
+        else:
+            continue
+        replacements[index] = ({**message, "content": stub}, [rule])
+    return replacements
+
+
+def prune_tool_outputs(conversation: Conversation, policy: Optional[PruningPolicy] = None,
+                       agent: str = "agent") -> Conversation:
+    """
+    A copy of `conversation` pruned down to the policy's low-water mark, or
+    `conversation` itself if it is under the high-water mark (or nothing is stale).
+    """
+    policy = policy or PruningPolicy()
+    if conversation.tokens <= policy.threshold_tokens:
+        return conversation
+
+    pruned = conversation
+    replaced = {}
+    for keep_turns in range(policy.keep_turns, min(policy.min_keep_turns, policy.keep_turns) - 1, -1):
+        replacements = _replacements(conversation, policy, keep_turns)
+        if not replacements:
+            continue
+        pruned = conversation.copy()
+        for index, (message, _) in replacements.items():
+            pruned[index] = message
+        replaced = replacements
+        if pruned.tokens <= policy.low_water:
+            break
+
+    if not replaced:
+        return conversation
+    for _, rules in replaced.values():
+        for rule in rules:
+            CONTEXT_PRUNED.labels(agent, rule).inc()
+    logger.info(f"{agent}: pruned {len(replaced)} stale tool messages, {conversation.tokens} -> {pruned.tokens} tokens"
+                f" (target {policy.low_water})")
+    return pruned
@@ -0,0 +1,260 @@
+"""
+Conversation
+
+Message lists laid out so a local server (LM Studio / llama.cpp) can reuse its
+KV cache. The server only skips the part of a prompt that is byte-identical to
+the start of the previous prompt, so:
+
+- the system prompt comes first and never changes; tool schemas go in `tools=`
+  only, never interpolated into the instructions as well
+- history is append-only between consolidations: turns are added at the end and
+  earlier messages are not edited
+- one-off control prompts (such as the consolidation instruction) go after the
+  history in a copy of the messages (Conversation.with_control), so the history
+  before them is still a cached prefix
+
+PrefixReuse measures how much of each prompt an agent sends repeats the start
+of its previous prompt, as agent_prompt_prefix_tokens_total{kind="reused"|"new"}.
+
+Conversations also keep a running token count (Conversation.tokens), so
+context budget checks don't re-measure the history on every prompt.
+"""
+
+import json
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from agent_metrics import PROMPT_PREFIX_TOKENS
+
+logger = logging.getLogger(__name__)
+
+
+CONSOLIDATE_PROMPT = (
+    "Consolidate the conversation above into a single message for yourself to continue from. "
+    "Do not lose any information: keep the task, decisions, results and open questions."
+)
+
+
+MESSAGE_OVERHEAD = 4  # tokens the chat template adds around each message (role, separators)
+
+_encoding: Any = None
+
+
+def approx_tokens(text: str) -> int:
+    """A rough token count: about 4 characters per token for English text and JSON"""
+    return len(text) // 4 + 1
+
+
+def count_tokens(text: str) -> int:
+    """Tokens in `text`: tiktoken's cl100k_base if installed, else approx_tokens()"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return approx_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _serialize(value: Any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _fingerprint(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def message_tokens(message: Dict[str, Any], count: Callable[[str], int] = count_tokens) -> int:
+    """Tokens a message adds to a prompt: content, tool calls and the template overhead"""
+    content = message.get("content")
+    tokens = MESSAGE_OVERHEAD + (count(content) if isinstance(content, str) else count(_serialize(content)) if content else 0)
+    if message.get("tool_calls"):
+        tokens += count(_serialize(message["tool_calls"]))
+    return tokens
+
+
+class Conversation(list):
+    """
+    An agent's messages: the system prompt, then append-only history.
+
+    A list of message dicts, so it works wherever the agents used a plain list.
+    Each message is counted (and fingerprinted for PrefixReuse) once, when it is
+    added, so `tokens` is a running total rather than a pass over the history.
+    Replace messages instead of editing them in place, or the counts go stale.
+    `count` is the tokenizer: a function from text to its number of tokens.
+    """
+
+    def __init__(self, system_prompt: str, history: Iterable[Dict[str, Any]] = (),
+                 count: Callable[[str], int] = count_tokens):
+        super().__init__()
+        self.count = count
+        self.tokens = 0
+        self._sizes: List[int] = []
+        self._fingerprints: List[str] = []
+        self.append({"role": "system", "content": system_prompt})
+        self.extend(history)
+
+    # Bookkeeping: every mutation keeps _sizes, _fingerprints and tokens in step with the list
+
+    def _measure(self, message: Dict[str, Any]) -> Tuple[int, str]:
+        return message_tokens(message, self.count), _fingerprint(_serialize(message))
+
+    def _recount(self):
+        measured = [self._measure(message) for message in self]
+        self._sizes = [size for size, _ in measured]
+        self._fingerprints = [fingerprint for _, fingerprint in measured]
+        self.tokens = sum(self._sizes)
+
+    def append(self, message: Dict[str, Any]):
+        size, fingerprint = self._measure(message)
+        super().append(message)
+        self._sizes.append(size)
+        self._fingerprints.append(fingerprint)
+        self.tokens += size
+
+    def extend(self, messages: Iterable[Dict[str, Any]]):
+        for message in messages:
+            self.append(message)
+
+    def __iadd__(self, messages: Iterable[Dict[str, Any]]):
+        self.extend(messages)
+        return self
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        if isinstance(index, slice):
+            self._recount()
+            return
+        size, fingerprint = self._measure(value)
+        self.tokens += size - self._sizes[index]
+        self._sizes[index] = size
+        self._fingerprints[index] = fingerprint
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._recount()
+
+    def insert(self, index, message):
+        super().insert(index, message)
+        self._recount()
+
+    def pop(self, index=-1):
+        message = super().pop(index)
+        self.tokens -= self._sizes.pop(index)
+        self._fingerprints.pop(index)
+        return message
+
+    def remove(self, message):
+        super().remove(message)
+        self._recount()
+
+    def clear(self):
+        super().clear()
+        self._recount()
+
+    @property
+    def system_prompt(self) -> str:
+        return self[0]["content"]
+
+    @property
+    def history(self) -> List[Dict[str, Any]]:
+        return self[1:]
+
+    @property
+    def token_counts(self) -> List[int]:
+        """Tokens per message, in order"""
+        return list(self._sizes)
+
+    def copy(self) -> "Conversation":
+        """A shallow copy that keeps the counts instead of recounting"""
+        duplicate = Conversation.__new__(Conversation)
+        list.extend(duplicate, self)
+        duplicate.count = self.count
+        duplicate.tokens = self.tokens
+        duplicate._sizes = list(self._sizes)
+        duplicate._fingerprints = list(self._fingerprints)
+        return duplicate
+
+    def prefix_key(self, end: int) -> str:
+        """A hash identifying the messages self[:end]"""
+        return _fingerprint("".join(self._fingerprints[:end]))
+
+    def splice(self, start: int, end: int, messages: Iterable[Dict[str, Any]]) -> "Conversation":
+        """A copy with self[start:end] replaced by `messages`; only the new messages are counted"""
+        duplicate = self.copy()
+        added = list(messages)
+        measured = [self._measure(message) for message in added]
+        list.__setitem__(duplicate, slice(start, end), added)
+        duplicate._sizes[start:end] = [size for size, _ in measured]
+        duplicate._fingerprints[start:end] = [fingerprint for _, fingerprint in measured]
+        duplicate.tokens = sum(duplicate._sizes)
+        return duplicate
+
+    def with_control(self, content: str) -> "Conversation":
+        """The messages plus a trailing user turn that isn't kept in the conversation"""
+        request = self.copy()
+        request.append({"role": "user", "content": content})
+        return request
+
+    def consolidated(self, summary: str) -> "Conversation":
+        """A new conversation continuing from `summary`, with the same system prompt (unchanged if there's no summary)"""
+        if not summary:
+            logger.warning("Consolidation produced no summary; keeping the full conversation")
+            return self
+        return Conversation(self.system_prompt, [{"role": "user", "content": f"Previous conversation summary: {summary}"}],
+                            count=self.count)
+
+
+class PrefixReuse:
+    """
+    How much of each prompt matches the start of an agent's previous prompt.
+
+    Compares per-message fingerprints (the tool schemas count as the first
+    "message"); a Conversation already holds them, so that is a list compare.
+    """
+
+    def __init__(self, agent_name: str):
+        self.agent_name = agent_name
+        self.reused_tokens = 0
+        self.total_tokens = 0
+        self._previous: List[str] = []
+
+    def observe(self, messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]] = None) -> float:
+        """Record a prompt about to be sent; returns the fraction of it that repeats the previous one"""
+        tools_text = _serialize(tools or [])
+        fingerprints = [_fingerprint(tools_text)]
+        sizes = [approx_tokens(tools_text)]
+        if isinstance(messages, Conversation):
+            # Counted and fingerprinted when the messages were added
+            fingerprints += messages._fingerprints
+            sizes += messages._sizes
+        else:
+            for message in messages:
+                fingerprints.append(_fingerprint(_serialize(message)))
+                sizes.append(message_tokens(message))
+
+        had_previous = bool(self._previous)
+        shared = 0
+        for current, previous in zip(fingerprints, self._previous):
+            if current != previous:
+                break
+            shared += 1
+        self._previous = fingerprints
+
+        reused, total = sum(sizes[:shared]), sum(sizes)
+        self.reused_tokens += reused
+        self.total_tokens += total
+        PROMPT_PREFIX_TOKENS.labels(self.agent_name, "reused").inc(reused)
+        PROMPT_PREFIX_TOKENS.labels(self.agent_name, "new").inc(total - reused)
+        if had_previous and shared == 0:
+            logger.debug(f"{self.agent_name}: prompt shares no prefix with the previous one")
+        return reused / total if total else 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """Reused share of all prompt tokens observed so far"""
+        return self.reused_tokens / self.total_tokens if self.total_tokens else 0.0
@@ -28,10 +28,7 @@ def create_weather_agent():
         You are a weather specialist bot. Your primary function is to provide weather information.
         When you receive requests, always try to use your get_current_weather tool to provide accurate information.
         Be concise and helpful in your responses.
-        
-        Available tools:
-        {tools}
-        """.format(tools=json.dumps(tools, indent=2)),
+        """,
         model="qwen/qwen3-32b",
         tools=tools
     )
@@ -54,10 +51,7 @@ def create_coordinator_agent():
         - Other agents as they become available
         
         Be efficient and always acknowledge when you're delegating tasks.
-        
-        Available tools:
-        {tools}
-        """.format(tools=json.dumps(tools, indent=2)),
+        """,
         model="qwen/qwen3-32b",
         tools=tools
     )
@@ -72,10 +66,7 @@ def create_general_assistant():
         When you don't have the capability to handle something, you can ask other agents for help.
         
         You can use the weather tool and coordinate with other agents as needed.
-        
-        Available tools:
-        {tools}
-        """.format(tools=json.dumps(tools, indent=2)),
+        """,
         model="qwen/qwen3-32b",
         tools=tools
     )
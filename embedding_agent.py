@@ -0,0 +1,243 @@
+"""
+Embedding Agent
+
+A shared embedding service on the mesh. The sentence-transformers model is
+loaded once per process instead of once per agent, and any agent can get
+vectors with `await agent.embed(["text", ...])` (see NATSAgentMixin.embed).
+
+- Concurrent requests are micro-batched: texts queue up for a few milliseconds
+  (or while the previous forward pass runs) and are encoded in one batch
+- Vectors are cached by content hash as packed float32, and identical texts in flight are encoded once
+- Replicas share a queue group like any other agent, so the service scales out
+
+Run:
+    python embedding_agent.py                       # model from EMBEDDING_MODEL
+    python embedding_agent.py --model all-mpnet-base-v2 --batch-size 128
+"""
+
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import threading
+import collections
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from agent_metrics import EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE
+from agent_payloads import content_digest
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig, nats_config
+
+logger = logging.getLogger(__name__)
+
+
+_models: Dict[Tuple[str, str], Any] = {}
+_models_lock = threading.Lock()
+
+
+def load_model(name: str, device: str = "cpu"):
+    """Load a sentence-transformers model, once per process"""
+    with _models_lock:
+        if (name, device) not in _models:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as error:
+                raise ImportError(
+                    "The embedding agent needs sentence-transformers: pip install sentence-transformers"
+                ) from error
+            logger.info(f"Loading embedding model {name} on {device}")
+            _models[(name, device)] = SentenceTransformer(name, device=device)
+        return _models[(name, device)]
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts from concurrent callers into batches for `encode`.
+
+    `encode(texts)` is blocking (a model forward pass) and runs in a worker
+    thread, one batch at a time; texts arriving meanwhile form the next batch.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], Sequence[Sequence[float]]], max_batch_size: int = 64,
+                 max_wait: float = 0.005, cache_size: int = 50000, name: str = "embeddings"):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cache_size = cache_size
+        self.name = name
+        self._cache: collections.OrderedDict = collections.OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def embed(self, texts: List[str]) -> List[Sequence[float]]:
+        """Vectors for `texts`, in order, as returned by `encode` (and cached)"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        loop = asyncio.get_running_loop()
+        results: List[Any] = []
+        for text in texts:
+            key = content_digest(text.encode('utf-8'))
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                EMBEDDING_CACHE.labels(self.name, "hit").inc()
+                results.append(self._cache[key])
+            elif key in self._pending:
+                EMBEDDING_CACHE.labels(self.name, "hit").inc()
+                results.append(self._pending[key])
+            else:
+                EMBEDDING_CACHE.labels(self.name, "miss").inc()
+                future = loop.create_future()
+                self._pending[key] = future
+                self._queue.put_nowait((key, text))
+                results.append(future)
+
+        return [await result if isinstance(result, asyncio.Future) else result for result in results]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            EMBEDDING_BATCH_SIZE.labels(self.name).observe(len(batch))
+            try:
+                vectors = await loop.run_in_executor(None, self.encode, [text for _, text in batch])
+            except Exception as error:
+                logger.error(f"Embedding batch of {len(batch)} failed: {error}")
+                for key, _ in batch:
+                    future = self._pending.pop(key)
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+
+            for (key, _), vector in zip(batch, vectors):
+                self._cache[key] = vector
+                future = self._pending.pop(key)
+                if not future.done():
+                    future.set_result(vector)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+
+
+class EmbeddingAgent(NATSAgentMixin):
+    """
+    Serves `{"texts": [...]}` requests with `{"model", "dim", "vectors"}` replies.
+
+    Unlike LLM agents, requests are handled concurrently so they can share batches.
+    """
+
+    concurrent_requests = True
+
+    def __init__(self, name: Optional[str] = None, model: Optional[str] = None, device: str = "cpu",
+                 nats_config: NATSConfig = nats_config):
+        cfg = nats_config
+        self.name = name or cfg.embedding_agent
+        self.model = model or cfg.embedding_model
+        self.device = device
+        self.tools = []
+        super().__init__(nats_config=cfg)
+        self.batcher = EmbeddingBatcher(
+            self._encode,
+            max_batch_size=cfg.embedding_batch_size,
+            max_wait=cfg.embedding_batch_window,
+            cache_size=cfg.embedding_cache_size,
+            name=self.name,
+        )
+
+    def _encode(self, texts: List[str]) -> List[array]:
+        model = load_model(self.model, self.device)
+        vectors = model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+        # Packed float32 for the cache: a list of Python floats takes about 8 times the memory
+        return [array("f", vector.astype("float32").tobytes()) for vector in vectors]
+
+    def run(self, kickoff_message):
+        """Synchronous, unbatched embedding of a request body (outside the mesh)"""
+        texts = self._parse(kickoff_message)
+        return [{"role": "assistant", "content": self._reply(self._encode(texts))}]
+
+    @staticmethod
+    def _parse(content: str) -> List[str]:
+        try:
+            request = json.loads(content)
+        except json.JSONDecodeError:
+            return [content]  # a bare string is one text
+        texts = request.get("texts") if isinstance(request, dict) else request
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise ValueError("Embedding requests need {\"texts\": [str, ...]}")
+        return texts
+
+    def _reply(self, vectors: Sequence[array]) -> str:
+        return json.dumps({
+            "model": self.model,
+            "dim": len(vectors[0]) if vectors else 0,
+            "vectors": [vector.tolist() for vector in vectors],
+        })
+
+    async def _run_agent(self, content: str) -> str:
+        try:
+            texts = self._parse(content)
+        except ValueError as error:
+            return json.dumps({"error": str(error)})
+        return self._reply(await self.batcher.embed(texts))
+
+    async def connect_nats(self, capabilities: Optional[List[str]] = None, description: Optional[str] = None,
+                           topics: Optional[List[str]] = None):
+        # Load the model before announcing, so the first request doesn't pay for it
+        await asyncio.get_running_loop().run_in_executor(None, load_model, self.model, self.device)
+        await super().connect_nats(
+            capabilities=capabilities or ["embeddings"],
+            description=description or f"Text embeddings ({self.model})",
+            topics=topics,
+        )
+
+    async def disconnect_nats(self, drain: bool = True, drain_timeout: Optional[float] = None):
+        await super().disconnect_nats(drain=drain, drain_timeout=drain_timeout)
+        self.batcher.close()
+
+
+async def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve text embeddings on the agent mesh")
+    parser.add_argument("--name", default=nats_config.embedding_agent)
+    parser.add_argument("--model", default=nats_config.embedding_model)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--batch-size", type=int, default=nats_config.embedding_batch_size)
+    parser.add_argument("--batch-window", type=float, default=nats_config.embedding_batch_window,
+                        help="Seconds to wait for more texts before a forward pass")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    nats_config.embedding_batch_size = args.batch_size
+    nats_config.embedding_batch_window = args.batch_window
+
+    agent = EmbeddingAgent(name=args.name, model=args.model, device=args.device)
+    await agent.connect_nats()
+    logger.info(f"{agent.name} serving {agent.model} embeddings")
+    try:
+        await agent.wait_until_stopped()
+    finally:
+        await agent.disconnect_nats()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
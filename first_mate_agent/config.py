@@ -57,7 +57,10 @@ class AgentConfig(BaseSettings):
     name: str = Field(default="First-Mate Agent", description="Agent name")
     max_context_length: int = Field(default=8000, description="Maximum context length")
     context_consolidation_threshold: int = Field(default=6000, description="Context consolidation threshold")
+    prune_threshold: int = Field(default=3000, description="Tokens past which stale tool output is pruned")
+    rolling_summary_threshold: int = Field(default=4000, description="Tokens past which the oldest turns are summarized in the background")
     memory_retention_days: int = Field(default=90, description="Memory retention in days")
+    tool_timeout: float = Field(default=60.0, description="Seconds before a tool call is abandoned")
     
     class Config:
         env_prefix = "AGENT_"
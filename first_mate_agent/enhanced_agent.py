@@ -4,15 +4,30 @@ Extends the original Agent with advanced capabilities
 """
 import json
 import random
-from typing import List, Dict, Any, Optional, Callable
+import time
+from typing import List, Dict, Any, Optional, Callable, Literal
 from datetime import datetime
 from .lm_client import lm_client
 from .config import config
 from .logger import logger
+from agent_loop import assistant_message, run_until_done
+from context_pruning import PruningPolicy, prune_tool_outputs
+from conversation import CONSOLIDATE_PROMPT, Conversation, PrefixReuse
+from rolling_summary import RollingSummarizer, openai_summarizer
+from agent_metrics import record_completion
+from agent_tracing import tracer
+from tool_executor import ToolExecutor, ToolLimits
+from tool_registry import ToolRegistry, tool
 
 
-def get_current_weather(location: str, unit: str = "celsius") -> str:
-    """Get current weather for a location"""
+@tool
+def get_current_weather(location: str, unit: Literal["celsius", "fahrenheit"] = "celsius") -> str:
+    """
+    Get the current weather in a given location
+
+    Args:
+        location: The city and state, e.g. San Francisco, CA
+    """
     return f"The weather in {location} is Sunny and {random.randint(40, 80)} degrees {unit}."
 
 
@@ -34,85 +49,110 @@ class EnhancedAgent:
         self.max_context_length = max_context_length or config.agent.max_context_length
         self.context_consolidation_threshold = config.agent.context_consolidation_threshold
         
-        # Initialize message history
-        self.messages = [
-            {"role": "system", "content": self.instructions}
-        ]
+        # Initialize message history: fixed system prompt, then append-only turns
+        self.messages = Conversation(self.instructions)
+        self.prefix_reuse = PrefixReuse(self.name)
+        
+        # Old tool output is pruned by rule first, then the oldest turns are summarized in the
+        # background; consolidate_context() remains the backstop
+        self.pruning_policy = PruningPolicy(threshold_tokens=config.agent.prune_threshold)
+        self.summarizer = RollingSummarizer(
+            openai_summarizer(lm_client.client, self.model, agent=self.name),
+            threshold_tokens=config.agent.rolling_summary_threshold,
+            name=self.name,
+        )
+        
+        # Tool functions by name, with argument validation
+        self.registry = ToolRegistry(get_current_weather)
         
-        # Tool function registry
-        self.tool_functions = {
-            "get_current_weather": get_current_weather
-        }
+        # Runs the tool calls of a completion concurrently; repeated weather lookups are reused for 10 minutes
+        self.tool_executor = ToolExecutor(
+            self.name,
+            limits={"get_current_weather": ToolLimits(timeout=config.agent.tool_timeout, cache_ttl=600)},
+            default_timeout=config.agent.tool_timeout,
+        )
         
         logger.info(f"Enhanced Agent '{self.name}' initialized with {len(self.tools)} tools")
     
     def add_tool(self, tool_name: str, tool_function: Callable, tool_schema: Dict[str, Any]):
         """Add a new tool to the agent"""
         self.tools.append(tool_schema)
-        self.tool_functions[tool_name] = tool_function
+        self.registry.register(tool_function, schema=tool_schema)
         logger.info(f"Added tool '{tool_name}' to agent")
     
     def consolidate_context(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Consolidate context when it gets too long"""
         try:
-            # Use LM Studio to consolidate context
-            consolidated_content = lm_client.consolidate_context(messages)
-            
-            # Recreate messages list with consolidated context
-            consolidated_messages = [
-                {"role": "system", "content": self.instructions},
-                {"role": "user", "content": f"Previous conversation summary: {consolidated_content}"}
-            ]
+            # Ask for the summary after the history, so the history is served from the KV cache
+            request = messages.with_control(CONSOLIDATE_PROMPT)
+            self.prefix_reuse.observe(request, self.tools)
+            completion = lm_client.chat_completion(
+                messages=request,
+                tools=self.tools if self.tools else None,
+                tool_choice="auto"
+            )
             
             logger.info("Context consolidated successfully")
-            return consolidated_messages
+            return messages.consolidated(completion["content"])
             
         except Exception as error:
             logger.error(f"Context consolidation failed: {error}")
-            # Fallback: keep only recent messages
-            return messages[-10:] if len(messages) > 10 else messages
+            # Fallback: keep the system prompt and the recent turns, starting at a non-tool message
+            recent = messages.history[-10:]
+            while recent and recent[0].get("role") == "tool":
+                recent.pop(0)
+            return Conversation(self.instructions, recent)
     
-    def should_consolidate_context(self) -> bool:
-        """Check if context should be consolidated"""
-        total_tokens = sum(len(str(msg).split()) for msg in self.messages)
-        return total_tokens > self.context_consolidation_threshold
+    def should_consolidate_context(self, messages: Optional[Conversation] = None) -> bool:
+        """Check if context should be consolidated (the conversation keeps a running token count)"""
+        messages = self.messages if messages is None else messages
+        return messages.tokens > self.context_consolidation_threshold
     
     def prompt(self, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Process a prompt and handle tool calls"""
         try:
-            # Check if context needs consolidation
-            if self.should_consolidate_context():
+            # Prune stale tool output (no LLM call), then fold the oldest turns into summaries
+            # without waiting; consolidate only if still too long
+            if not self.summarizer.pending:
+                messages = prune_tool_outputs(messages, self.pruning_policy, agent=self.name)
+            messages = self.summarizer.compact(messages)
+            if self.should_consolidate_context(messages):
                 logger.info("Context length exceeded threshold, consolidating...")
                 messages = self.consolidate_context(messages)
             
             # Get completion from LM Studio
-            completion = lm_client.chat_completion(
-                messages=messages,
-                tools=self.tools if self.tools else None,
-                tool_choice="auto"
-            )
+            self.prefix_reuse.observe(messages, self.tools)
+            started = time.perf_counter()
+            with tracer.span("llm.completion", agent=self.name, model=self.model):
+                completion = lm_client.chat_completion(
+                    messages=messages,
+                    tools=self.tools if self.tools else None,
+                    tool_choice="auto"
+                )
+            record_completion(self.name, self.model, started, completion)
+            self.last_completion = completion
             
-            # Extract content and handle thinking tags
-            content = completion["content"]
+            # Extract content and handle thinking tags; a turn with only tool calls has no content
+            content = completion["content"] or ""
             if "<think>" in content and "</think>" in content:
                 # Extract the response after thinking
                 content = content.split("</think>")[-1].strip()
             
             logger.debug(f"Agent response: {content[:100]}...")
             
-            # Add assistant response to messages
-            messages.append({"role": "assistant", "content": content})
+            # Add assistant response (with its tool calls) to messages
+            messages.append(assistant_message(completion, content=content))
             
             # Handle tool calls if present
             if completion.get("tool_calls"):
                 logger.info(f"Processing {len(completion['tool_calls'])} tool calls")
-                for tool_call in completion["tool_calls"]:
-                    messages = self.handle_tool_call(tool_call, messages)
+                messages = self.tool_executor.execute(completion["tool_calls"], self.handle_tool_call, messages)
             
             return messages
             
         except Exception as error:
             logger.error(f"Prompt processing failed: {error}")
+            self.last_completion = {"finish_reason": "error"}
             # Add error message to conversation
             messages.append({
                 "role": "assistant", 
@@ -163,25 +203,11 @@ class EnhancedAgent:
             
             logger.info(f"Executing tool: {tool_name} with args: {tool_arguments}")
             
-            # Find and execute the tool function
-            if tool_name in self.tool_functions:
-                tool_function = self.tool_functions[tool_name]
-                result = tool_function(**tool_arguments)
-                
-                # Add tool result to messages
-                messages.append({
-                    "role": "tool",
-                    "content": str(result)
-                })
-                
-                logger.info(f"Tool '{tool_name}' executed successfully")
-            else:
-                error_msg = f"Tool '{tool_name}' not found"
-                logger.error(error_msg)
-                messages.append({
-                    "role": "tool",
-                    "content": error_msg
-                })
+            # Validate and execute the tool function
+            messages.append({
+                "role": "tool",
+                "content": self.registry.execute(tool_name, tool_arguments)
+            })
             
             return messages
             
@@ -195,44 +221,8 @@ class EnhancedAgent:
     
     def handle_tool_call(self, tool_call: Any, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """Handle a tool call"""
-        try:
-            tool_name = tool_call.function.name
-            tool_arguments = json.loads(tool_call.function.arguments)
-            
-            logger.info(f"Executing tool: {tool_name} with args: {tool_arguments}")
-            
-            # Find and execute the tool function
-            if tool_name in self.tool_functions:
-                tool_function = self.tool_functions[tool_name]
-                result = tool_function(**tool_arguments)
-                
-                # Add tool result to messages
-                messages.append({
-                    "role": "tool",
-                    "content": str(result),
-                    "tool_call_id": tool_call.id
-                })
-                
-                logger.info(f"Tool '{tool_name}' executed successfully")
-            else:
-                error_msg = f"Tool '{tool_name}' not found"
-                logger.error(error_msg)
-                messages.append({
-                    "role": "tool",
-                    "content": error_msg,
-                    "tool_call_id": tool_call.id
-                })
-            
-            return messages
-            
-        except Exception as error:
-            logger.error(f"Tool call handling failed: {error}")
-            messages.append({
-                "role": "tool",
-                "content": f"Tool execution failed: {str(error)}",
-                "tool_call_id": tool_call.id
-            })
-            return messages
+        logger.info(f"Executing tool: {tool_call.function.name} with args: {tool_call.function.arguments}")
+        return self.registry.handle_tool_call(tool_call, messages, agent=self.name)
     
     def run(self, kickoff_message: str) -> List[Dict[str, str]]:
         """Run a single interaction"""
@@ -244,55 +234,13 @@ class EnhancedAgent:
         
         return self.messages
     
-    def agentic_run(self, kickoff_message: str, max_iterations: int = 10) -> List[Dict[str, str]]:
-        """Run an agentic loop with automatic continuation"""
+    def agentic_run(self, kickoff_message: str, max_iterations: int = 10,
+                    token_budget: Optional[int] = None) -> List[Dict[str, str]]:
+        """Run an agentic loop: one completion per iteration until the model answers without tool calls"""
         logger.info(f"Starting agentic run: {kickoff_message[:50]}...")
         
-        # Initial run
         self.messages.append({"role": "user", "content": kickoff_message})
-        results = self.prompt(self.messages)
-        self.messages = results
-        
-        # Agentic loop
-        iteration = 0
-        while iteration < max_iterations:
-            iteration += 1
-            logger.info(f"Agentic iteration {iteration}/{max_iterations}")
-            
-            # Check if task is complete
-            check_messages = self.messages.copy()
-            check_messages.append({
-                "role": "user", 
-                "content": "Has the original task been completed? Respond with only 'yes' (completed) or 'no' (continue) with no other text."
-            })
-            
-            try:
-                completion = lm_client.chat_completion(check_messages)
-                response = completion["content"].lower().strip()
-                
-                if "yes" in response:
-                    logger.info("Task completed successfully")
-                    break
-                elif "no" in response:
-                    # Continue with the task
-                    self.messages.append({
-                        "role": "user", 
-                        "content": "Please continue working on the original task."
-                    })
-                    results = self.prompt(self.messages)
-                    self.messages = results
-                else:
-                    logger.warning(f"Unexpected completion response: {response}")
-                    break
-                    
-            except Exception as error:
-                logger.error(f"Agentic loop error: {error}")
-                break
-        
-        if iteration >= max_iterations:
-            logger.warning(f"Agentic run reached maximum iterations ({max_iterations})")
-        
-        return self.messages
+        return run_until_done(self, max_iterations=max_iterations, token_budget=token_budget)
     
     def get_conversation_summary(self) -> str:
         """Get a summary of the current conversation"""
@@ -315,31 +263,12 @@ class EnhancedAgent:
     
     def reset_conversation(self):
         """Reset the conversation history"""
-        self.messages = [{"role": "system", "content": self.instructions}]
+        self.messages = Conversation(self.instructions)
         logger.info("Conversation reset")
 
 
 # Default tools configuration
-DEFAULT_TOOLS = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_current_weather",
-            "description": "Get the current weather in a given location",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {
-                        "type": "string",
-                        "description": "The city and state, e.g. San Francisco, CA",
-                    },
-                    "unit": {"type": "string", "enum": ["celsius", "fahrenheit"]},
-                },
-                "required": ["location"],
-            },
-        }
-    }
-]
+DEFAULT_TOOLS = [get_current_weather.__tool__.schema]
 
 
 # Create default agent instance
@@ -1,17 +1,18 @@
 """
 LM Studio client for First Mate Agent using OpenAI-compatible API
 """
-from openai import OpenAI
 from typing import List, Dict, Any, Optional
 from .config import config
 from .logger import logger
+from llm_gateway import llm_client
 
 
 class LMStudioClient:
     """Client for interacting with LM Studio via OpenAI-compatible API"""
     
     def __init__(self):
-        self.client = OpenAI(
+        # Shared with every agent in the process talking to the same server
+        self.client = llm_client(
             base_url=config.lm_studio.base_url,
             api_key=config.lm_studio.api_key
         )
@@ -61,6 +62,7 @@ class LMStudioClient:
             result = {
                 "content": response.choices[0].message.content,
                 "tool_calls": response.choices[0].message.tool_calls,
+                "finish_reason": response.choices[0].finish_reason,
                 "usage": response.usage,
                 "model": response.model
             }
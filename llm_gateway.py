@@ -0,0 +1,266 @@
+"""
+LLM Gateway
+
+One process-wide client for every agent's chat completions, instead of an
+OpenAI client per module or agent instance:
+
+- one AsyncOpenAI client and HTTP connection pool per backend (base URL and
+  API key), with keep-alive, so all agents in a process share sockets
+- a concurrency limit per backend: at most max_concurrency requests are in
+  flight against one model server, and the rest queue in the process instead
+  of piling onto LM Studio
+- connect and read timeouts, and retries with exponential backoff and jitter
+  on 429, 5xx, timeouts and connection errors (honouring Retry-After); a
+  request waiting to retry gives up its slot
+
+The async clients run on one event loop in a background thread. Agents get a
+drop-in for a synchronous OpenAI client from llm_client(), so they keep calling
+`client.chat.completions.create(...)` (with stream=True too); async code can
+`await client.acreate(...)` instead.
+
+    client = llm_client()  # LM_STUDIO_BASE_URL
+    client = llm_client(base_url=os.environ.get("OPENAI_BASE_URL"), api_key=os.environ.get("GROQ_API_KEY"))
+"""
+
+import os
+import queue
+import random
+import asyncio
+import logging
+import threading
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+from openai import (
+    DEFAULT_CONNECTION_LIMITS, APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI,
+    DefaultAsyncHttpxClient, Timeout,
+)
+
+from agent_metrics import LLM_INFLIGHT, LLM_QUEUED, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BASE_URL = "http://127.0.0.1:1234/v1"
+DEFAULT_API_KEY = "lm-studio"
+RETRY_STATUSES = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+_END = object()  # marks the end of a stream in a chunk queue
+
+# The connection-limits type of the HTTP library openai was built on, without importing that library
+Limits = type(DEFAULT_CONNECTION_LIMITS)
+
+
+@dataclass
+class GatewayLimits:
+    """Connection pool, concurrency, timeout and retry settings, applied to each backend"""
+
+    max_concurrency: int = field(default_factory=lambda: int(os.getenv("LLM_MAX_CONCURRENCY", "4")))  # requests in flight
+    max_connections: int = 16
+    max_keepalive_connections: int = 8
+    keepalive_expiry: float = 120.0  # seconds an idle connection is kept open
+    connect_timeout: float = 5.0
+    timeout: float = 600.0  # seconds to wait for response data; local reasoning models are slow
+    max_retries: int = 3
+    backoff_base: float = 0.5  # seconds before the first retry, doubled for each one after
+    backoff_max: float = 20.0
+
+
+class _Backend:
+    """The pooled client and request slots for one base URL and API key"""
+
+    def __init__(self, base_url: str, api_key: Optional[str], limits: GatewayLimits):
+        self.name = urlsplit(base_url).netloc or base_url
+        self.limits = limits
+        timeout = Timeout(limits.timeout, connect=limits.connect_timeout)
+        self.client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=0,  # retried by the gateway, outside the concurrency slot
+            http_client=DefaultAsyncHttpxClient(
+                timeout=timeout,
+                limits=Limits(
+                    max_connections=limits.max_connections,
+                    max_keepalive_connections=limits.max_keepalive_connections,
+                    keepalive_expiry=limits.keepalive_expiry,
+                ),
+            ),
+        )
+        self.slots = asyncio.Semaphore(limits.max_concurrency)
+
+
+class LLMGateway:
+    """Chat completions for every agent in the process, through one pooled client per backend"""
+
+    def __init__(self, limits: Optional[GatewayLimits] = None):
+        self.limits = limits or GatewayLimits()
+        self._backends: Dict[Tuple[str, Optional[str]], _Backend] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The gateway's event loop, started on first use"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def client(self, base_url: Optional[str] = None, api_key: Optional[str] = DEFAULT_API_KEY) -> "GatewayClient":
+        """A client for `base_url` (default LM_STUDIO_BASE_URL); clients for the same backend share it"""
+        base_url = base_url or os.getenv("LM_STUDIO_BASE_URL", DEFAULT_BASE_URL)
+        with self._lock:
+            backend = self._backends.get((base_url, api_key))
+            if backend is None:
+                backend = self._backends[(base_url, api_key)] = _Backend(base_url, api_key, self.limits)
+                logger.info(f"LLM gateway: new backend {backend.name} "
+                            f"(max {self.limits.max_concurrency} concurrent requests)")
+        return GatewayClient(self, backend)
+
+    def _retry_delay(self, backend: _Backend, error: Exception, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying after `error`, or None if it shouldn't be retried"""
+        if attempt >= self.limits.max_retries:
+            return None
+        if isinstance(error, APIStatusError):
+            if error.status_code not in RETRY_STATUSES:
+                return None
+            reason = str(error.status_code)
+            retry_after = error.response.headers.get("retry-after")
+        else:
+            reason = "timeout" if isinstance(error, APITimeoutError) else "connection"
+            retry_after = None
+        LLM_RETRIES.labels(backend.name, reason).inc()
+        try:
+            if retry_after:
+                return min(float(retry_after), self.limits.backoff_max)
+        except ValueError:
+            pass  # an HTTP date; use the backoff
+        return min(self.limits.backoff_max, self.limits.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    async def _call(self, backend: _Backend, request: Dict[str, Any],
+                    deliver: Optional[Callable[[Any], Any]] = None) -> Any:
+        """
+        Run one completion on the gateway loop; returns it, or passes each chunk to `deliver` if streamed.
+
+        Only opening the request is retried; a stream that fails part way raises.
+        """
+        attempt = 0
+        while True:
+            LLM_QUEUED.labels(backend.name).inc()
+            try:
+                await backend.slots.acquire()
+            finally:
+                LLM_QUEUED.labels(backend.name).dec()
+            LLM_INFLIGHT.labels(backend.name).inc()
+            streamed = 0
+            try:
+                response = await backend.client.chat.completions.create(**request)
+                if deliver is None:
+                    return response
+                try:
+                    async for chunk in response:
+                        streamed += 1
+                        deliver(chunk)
+                finally:
+                    await response.close()
+                return None
+            except (APIStatusError, APIConnectionError) as error:
+                delay = None if streamed else self._retry_delay(backend, error, attempt)
+                if delay is None:
+                    raise
+                failure = error
+            finally:
+                LLM_INFLIGHT.labels(backend.name).dec()
+                backend.slots.release()
+            attempt += 1
+            logger.warning(f"LLM gateway: {backend.name} failed ({failure}); retry {attempt} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    def _submit(self, coroutine):
+        if threading.current_thread() is self._thread:
+            coroutine.close()
+            raise RuntimeError("Synchronous LLM calls can't be made from the gateway's event loop; use acreate()")
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+class ChunkStream:
+    """The chunks of a streamed completion, read on the gateway loop and handed to the calling thread"""
+
+    def __init__(self, gateway: LLMGateway, backend: _Backend, request: Dict[str, Any]):
+        self._chunks: "queue.Queue[Any]" = queue.Queue()
+        self._future = gateway._submit(gateway._call(backend, request, self._chunks.put))
+        self._future.add_done_callback(lambda _: self._chunks.put(_END))
+
+    def __iter__(self) -> "ChunkStream":
+        return self
+
+    def __next__(self) -> Any:
+        chunk = self._chunks.get()
+        if chunk is _END:
+            self._chunks.put(_END)
+            self._future.result()  # the stream's error, if it failed
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        """Stop reading the stream and free its slot"""
+        self._future.cancel()
+
+    def __enter__(self) -> "ChunkStream":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class GatewayClient:
+    """A drop-in for an OpenAI client's chat.completions.create, going through the gateway"""
+
+    def __init__(self, gateway: LLMGateway, backend: _Backend):
+        self.gateway = gateway
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **request: Any) -> Any:
+        """A chat completion, or a ChunkStream with stream=True; blocks the calling thread"""
+        if request.get("stream"):
+            return ChunkStream(self.gateway, self.backend, request)
+        return self.gateway._submit(self.gateway._call(self.backend, request)).result()
+
+    async def acreate(self, **request: Any) -> Any:
+        """create() for async code, without blocking the caller's event loop; streams are async iterators"""
+        if not request.get("stream"):
+            return await asyncio.wrap_future(self.gateway._submit(self.gateway._call(self.backend, request)))
+        loop = asyncio.get_running_loop()
+        chunks: "asyncio.Queue[Any]" = asyncio.Queue()
+        future = self.gateway._submit(self.gateway._call(
+            self.backend, request, lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+        ))
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(chunks.put_nowait, _END))
+        return self._aiter(chunks, future)
+
+    @staticmethod
+    async def _aiter(chunks: "asyncio.Queue[Any]", future) -> AsyncIterator[Any]:
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is _END:
+                    future.result()
+                    return
+                yield chunk
+        finally:
+            future.cancel()
+
+
+gateway = LLMGateway()
+
+
+def llm_client(base_url: Optional[str] = None, api_key: Optional[str] = DEFAULT_API_KEY) -> GatewayClient:
+    """A client on the process-wide gateway; see LLMGateway.client()"""
+    return gateway.client(base_url, api_key)
@@ -0,0 +1,356 @@
+"""
+Mock LLM Server
+
+A local OpenAI-compatible server for deterministic performance testing.
+It speaks /v1/chat/completions (plain JSON and SSE streaming) and /v1/models,
+so agents can be benchmarked without LM Studio or a GPU.
+
+Controls:
+- Timing: time-to-first-token, tokens/sec and output length
+- Scripted responses: content, tool_calls, errors and per-step timing from a JSON file
+- Injected errors: a seeded error rate with a configurable HTTP status
+- <think> blocks: prefix replies with a qwen3-style reasoning block
+
+Usage:
+    python mock_llm_server.py --port 1234 --ttft 0.3 --tokens-per-sec 40 --output-tokens 80 --think-tokens 30
+    LM_STUDIO_BASE_URL=http://127.0.0.1:1234/v1 python nats_ooda_agent.py
+
+Script file format (steps are served in order, then the last step repeats unless --script-loop):
+    [
+      {"tool_calls": [{"name": "get_current_weather", "arguments": {"location": "Boston"}}]},
+      {"content": "It is sunny in Boston.", "think": "The tool said sunny."},
+      {"error": {"status": 503, "message": "model reloading"}}
+    ]
+"""
+
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VOCABULARY = [
+    "the", "agent", "weather", "is", "sunny", "today", "and", "tomorrow", "looks", "clear",
+    "with", "light", "wind", "from", "west", "so", "plan", "a", "trip", "outdoors",
+]
+
+
+@dataclass
+class MockLLMConfig:
+    """Behaviour of the mock server"""
+
+    ttft: float = 0.2  # seconds before the first token
+    tokens_per_sec: float = 50.0
+    output_tokens: int = 40
+    think_tokens: int = 0  # size of the <think> block, 0 to disable
+    error_rate: float = 0.0
+    error_status: int = 500
+    model: str = "qwen/qwen3-32b"
+    seed: int = 0
+    script: List[Dict[str, Any]] = field(default_factory=list)
+    script_loop: bool = False
+
+
+class MockLLMState:
+    """Shared, thread-safe state: scripted step cursor, RNG and counters"""
+
+    def __init__(self, config: MockLLMConfig):
+        self.config = config
+        self._lock = threading.Lock()
+        self._rng = random.Random(config.seed)
+        self._step = 0
+        self.stats = {"requests": 0, "streamed": 0, "errors": 0, "completion_tokens": 0}
+
+    def next_step(self) -> Dict[str, Any]:
+        """Return the scripted step for this request (empty when unscripted)"""
+        with self._lock:
+            self.stats["requests"] += 1
+            script = self.config.script
+            if not script:
+                return {}
+            if self.config.script_loop:
+                step = script[self._step % len(script)]
+            else:
+                step = script[min(self._step, len(script) - 1)]
+            self._step += 1
+            return step
+
+    def inject_error(self) -> bool:
+        with self._lock:
+            return self.config.error_rate > 0 and self._rng.random() < self.config.error_rate
+
+    def record(self, key: str, amount: int = 1):
+        with self._lock:
+            self.stats[key] += amount
+
+
+def make_words(count: int, offset: int = 0) -> List[str]:
+    """Deterministic filler text, one word per token"""
+    return [VOCABULARY[(offset + i) % len(VOCABULARY)] for i in range(count)]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token)"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def build_reply(step: Dict[str, Any], config: MockLLMConfig, max_tokens: Optional[int]) -> Dict[str, Any]:
+    """Work out the text pieces, tool calls and finish reason for one completion"""
+    think_tokens = step.get("think_tokens", config.think_tokens)
+    think = step.get("think")
+    if think is None and think_tokens:
+        think = " ".join(make_words(think_tokens, offset=7))
+
+    tool_calls = [
+        {
+            "id": f"call_{uuid.uuid4().hex[:12]}",
+            "type": "function",
+            "function": {
+                "name": call["name"],
+                "arguments": call["arguments"] if isinstance(call.get("arguments"), str)
+                else json.dumps(call.get("arguments", {})),
+            },
+        }
+        for call in step.get("tool_calls", [])
+    ]
+
+    if "content" in step:
+        words = step["content"].split(" ") if step["content"] else []
+    elif tool_calls:
+        words = []
+    else:
+        words = make_words(step.get("output_tokens", config.output_tokens))
+
+    finish_reason = "tool_calls" if tool_calls else "stop"
+    if max_tokens is not None and len(words) > max_tokens:
+        words = words[:max_tokens]
+        finish_reason = "length"
+
+    pieces = []
+    if think:
+        pieces.append("<think>")
+        pieces.extend(word + " " for word in think.split(" "))
+        pieces.append("</think>\n\n")
+    pieces.extend(word if i == len(words) - 1 else word + " " for i, word in enumerate(words))
+
+    return {
+        "pieces": pieces,
+        "tool_calls": tool_calls,
+        "finish_reason": step.get("finish_reason", finish_reason),
+        "completion_tokens": len(pieces) + sum(estimate_tokens(c["function"]["arguments"]) for c in tool_calls),
+    }
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """Request handler implementing the OpenAI chat completions surface"""
+
+    protocol_version = "HTTP/1.1"
+    state: MockLLMState = None  # set by create_server
+
+    def log_message(self, format: str, *args: Any):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self.state.record("errors")
+        headers = {"Retry-After": "1"} if status == 429 else None
+        self._send_json(status, {
+            "error": {"message": message, "type": "mock_error", "code": status}
+        }, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {
+                "object": "list",
+                "data": [{"id": self.state.config.model, "object": "model", "owned_by": "mock"}],
+            })
+        elif self.path.rstrip("/") == "/mock/stats":
+            self._send_json(200, dict(self.state.stats))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_error(400, "Request body is not valid JSON")
+            return
+
+        config = self.state.config
+        step = self.state.next_step()
+
+        error = step.get("error")
+        if error:
+            self._send_error(error.get("status", config.error_status), error.get("message", "Scripted error"))
+            return
+        if self.state.inject_error():
+            self._send_error(config.error_status, "Injected error")
+            return
+
+        reply = build_reply(step, config, request.get("max_tokens"))
+        prompt_tokens = estimate_tokens(json.dumps(request.get("messages", [])))
+        ttft = step.get("ttft", config.ttft)
+        token_delay = 1.0 / step.get("tokens_per_sec", config.tokens_per_sec)
+        model = request.get("model") or config.model
+        self.state.record("completion_tokens", reply["completion_tokens"])
+
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": reply["completion_tokens"],
+            "total_tokens": prompt_tokens + reply["completion_tokens"],
+        }
+
+        if request.get("stream"):
+            self.state.record("streamed")
+            self._stream(reply, model, ttft, token_delay, usage,
+                         include_usage=bool((request.get("stream_options") or {}).get("include_usage")))
+        else:
+            time.sleep(ttft + token_delay * reply["completion_tokens"])
+            message: Dict[str, Any] = {"role": "assistant", "content": "".join(reply["pieces"]) or None}
+            if reply["tool_calls"]:
+                message["tool_calls"] = reply["tool_calls"]
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": reply["finish_reason"]}],
+                "usage": usage,
+            })
+
+    def _stream(self, reply: Dict[str, Any], model: str, ttft: float, token_delay: float,
+                usage: Dict[str, int], include_usage: bool):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta: Dict[str, Any], finish_reason: Optional[str] = None, **extra: Any):
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            payload.update(extra)
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            time.sleep(ttft)
+            chunk({"role": "assistant", "content": ""})
+            for piece in reply["pieces"]:
+                chunk({"content": piece})
+                time.sleep(token_delay)
+            for index, call in enumerate(reply["tool_calls"]):
+                chunk({"tool_calls": [{
+                    "index": index, "id": call["id"], "type": "function",
+                    "function": {"name": call["function"]["name"], "arguments": ""},
+                }]})
+                arguments = call["function"]["arguments"]
+                for start in range(0, len(arguments), 8):
+                    chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + 8]}}]})
+                    time.sleep(token_delay * 2)
+            chunk({}, reply["finish_reason"])
+            if include_usage:
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [], "usage": usage}
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("Client disconnected mid-stream")
+
+
+def create_server(config: MockLLMConfig, host: str = "127.0.0.1", port: int = 1234) -> ThreadingHTTPServer:
+    """Create (but do not start) a mock server; port 0 picks a free port"""
+    handler = type("BoundMockLLMHandler", (MockLLMHandler,), {"state": MockLLMState(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_mock_server(config: Optional[MockLLMConfig] = None, host: str = "127.0.0.1",
+                      port: int = 0) -> ThreadingHTTPServer:
+    """Start a mock server on a background thread; the base URL is f"http://{host}:{server.server_port}/v1" """
+    server = create_server(config or MockLLMConfig(), host, port)
+    thread = threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--ttft", type=float, default=0.2, help="Seconds to first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0)
+    parser.add_argument("--output-tokens", type=int, default=40)
+    parser.add_argument("--think-tokens", type=int, default=0, help="Emit a <think> block of this many tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--model", default="qwen/qwen3-32b")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--script", help="JSON file with scripted responses")
+    parser.add_argument("--script-loop", action="store_true", help="Cycle the script instead of repeating the last step")
+    args = parser.parse_args(argv)
+
+    script = []
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+
+    config = MockLLMConfig(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        output_tokens=args.output_tokens,
+        think_tokens=args.think_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        model=args.model,
+        seed=args.seed,
+        script=script,
+        script_loop=args.script_loop,
+    )
+    server = create_server(config, args.host, args.port)
+    logger.info(f"Mock LLM server listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down mock LLM server")
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
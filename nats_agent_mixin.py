@@ -6,22 +6,57 @@ It enables agents to communicate via NATS like a Slack-style messaging system.
 """
 
 import asyncio
+import collections
+import contextvars
+import functools
+import json
 import logging
-from typing import Callable, Optional, Dict, Any, List
+import math
+import random
+import signal
+import time
+from typing import AsyncIterator, Callable, Optional, Dict, Any, List
 import uuid
 from datetime import datetime
 
 import nats
 from nats.aio.client import Client as NATSClient
 from nats.aio.msg import Msg
+from nats.errors import NoRespondersError
 
-from nats_config import NATSConfig, AgentMetadata, AgentMessage, nats_config
+import nats_inprocess
+from agent_registry import PeerRegistry
+from agent_jobs import (
+    Job, KVJobStore, get_local_job_store, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED,
+)
+from agent_payloads import (
+    PAYLOAD_METADATA_KEY, PayloadRef, PayloadStoreUnavailable, ObjectStorePayloadStore, get_local_store,
+)
+from nats_config import NATSConfig, AgentMetadata, AgentMessage, MessageEnvelope, nats_config
+from agent_metrics import (
+    MESSAGES_PUBLISHED, MESSAGES_RECEIVED, MESSAGES_DROPPED, REQUEST_LATENCY, REQUESTS, ERRORS,
+    INFLIGHT_WORK, QUEUED_WORK, PAYLOAD_BYTES, PEER_DETECTION_TIME, FAILOVERS,
+    HEDGED_REQUESTS, start_metrics_server,
+)
+from agent_tracing import tracer, message_sent_at
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# The job being executed in this task/thread, so report_progress() knows what to update
+_current_job: contextvars.ContextVar[Optional[Job]] = contextvars.ContextVar("agent_current_job", default=None)
+
+# Stop events of agents blocked in wait_until_stopped(); one signal stops every agent in the process
+_stop_events = set()
+
+
+def _stop_all_agents():
+    for event in list(_stop_events):
+        event.set()
+
+
 class NATSAgentMixin:
     """
     Mixin class that adds NATS messaging capabilities to any agent.
@@ -34,6 +69,10 @@ class NATSAgentMixin:
     - Agent handoff capabilities
     """
     
+    # Requests are handled one at a time because run() keeps the conversation on the
+    # agent; agents without per-request state can take them concurrently
+    concurrent_requests = False
+    
     def __init__(self, *args, **kwargs):
         # Extract NATS-specific kwargs before passing to super
         nats_cfg = kwargs.pop('nats_config', nats_config)
@@ -47,6 +86,12 @@ class NATSAgentMixin:
         self.nats_client: Optional[NATSClient] = None
         self.nats_config: NATSConfig = nats_cfg
         
+        # Claim-check store for large message content, and job records
+        self.payload_store = None
+        self.job_store = None
+        self._job_subscriptions: Dict[str, Any] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        
         # Agent metadata
         self.agent_metadata: Optional[AgentMetadata] = None
         
@@ -54,31 +99,81 @@ class NATSAgentMixin:
         self.message_handlers: Dict[str, Callable] = {}
         self.pending_responses: Dict[str, asyncio.Future] = {}
         
+        # Peers seen via announcements/heartbeats, and futures resolved when a request target dies
+        self.peer_registry = PeerRegistry(
+            heartbeat_interval=nats_cfg.heartbeat_interval,
+            phi_threshold=nats_cfg.phi_threshold,
+        )
+        self._target_watchers: Dict[str, set] = {}
+        
+        # Recent request latencies per target, and hedging budget counters
+        self._request_latencies: Dict[str, collections.deque] = {}
+        self._hedge_counts = {"requests": 0, "hedges": 0}
+        
         # Subscriptions
         self.subscriptions = []
+        self.work_subscriptions = []  # direct + request; drained first on shutdown
         
         # Background tasks
         self.background_tasks = []
         
+        # Broadcast topics of interest (None = every topic for our capabilities)
+        self.broadcast_topics: Optional[List[str]] = None
+        self._seen_broadcasts: collections.OrderedDict = collections.OrderedDict()
+        
+        # In-flight work (request handlers and agent kickoffs) and drain state
+        self.inflight_tasks = set()
+        self._request_lock = asyncio.Lock()  # serialises requests across the request subscriptions
+        self.draining = False
+        self._stop_event: Optional[asyncio.Event] = None
+        
         logger.info(f"NATSAgentMixin initialized for agent: {getattr(self, 'name', 'Unknown')}")
     
     async def connect_nats(
         self,
         capabilities: Optional[List[str]] = None,
-        description: Optional[str] = None
+        description: Optional[str] = None,
+        topics: Optional[List[str]] = None
     ):
-        """Connect to NATS and register this agent"""
+        """
+        Connect to NATS and register this agent.
+        
+        The agent receives broadcasts addressed to its capabilities; pass `topics`
+        to narrow that to specific topics (e.g. ["alerts"]).
+        """
+        self.broadcast_topics = topics
         try:
-            # Connect to NATS
-            self.nats_client = await nats.connect(
-                servers=[self.nats_config.nats_url],
-                connect_timeout=self.nats_config.connection_timeout,
-                max_reconnect_attempts=self.nats_config.max_reconnect_attempts,
-                reconnect_time_wait=self.nats_config.reconnect_time_wait,
-                error_cb=self._on_error,
-                disconnected_cb=self._on_disconnected,
-                reconnected_cb=self._on_reconnected,
-            )
+            # Connect to NATS (or the in-process broker for inproc:// URLs)
+            if self.nats_config.nats_url.startswith(nats_inprocess.INPROC_SCHEME):
+                self.nats_client = await nats_inprocess.connect(
+                    self.nats_config.nats_url,
+                    error_cb=self._on_error,
+                )
+                self.payload_store = get_local_store(
+                    self.nats_config.nats_url,
+                    self.nats_config.payload_bucket,
+                    self.nats_config.payload_chunk_size,
+                    self.nats_config.payload_ttl,
+                )
+                self.job_store = get_local_job_store(self.nats_config.nats_url)
+            else:
+                self.nats_client = await nats.connect(
+                    servers=[self.nats_config.nats_url],
+                    connect_timeout=self.nats_config.connection_timeout,
+                    max_reconnect_attempts=self.nats_config.max_reconnect_attempts,
+                    reconnect_time_wait=self.nats_config.reconnect_time_wait,
+                    error_cb=self._on_error,
+                    disconnected_cb=self._on_disconnected,
+                    reconnected_cb=self._on_reconnected,
+                )
+                self.payload_store = ObjectStorePayloadStore(
+                    self.nats_client,
+                    self.nats_config.payload_bucket,
+                    self.nats_config.payload_chunk_size,
+                    self.nats_config.payload_ttl,
+                )
+                self.job_store = KVJobStore(self.nats_client, self.nats_config.job_bucket, self.nats_config.job_ttl)
+            self._loop = asyncio.get_running_loop()
             
             logger.info(f"Connected to NATS at {self.nats_config.nats_url}")
             
@@ -91,15 +186,22 @@ class NATSAgentMixin:
                 model=getattr(self, 'model', 'unknown'),
             )
             
+            # Expose metrics if configured
+            if self.nats_config.metrics_port:
+                start_metrics_server(self.nats_config.metrics_port)
+            QUEUED_WORK.labels(self.agent_metadata.name).set_function(self._queued_message_count)
+            
             # Subscribe to channels
             await self._subscribe_to_channels()
             
             # Announce presence
             await self.announce_presence()
             
-            # Start heartbeat task
+            # Start heartbeat and failure detection tasks
             heartbeat_task = asyncio.create_task(self._heartbeat_loop())
             self.background_tasks.append(heartbeat_task)
+            failure_check_task = asyncio.create_task(self._failure_check_loop())
+            self.background_tasks.append(failure_check_task)
             
             logger.info(f"Agent '{self.agent_metadata.name}' registered on NATS")
             
@@ -117,23 +219,64 @@ class NATSAgentMixin:
         self.subscriptions.append(sub_all)
         logger.info(f"Subscribed to {self.nats_config.all_agents_channel}")
         
+        # Subscribe to peer heartbeats for failure detection
+        heartbeat_subject = self.nats_config.get_heartbeat_subscription()
+        sub_heartbeat = await self.nats_client.subscribe(heartbeat_subject, cb=self._handle_heartbeat_message)
+        self.subscriptions.append(sub_heartbeat)
+        logger.info(f"Subscribed to {heartbeat_subject}")
+        
+        # Subscribe to broadcasts for our capabilities only
+        for capability in self.agent_metadata.capabilities:
+            for topic in self.broadcast_topics or [None]:
+                subject = self.nats_config.get_broadcast_subscription(capability, topic)
+                sub_broadcast = await self.nats_client.subscribe(subject, cb=self._handle_broadcast_message)
+                self.subscriptions.append(sub_broadcast)
+                logger.info(f"Subscribed to {subject}")
+        
+        # Work channels join a queue group so replicas of this agent share the load
+        queue_group = self.nats_config.get_queue_group(self.agent_metadata.name)
+        
         # Subscribe to direct message channel
         direct_channel = self.nats_config.get_direct_channel(self.agent_metadata.name)
         sub_direct = await self.nats_client.subscribe(
             direct_channel,
+            queue=queue_group,
             cb=self._handle_direct_message
         )
         self.subscriptions.append(sub_direct)
+        self.work_subscriptions.append(sub_direct)
         logger.info(f"Subscribed to {direct_channel}")
         
         # Subscribe to request channel
         request_channel = self.nats_config.get_request_channel(self.agent_metadata.name)
         sub_request = await self.nats_client.subscribe(
             request_channel,
+            queue=queue_group,
             cb=self._handle_request_message
         )
         self.subscriptions.append(sub_request)
+        self.work_subscriptions.append(sub_request)
         logger.info(f"Subscribed to {request_channel}")
+        
+        # And to this replica's own request channel, so a hedge can go to a different replica
+        instance_channel = self.nats_config.get_instance_request_channel(
+            self.agent_metadata.name, self.agent_metadata.instance_id
+        )
+        sub_instance = await self.nats_client.subscribe(instance_channel, cb=self._handle_request_message)
+        self.subscriptions.append(sub_instance)
+        self.work_subscriptions.append(sub_instance)
+        logger.info(f"Subscribed to {instance_channel}")
+        
+        # Subscribe to job submissions
+        job_channel = self.nats_config.get_job_submit_channel(self.agent_metadata.name)
+        sub_job = await self.nats_client.subscribe(
+            job_channel,
+            queue=queue_group,
+            cb=self._handle_job_submission
+        )
+        self.subscriptions.append(sub_job)
+        self.work_subscriptions.append(sub_job)
+        logger.info(f"Subscribed to {job_channel}")
     
     async def announce_presence(self):
         """Announce this agent's presence on the all-agents channel"""
@@ -144,17 +287,14 @@ class NATSAgentMixin:
             metadata=self.agent_metadata.to_dict()
         )
         
-        await self.nats_client.publish(
-            self.nats_config.all_agents_channel,
-            message.to_bytes()
-        )
+        await self._publish(self.nats_config.all_agents_channel, message)
         logger.info(f"Announced presence: {self.agent_metadata.name}")
     
     async def _heartbeat_loop(self):
         """Send periodic heartbeat messages"""
         while self.nats_client and not self.nats_client.is_closed:
             try:
-                await asyncio.sleep(30)  # Heartbeat every 30 seconds
+                await asyncio.sleep(self.nats_config.heartbeat_interval)
                 
                 self.agent_metadata.last_heartbeat = datetime.utcnow().isoformat()
                 
@@ -164,82 +304,309 @@ class NATSAgentMixin:
                     metadata=self.agent_metadata.to_dict()
                 )
                 
-                await self.nats_client.publish(
-                    self.nats_config.all_agents_channel,
-                    message.to_bytes()
-                )
+                # Heartbeats have their own subject, so agents.all only carries announcements and broadcasts
+                await self._publish(self.nats_config.get_heartbeat_channel(self.agent_metadata.name), message)
                 
             except Exception as error:
                 logger.error(f"Heartbeat error: {error}")
+                ERRORS.labels(self.agent_metadata.name, "heartbeat").inc()
     
     async def _handle_all_agents_message(self, msg: Msg):
         """Handle messages from the all-agents channel"""
         try:
-            agent_msg = AgentMessage.from_bytes(msg.data)
-            logger.info(f"All-agents message from {agent_msg.from_agent}: {agent_msg.message_type}")
+            envelope = MessageEnvelope.from_msg(msg)
+            if self._drop_from_headers(envelope):
+                return
+            self._record_received(envelope)
             
             # Handle different message types
+            if envelope.message_type == "heartbeat":
+                # Could maintain a registry of active agents; nothing to decode yet
+                return
+            
+            agent_msg = envelope.message
+            logger.info(f"All-agents message from {agent_msg.from_agent}: {agent_msg.message_type}")
             if agent_msg.message_type == "announcement":
                 logger.info(f"Agent announcement: {agent_msg.content}")
-            elif agent_msg.message_type == "heartbeat":
-                # Could maintain a registry of active agents
-                pass
+                self._observe_peer(agent_msg)
             
         except Exception as error:
             logger.error(f"Error handling all-agents message: {error}")
+            ERRORS.labels(self.agent_metadata.name, "all_agents_handler").inc()
+    
+    async def _handle_heartbeat_message(self, msg: Msg):
+        """Feed peer heartbeats to the failure detector"""
+        try:
+            envelope = MessageEnvelope.from_msg(msg)
+            if self._drop_from_headers(envelope):
+                return
+            self._record_received(envelope)
+            self._observe_peer(envelope.message)
+        except Exception as error:
+            logger.error(f"Error handling heartbeat: {error}")
+            ERRORS.labels(self.agent_metadata.name, "heartbeat_handler").inc()
+    
+    def _observe_peer(self, message: AgentMessage):
+        """Update the peer registry from an announcement or heartbeat"""
+        if message.from_agent == self.agent_metadata.name:
+            return
+        if message.metadata.get("status") == "offline":
+            # Other replicas under the same name may still be serving
+            self.peer_registry.mark_offline(message.from_agent, message.metadata.get("instance_id"))
+            if self.peer_registry.is_down(message.from_agent):
+                self._notify_target_down(message.from_agent)
+        elif "capabilities" in message.metadata:
+            self.peer_registry.observe(AgentMetadata.from_dict(message.metadata), now=asyncio.get_running_loop().time())
+    
+    async def _failure_check_loop(self):
+        """Periodically evaluate the failure detector and fail over requests to dead peers"""
+        while self.nats_client and not self.nats_client.is_closed:
+            try:
+                await asyncio.sleep(self.nats_config.failure_check_interval)
+                for peer, silence in self.peer_registry.check(now=asyncio.get_running_loop().time()):
+                    logger.warning(f"Peer '{peer}' suspected dead (no heartbeat for {silence:.1f}s)")
+                    PEER_DETECTION_TIME.labels(self.agent_metadata.name, peer).observe(silence)
+                    self._notify_target_down(peer)
+                
+            except Exception as error:
+                logger.error(f"Failure check error: {error}")
+                ERRORS.labels(self.agent_metadata.name, "failure_check").inc()
+    
+    def _notify_target_down(self, name: str):
+        """Wake up requests waiting on a peer that is gone"""
+        for watcher in self._target_watchers.get(name, ()):
+            if not watcher.done():
+                watcher.set_result(None)
+    
+    async def _handle_broadcast_message(self, msg: Msg):
+        """Handle broadcasts addressed to one of our capabilities"""
+        try:
+            envelope = MessageEnvelope.from_msg(msg)
+            if self._drop_from_headers(envelope):
+                return
+            # A broadcast to several of our capabilities arrives once per matching subject
+            message_id = envelope.message_id
+            if message_id:
+                if message_id in self._seen_broadcasts:
+                    MESSAGES_DROPPED.labels(self.agent_metadata.name, "duplicate").inc()
+                    return
+                self._seen_broadcasts[message_id] = True
+                if len(self._seen_broadcasts) > 1024:
+                    self._seen_broadcasts.popitem(last=False)
+            self._record_received(envelope)
+            
+            agent_msg = envelope.message
+            logger.info(f"Broadcast from {agent_msg.from_agent} on {msg.subject}: {agent_msg.content}")
+            
+        except Exception as error:
+            logger.error(f"Error handling broadcast message: {error}")
+            ERRORS.labels(self.agent_metadata.name, "broadcast_handler").inc()
     
     async def _handle_direct_message(self, msg: Msg):
         """Handle direct messages sent to this agent"""
         try:
-            agent_msg = AgentMessage.from_bytes(msg.data)
+            envelope = MessageEnvelope.from_msg(msg)
+            if self._drop_from_headers(envelope):
+                return
+            self._record_received(envelope)
+            agent_msg = envelope.message
             logger.info(f"Direct message from {agent_msg.from_agent}: {agent_msg.content}")
             
             # Kick off the agent with this message
             if hasattr(self, 'agentic_run'):
                 # Run agent with the incoming message in the background
                 task = asyncio.create_task(self._handle_agent_kickoff(agent_msg))
-                self.background_tasks.append(task)
+                self.inflight_tasks.add(task)
+                task.add_done_callback(self.inflight_tasks.discard)
             else:
                 logger.warning(f"Agent {self.agent_metadata.name} doesn't have 'agentic_run' method")
             
         except Exception as error:
             logger.error(f"Error handling direct message: {error}")
+            ERRORS.labels(self.agent_metadata.name, "direct_handler").inc()
     
     async def _handle_request_message(self, msg: Msg):
-        """Handle request messages (expecting a response)"""
+        """Handle request messages (expecting a response), each in its own task"""
+        # NATS runs a subscription's callbacks one at a time, in one long-lived task;
+        # tracking a task per request lets drain wait for (and disconnect cancel) just the requests
+        if self.concurrent_requests:
+            self._track_request(msg)
+            return
+        # Leave the next request queued until this one is done, whichever request subscription
+        # (queue group or this replica's own) it came in on; wait() rather than await, so
+        # stopping the subscription doesn't cancel the request
+        async with self._request_lock:
+            await asyncio.wait({self._track_request(msg)})
+    
+    def _track_request(self, msg: Msg) -> asyncio.Task:
+        task = asyncio.create_task(self._handle_request(msg))
+        self.inflight_tasks.add(task)
+        task.add_done_callback(self.inflight_tasks.discard)
+        return task
+    
+    async def _handle_request(self, msg: Msg):
+        """Run the agent on a request and reply with its answer"""
         try:
-            agent_msg = AgentMessage.from_bytes(msg.data)
+            envelope = MessageEnvelope.from_msg(msg)
+            if self._drop_from_headers(envelope):
+                return
+            self._record_received(envelope)
+            agent_msg = envelope.message
             logger.info(f"Request from {agent_msg.from_agent}: {agent_msg.content}")
             
             # Process the request using the agent
             if hasattr(self, 'run'):
-                # Synchronous run - wrap in async
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(None, self.run, agent_msg.content)
-                
-                # Extract the response content
-                response_content = ""
-                if result and len(result) > 0:
-                    last_message = result[-1]
-                    response_content = last_message.get('content', str(result))
-                
-                # Send response
-                response_msg = AgentMessage(
+                trace_parent = self._record_queue_wait(agent_msg)
+                with tracer.span("agent.handle_request", agent=self.agent_metadata.name,
+                                 parent=trace_parent, from_agent=agent_msg.from_agent):
+                    await self.resolve_payload(agent_msg)
+                    response_content = await self._run_agent(agent_msg.content)
+                    
+                    # Send response
+                    response_msg = AgentMessage(
+                        message_type="response",
+                        from_agent=self.agent_metadata.name,
+                        to_agent=agent_msg.from_agent,
+                        content=response_content,
+                        in_reply_to=agent_msg.message_id,
+                        metadata=tracer.inject({"original_request": agent_msg.content})
+                    )
+                    
+                    # Reply to the message
+                    if msg.reply:
+                        await self._publish(msg.reply, response_msg)
+                        logger.info(f"Sent response to {agent_msg.from_agent}")
+            
+        except Exception as error:
+            logger.error(f"Error handling request message: {error}")
+            ERRORS.labels(self.agent_metadata.name, "request_handler").inc()
+    
+    async def _run_agent(self, content: str) -> str:
+        """Run the agent's synchronous run() in a worker thread and return its final message"""
+        # Carry the trace (and job) context into the worker thread
+        loop = asyncio.get_event_loop()
+        run = functools.partial(contextvars.copy_context().run, self.run, content)
+        INFLIGHT_WORK.labels(self.agent_metadata.name).inc()
+        try:
+            result = await loop.run_in_executor(None, run)
+        finally:
+            INFLIGHT_WORK.labels(self.agent_metadata.name).dec()
+        
+        # Extract the response content
+        response_content = ""
+        if result and len(result) > 0:
+            last_message = result[-1]
+            response_content = last_message.get('content', str(result))
+        return response_content
+    
+    async def _handle_job_submission(self, msg: Msg):
+        """Accept a job: acknowledge with its ID right away, then run it in the background"""
+        try:
+            envelope = MessageEnvelope.from_msg(msg)
+            if self._drop_from_headers(envelope):
+                return
+            self._record_received(envelope)
+            agent_msg = envelope.message
+            job = Job(
+                job_id=agent_msg.metadata.get("job_id") or agent_msg.message_id,
+                agent=self.agent_metadata.name,
+                submitted_by=agent_msg.from_agent,
+                message="Queued",
+            )
+            await self.job_store.put(job)
+            logger.info(f"Accepted job {job.job_id} from {agent_msg.from_agent}")
+            
+            if msg.reply:
+                await self._publish(msg.reply, AgentMessage(
                     message_type="response",
                     from_agent=self.agent_metadata.name,
                     to_agent=agent_msg.from_agent,
-                    content=response_content,
+                    content=job.job_id,
                     in_reply_to=agent_msg.message_id,
-                    metadata={"original_request": agent_msg.content}
-                )
-                
-                # Reply to the message
-                if msg.reply:
-                    await self.nats_client.publish(msg.reply, response_msg.to_bytes())
-                    logger.info(f"Sent response to {agent_msg.from_agent}")
+                ))
+            
+            task = asyncio.create_task(self._run_job(job, agent_msg))
+            self.inflight_tasks.add(task)
+            task.add_done_callback(self.inflight_tasks.discard)
             
         except Exception as error:
-            logger.error(f"Error handling request message: {error}")
+            logger.error(f"Error accepting job: {error}")
+            ERRORS.labels(self.agent_metadata.name, "job_handler").inc()
+    
+    async def _run_job(self, job: Job, message: AgentMessage):
+        """Run a job to completion, persisting its state and publishing progress events"""
+        token = _current_job.set(job)
+        try:
+            trace_parent = self._record_queue_wait(message)
+            with tracer.span("agent.job", agent=self.agent_metadata.name, parent=trace_parent,
+                             from_agent=message.from_agent, job_id=job.job_id):
+                if not hasattr(self, 'run'):
+                    raise RuntimeError(f"Agent {self.agent_metadata.name} doesn't have a 'run' method")
+                await self._update_job(job, status=JOB_RUNNING, message="Started")
+                await self.resolve_payload(message)
+                result = await self._run_agent(message.content)
+                await self._store_job_result(job, result)
+                await self._update_job(job, status=JOB_SUCCEEDED, progress=1.0, message="Completed")
+            logger.info(f"Job {job.job_id} completed")
+        except asyncio.CancelledError:
+            await self._update_job(job, status=JOB_CANCELLED, message="Agent stopped before the job finished")
+            raise
+        except Exception as error:
+            logger.error(f"Job {job.job_id} failed: {error}")
+            ERRORS.labels(self.agent_metadata.name, "job").inc()
+            await self._update_job(job, status=JOB_FAILED, message="Failed", error=str(error))
+        finally:
+            _current_job.reset(token)
+    
+    async def _update_job(self, job: Job, **changes):
+        """Apply changes to a job, persist it and publish a job event"""
+        for key, value in changes.items():
+            setattr(job, key, value)
+        job.updated_at = datetime.utcnow().isoformat()
+        try:
+            await self.job_store.put(job)
+            await self._publish(self.nats_config.get_job_channel(job.job_id), AgentMessage(
+                message_type="job_event",
+                from_agent=self.agent_metadata.name,
+                to_agent=job.submitted_by,
+                content=job.message,
+                metadata={"job": job.event()},
+            ))
+        except Exception as error:
+            logger.error(f"Error updating job {job.job_id}: {error}")
+            ERRORS.labels(self.agent_metadata.name, "job_update").inc()
+    
+    async def _store_job_result(self, job: Job, result: str):
+        """Keep small results in the job record; claim-check large ones"""
+        data = result.encode('utf-8')
+        if self.payload_store and len(data) > self.nats_config.payload_offload_threshold:
+            try:
+                ref, stored = await self.payload_store.put(data)
+                PAYLOAD_BYTES.labels(self.agent_metadata.name, "stored" if stored else "deduplicated").inc(len(data))
+                job.result_ref = ref.to_dict()
+                return
+            except Exception as error:
+                logger.warning(f"Payload store unavailable, keeping job result inline: {error}")
+        job.result = result
+    
+    def report_progress(self, progress: float, message: str = ""):
+        """
+        Report progress of the job currently being run (no-op outside a job).
+        
+        Safe to call from the agent's synchronous run() in its worker thread.
+        """
+        job = _current_job.get()
+        if job is None or self._loop is None:
+            return
+        update = self._update_job(job, progress=max(0.0, min(1.0, progress)), message=message)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            asyncio.create_task(update)
+        else:
+            asyncio.run_coroutine_threadsafe(update, self._loop)
     
     async def _handle_agent_kickoff(self, message: AgentMessage):
         """Handle agent kickoff from incoming message"""
@@ -248,108 +615,422 @@ class NATSAgentMixin:
             
             # Run the agent
             if hasattr(self, 'agentic_run'):
-                # Check if agentic_run is async
-                result = self.agentic_run(message.content)
-                if asyncio.iscoroutine(result):
-                    result = await result
-                
-                logger.info(f"Agent completed task from {message.from_agent}")
-                
-                # Optionally send completion notification back
-                completion_msg = AgentMessage(
-                    message_type="response",
-                    from_agent=self.agent_metadata.name,
-                    to_agent=message.from_agent,
-                    content=f"Completed task: {message.content[:100]}...",
-                    in_reply_to=message.message_id,
-                    metadata={"status": "completed"}
-                )
-                
-                # Send to the requester's direct channel
-                response_channel = self.nats_config.get_direct_channel(message.from_agent)
-                await self.nats_client.publish(response_channel, completion_msg.to_bytes())
+                trace_parent = self._record_queue_wait(message)
+                with tracer.span("agent.kickoff", agent=self.agent_metadata.name, parent=trace_parent,
+                                 from_agent=message.from_agent, message_type=message.message_type):
+                    await self.resolve_payload(message)
+                    
+                    INFLIGHT_WORK.labels(self.agent_metadata.name).inc()
+                    try:
+                        # Check if agentic_run is async
+                        result = self.agentic_run(message.content)
+                        if asyncio.iscoroutine(result):
+                            result = await result
+                    finally:
+                        INFLIGHT_WORK.labels(self.agent_metadata.name).dec()
+                    
+                    logger.info(f"Agent completed task from {message.from_agent}")
+                    
+                    # Optionally send completion notification back
+                    completion_msg = AgentMessage(
+                        message_type="response",
+                        from_agent=self.agent_metadata.name,
+                        to_agent=message.from_agent,
+                        content=f"Completed task: {message.content[:100]}...",
+                        in_reply_to=message.message_id,
+                        metadata=tracer.inject({"status": "completed"})
+                    )
+                    
+                    # Send to the requester's direct channel
+                    response_channel = self.nats_config.get_direct_channel(message.from_agent)
+                    await self._publish(response_channel, completion_msg)
                 
         except Exception as error:
             logger.error(f"Error in agent kickoff: {error}")
+            ERRORS.labels(self.agent_metadata.name, "kickoff").inc()
     
     async def send_direct_message(self, to_agent: str, content: str, metadata: Optional[Dict] = None):
         """Send a direct message to another agent"""
         if not self.nats_client:
             raise RuntimeError("NATS client not connected. Call connect_nats() first.")
         
-        message = AgentMessage(
-            message_type="request",
-            from_agent=self.agent_metadata.name,
-            to_agent=to_agent,
-            content=content,
-            metadata=metadata or {},
-            message_id=str(uuid.uuid4())
-        )
-        
-        channel = self.nats_config.get_direct_channel(to_agent)
-        await self.nats_client.publish(channel, message.to_bytes())
+        with tracer.span("nats.send_direct", agent=self.agent_metadata.name, target=to_agent):
+            message = AgentMessage(
+                message_type="request",
+                from_agent=self.agent_metadata.name,
+                to_agent=to_agent,
+                content=content,
+                metadata=tracer.inject(dict(metadata or {})),
+                message_id=str(uuid.uuid4())
+            )
+            
+            channel = self.nats_config.get_direct_channel(to_agent)
+            await self._publish(channel, message)
         logger.info(f"Sent direct message to {to_agent}")
     
-    async def request_from_agent(self, to_agent: str, content: str, timeout: int = 30) -> Optional[str]:
-        """Send a request to another agent and wait for response"""
+    async def request_from_agent(self, to_agent: str, content: str, timeout: int = 30,
+                                 hedge: Optional[bool] = None) -> Optional[str]:
+        """
+        Send a request to another agent and wait for response.
+        
+        With `hedge` (default: NATSConfig.hedge_requests), a request still unanswered
+        after the target's observed p95 latency is duplicated to another replica (or
+        another agent with the same capability) and the first reply wins.
+        """
         if not self.nats_client:
             raise RuntimeError("NATS client not connected. Call connect_nats() first.")
         
+        hedge = self.nats_config.hedge_requests if hedge is None else hedge
+        with tracer.span("nats.request", agent=self.agent_metadata.name, target=to_agent, hedged=hedge):
+            if hedge:
+                return await self._hedged_request(to_agent, content, timeout)
+            return await self._request(to_agent, content, timeout)
+    
+    async def _hedged_request(self, to_agent: str, content: str, timeout: float) -> Optional[str]:
+        """
+        Race the request against a delayed duplicate sent to another replica of the target.
+        
+        With several replicas, the first copy goes to one picked at random (instead of
+        via the queue group) so the duplicate can go to a different one. Without another
+        replica, the duplicate goes to another agent with the same capability.
+        
+        There is no cancel message for requests, so the losing copy keeps running
+        on its agent and that work is wasted; hedge_budget bounds how much.
+        """
+        self._hedge_counts["requests"] += 1
+        delay = self._hedge_delay(to_agent)
+        if delay is None or delay >= timeout:
+            return await self._request(to_agent, content, timeout)
+        
+        replicas = self.peer_registry.available_instances(to_agent)
+        first_replica = random.choice(replicas) if len(replicas) > 1 else None
+        primary = asyncio.ensure_future(self._request(to_agent, content, timeout, instance=first_replica))
+        backup = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+            
+            # Cap the extra load at hedge_budget of hedged requests
+            if self._hedge_counts["hedges"] + 1 > self.nats_config.hedge_budget * self._hedge_counts["requests"]:
+                HEDGED_REQUESTS.labels(self.agent_metadata.name, to_agent, "over_budget").inc()
+                return await primary
+            
+            # Never back to the replica that has the first copy: it is the slow one
+            others = [key for key in self.peer_registry.available_instances(to_agent) if key != first_replica]
+            if first_replica is not None and others:
+                backup_target, backup_replica = to_agent, random.choice(others)
+            else:
+                backup_target = self.peer_registry.find_alternative(to_agent, exclude={self.agent_metadata.name})
+                backup_replica = None
+            if backup_target is None:
+                HEDGED_REQUESTS.labels(self.agent_metadata.name, to_agent, "no_target").inc()
+                return await primary
+            self._hedge_counts["hedges"] += 1
+            HEDGED_REQUESTS.labels(self.agent_metadata.name, to_agent, "sent").inc()
+            logger.info(f"Request to {to_agent} slower than {delay:.2f}s, hedging to "
+                        f"{backup_target}{f' ({backup_replica})' if backup_replica else ''}")
+            backup = asyncio.ensure_future(
+                self._request(backup_target, content, timeout - delay, instance=backup_replica)
+            )
+            
+            pending = {primary, backup}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result is not None:
+                        outcome = "won" if task is backup else "lost"
+                        HEDGED_REQUESTS.labels(self.agent_metadata.name, to_agent, outcome).inc()
+                        return result
+            return None
+        finally:
+            # Stop waiting for the losing copy; its agent still finishes the work and the reply is dropped
+            for task in (primary, backup):
+                if task is not None and not task.done():
+                    task.cancel()
+    
+    def _hedge_delay(self, to_agent: str) -> Optional[float]:
+        """The target's observed latency percentile, or None until there are enough samples"""
+        samples = self._request_latencies.get(to_agent)
+        if not samples or len(samples) < self.nats_config.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        rank = math.ceil(self.nats_config.hedge_percentile / 100 * len(ordered))
+        return ordered[min(max(rank, 1), len(ordered)) - 1]
+    
+    async def _request(self, to_agent: str, content: str, timeout: float,
+                       tried: Optional[set] = None, instance: Optional[str] = None) -> Optional[str]:
+        """
+        Send one request/reply round-trip, recording latency.
+        
+        The request goes to the target's queue group, or to one replica if `instance`
+        is given. If the target is (or becomes, while we wait) suspected dead, the request
+        is re-sent to a peer with the same capability, or fails fast if there is none.
+        """
+        if self.peer_registry.is_down(to_agent):
+            return await self._failover(to_agent, content, timeout, tried)
+        
         message_id = str(uuid.uuid4())
         message = AgentMessage(
             message_type="request",
             from_agent=self.agent_metadata.name,
             to_agent=to_agent,
             content=content,
-            message_id=message_id
+            metadata=tracer.inject({}),
+            message_id=message_id,
+            deadline=time.time() + timeout
         )
         
+        # Timed on the event loop clock (a virtual clock under agent_simulator)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
         try:
-            # Use request/reply pattern
-            channel = self.nats_config.get_request_channel(to_agent)
-            response = await self.nats_client.request(
+            await self._offload_payload(message)
+            
+            # Use request/reply pattern, racing the reply against the target being declared dead
+            if instance:
+                channel = self.nats_config.get_instance_request_channel(to_agent, instance)
+            else:
+                channel = self.nats_config.get_request_channel(to_agent)
+            request = asyncio.ensure_future(self.nats_client.request(
                 channel,
                 message.to_bytes(),
-                timeout=timeout
-            )
+                timeout=timeout,
+                headers=message.to_headers()
+            ))
+            # Counted when sent, whether or not a reply ever arrives
+            MESSAGES_PUBLISHED.labels(self.agent_metadata.name, message.message_type).inc()
+            target_down = loop.create_future()
+            self._target_watchers.setdefault(to_agent, set()).add(target_down)
+            try:
+                await asyncio.wait({request, target_down}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                self._target_watchers[to_agent].discard(target_down)
+                if not request.done():
+                    request.cancel()
             
-            response_msg = AgentMessage.from_bytes(response.data)
+            if not request.done() or request.cancelled():
+                REQUEST_LATENCY.labels(self.agent_metadata.name, to_agent, "failover").observe(loop.time() - started)
+                REQUESTS.labels(self.agent_metadata.name, to_agent, "failover").inc()
+                return await self._failover(to_agent, content, timeout - (loop.time() - started), tried)
+            response = request.result()
+            
+            response_msg = MessageEnvelope.from_msg(response).message
+            self._record_received(response_msg)
+            await self.resolve_payload(response_msg)
+            elapsed = loop.time() - started
+            REQUEST_LATENCY.labels(self.agent_metadata.name, to_agent, "ok").observe(elapsed)
+            REQUESTS.labels(self.agent_metadata.name, to_agent, "ok").inc()
+            self._request_latencies.setdefault(
+                to_agent, collections.deque(maxlen=self.nats_config.latency_window)
+            ).append(elapsed)
             logger.info(f"Received response from {to_agent}")
             return response_msg.content
             
+        except NoRespondersError:
+            # Nobody is subscribed any more, e.g. the agent crashed between heartbeats
+            REQUEST_LATENCY.labels(self.agent_metadata.name, to_agent, "error").observe(loop.time() - started)
+            REQUESTS.labels(self.agent_metadata.name, to_agent, "no_responders").inc()
+            if instance:
+                # Only that replica is gone; the queue group may still have others
+                return await self._request(to_agent, content, timeout - (loop.time() - started), tried)
+            return await self._failover(to_agent, content, timeout - (loop.time() - started), tried)
         except asyncio.TimeoutError:
+            REQUEST_LATENCY.labels(self.agent_metadata.name, to_agent, "timeout").observe(loop.time() - started)
+            REQUESTS.labels(self.agent_metadata.name, to_agent, "timeout").inc()
             logger.warning(f"Request to {to_agent} timed out after {timeout}s")
             return None
         except Exception as error:
+            REQUEST_LATENCY.labels(self.agent_metadata.name, to_agent, "error").observe(loop.time() - started)
+            REQUESTS.labels(self.agent_metadata.name, to_agent, "error").inc()
+            ERRORS.labels(self.agent_metadata.name, "request").inc()
             logger.error(f"Error requesting from agent: {error}")
             return None
     
-    async def handoff_to_agent(self, to_agent: str, content: str, metadata: Optional[Dict] = None):
-        """Hand off a task to another agent"""
+    async def _failover(self, to_agent: str, content: str, timeout: float,
+                        tried: Optional[set] = None) -> Optional[str]:
+        """Re-route a request for a dead peer to another agent with the same capability"""
+        tried = (tried or set()) | {to_agent}
+        alternative = self.peer_registry.find_alternative(to_agent, exclude=tried | {self.agent_metadata.name})
+        if alternative is None or timeout <= 0:
+            FAILOVERS.labels(self.agent_metadata.name, to_agent, "failed_fast").inc()
+            logger.warning(f"Request to {to_agent} failed fast: agent is down and has no available alternative")
+            return None
+        FAILOVERS.labels(self.agent_metadata.name, to_agent, "rerouted").inc()
+        logger.warning(f"Agent {to_agent} is down, re-routing request to {alternative}")
+        return await self._request(alternative, content, timeout, tried)
+    
+    async def embed(self, texts: List[str], timeout: float = 30) -> Optional[List[List[float]]]:
+        """
+        Embed texts with the shared embedding service (see embedding_agent.py).
+        
+        Returns one vector per text, or None if the service did not answer.
+        """
+        response = await self.request_from_agent(
+            self.nats_config.embedding_agent, json.dumps({"texts": list(texts)}), timeout=timeout
+        )
+        if response is None:
+            return None
+        reply = json.loads(response)
+        if "error" in reply:
+            logger.error(f"Embedding request failed: {reply['error']}")
+            return None
+        return reply["vectors"]
+    
+    async def submit_job(
+        self,
+        to_agent: str,
+        content: str,
+        metadata: Optional[Dict] = None,
+        on_progress: Optional[Callable] = None,
+        on_complete: Optional[Callable] = None
+    ) -> Optional[str]:
+        """
+        Submit a long-running task to another agent and return its job ID immediately.
+        
+        `on_progress(job)` is called for every status/progress event and `on_complete(job)`
+        once the job finished (with its result); both may be sync or async. Without
+        callbacks, use get_job() or wait_for_job() later. Returns None if no agent
+        accepted the job.
+        """
         if not self.nats_client:
             raise RuntimeError("NATS client not connected. Call connect_nats() first.")
         
-        message = AgentMessage(
-            message_type="handoff",
-            from_agent=self.agent_metadata.name,
-            to_agent=to_agent,
-            content=content,
-            metadata=metadata or {},
-            message_id=str(uuid.uuid4()),
-            priority=2  # Handoffs are high priority
-        )
+        job_id = str(uuid.uuid4())
+        # Watch before submitting so no event can be missed
+        if on_progress or on_complete:
+            await self._watch_job(job_id, on_progress, on_complete)
+        
+        with tracer.span("nats.submit_job", agent=self.agent_metadata.name, target=to_agent, job_id=job_id):
+            message = AgentMessage(
+                message_type="job",
+                from_agent=self.agent_metadata.name,
+                to_agent=to_agent,
+                content=content,
+                metadata=tracer.inject({**(metadata or {}), "job_id": job_id}),
+                message_id=job_id
+            )
+            try:
+                await self._offload_payload(message)
+                await self.nats_client.request(
+                    self.nats_config.get_job_submit_channel(to_agent),
+                    message.to_bytes(),
+                    timeout=self.nats_config.job_ack_timeout,
+                    headers=message.to_headers()
+                )
+                MESSAGES_PUBLISHED.labels(self.agent_metadata.name, message.message_type).inc()
+            except Exception as error:
+                logger.error(f"Job submission to {to_agent} failed: {error}")
+                ERRORS.labels(self.agent_metadata.name, "submit_job").inc()
+                await self._unwatch_job(job_id)
+                return None
         
-        # Send to both the direct channel and handoff channel
-        direct_channel = self.nats_config.get_direct_channel(to_agent)
-        handoff_channel = self.nats_config.get_handoff_channel(self.agent_metadata.name, to_agent)
+        logger.info(f"Submitted job {job_id} to {to_agent}")
+        return job_id
+    
+    async def get_job(self, job_id: str) -> Optional[Job]:
+        """Fetch a job's current state (and result, once it has one)"""
+        job = await self.job_store.get(job_id)
+        if job is not None and job.result_ref:
+            ref = PayloadRef.from_dict(job.result_ref)
+            chunks = [chunk async for chunk in self.payload_store.iter_chunks(ref)]
+            job.result = b"".join(chunks).decode(ref.encoding)
+        return job
+    
+    async def wait_for_job(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """Wait until a job finishes; returns None on timeout"""
+        finished = asyncio.get_running_loop().create_future()
         
-        await self.nats_client.publish(direct_channel, message.to_bytes())
-        await self.nats_client.publish(handoff_channel, message.to_bytes())
+        def on_complete(job: Job):
+            if not finished.done():
+                finished.set_result(job)
+        
+        await self._watch_job(job_id, None, on_complete)
+        try:
+            # The job may have finished before we started watching
+            job = await self.get_job(job_id)
+            if job is not None and job.done:
+                return job
+            return await asyncio.wait_for(finished, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            await self._unwatch_job(job_id)
+    
+    async def _watch_job(self, job_id: str, on_progress: Optional[Callable], on_complete: Optional[Callable]):
+        """Subscribe to a job's events and dispatch them to callbacks"""
+        async def handle_event(msg: Msg):
+            try:
+                event = MessageEnvelope.from_msg(msg).message
+                job = Job.from_dict(event.metadata["job"])
+                if on_progress:
+                    await self._call_handler(on_progress, job)
+                if job.done:
+                    if on_complete:
+                        await self._call_handler(on_complete, await self.get_job(job_id) or job)
+                    # Unsubscribing cancels the task running this callback, so do it from another task
+                    asyncio.create_task(self._unwatch_job(job_id))
+            except Exception as error:
+                logger.error(f"Error handling job event for {job_id}: {error}")
+                ERRORS.labels(self.agent_metadata.name, "job_callback").inc()
+        
+        sub = await self.nats_client.subscribe(self.nats_config.get_job_channel(job_id), cb=handle_event)
+        self._job_subscriptions[job_id] = sub
+    
+    async def _unwatch_job(self, job_id: str):
+        sub = self._job_subscriptions.pop(job_id, None)
+        if sub is not None:
+            try:
+                await sub.unsubscribe()
+            except Exception as error:
+                logger.debug(f"Error unsubscribing from job {job_id}: {error}")
+    
+    @staticmethod
+    async def _call_handler(handler: Callable, *args):
+        result = handler(*args)
+        if asyncio.iscoroutine(result):
+            await result
+    
+    async def handoff_to_agent(self, to_agent: str, content: str, metadata: Optional[Dict] = None):
+        """Hand off a task to another agent"""
+        if not self.nats_client:
+            raise RuntimeError("NATS client not connected. Call connect_nats() first.")
+        
+        with tracer.span("nats.handoff", agent=self.agent_metadata.name, target=to_agent):
+            message = AgentMessage(
+                message_type="handoff",
+                from_agent=self.agent_metadata.name,
+                to_agent=to_agent,
+                content=content,
+                metadata=tracer.inject(dict(metadata or {})),
+                message_id=str(uuid.uuid4()),
+                priority=2  # Handoffs are high priority
+            )
+            
+            # Send to both the direct channel and handoff channel
+            direct_channel = self.nats_config.get_direct_channel(to_agent)
+            handoff_channel = self.nats_config.get_handoff_channel(self.agent_metadata.name, to_agent)
+            
+            await self._publish(direct_channel, message)
+            await self._publish(handoff_channel, message)
         
         logger.info(f"Handed off task to {to_agent}")
     
-    async def broadcast_message(self, content: str, metadata: Optional[Dict] = None):
-        """Broadcast a message to all agents"""
+    async def broadcast_message(
+        self,
+        content: str,
+        metadata: Optional[Dict] = None,
+        audience: Optional[List[str]] = None,
+        topic: Optional[str] = None
+    ):
+        """
+        Broadcast a message.
+        
+        With `audience` (a list of capabilities) the message only reaches agents that
+        have one of them, on agents.broadcast.{capability}.{topic}. Without it, the
+        message goes to every agent on the all-agents channel.
+        """
         if not self.nats_client:
             raise RuntimeError("NATS client not connected. Call connect_nats() first.")
         
@@ -357,44 +1038,228 @@ class NATSAgentMixin:
             message_type="announcement",
             from_agent=self.agent_metadata.name,
             content=content,
-            metadata=metadata or {}
+            metadata=metadata or {},
+            message_id=str(uuid.uuid4())
         )
         
-        await self.nats_client.publish(
-            self.nats_config.all_agents_channel,
-            message.to_bytes()
-        )
-        logger.info(f"Broadcast message: {content}")
+        if audience:
+            for capability in audience:
+                await self._publish(self.nats_config.get_broadcast_channel(capability, topic), message)
+            logger.info(f"Broadcast message to {audience}: {content}")
+        else:
+            await self._publish(self.nats_config.all_agents_channel, message)
+            logger.info(f"Broadcast message: {content}")
     
-    async def disconnect_nats(self):
-        """Disconnect from NATS and cleanup"""
-        if self.nats_client:
+    async def drain_nats(self, timeout: Optional[float] = None) -> bool:
+        """
+        Stop taking new work and let in-flight work finish.
+        
+        This method:
+        1. Leaves the direct/request queue groups (replicas keep serving)
+        2. Announces the agent as busy so peers stop routing to it
+        3. Waits up to `timeout` seconds for queued and in-flight work
+        
+        Returns True if all work finished before the deadline.
+        """
+        if not self.nats_client or self.nats_client.is_closed or self.draining:
+            return True
+        
+        self.draining = True
+        timeout = self.nats_config.drain_timeout if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        logger.info(f"Draining agent '{self.agent_metadata.name}' (timeout {timeout}s)")
+        
+        # Mark busy in the registry
+        self.agent_metadata.status = "busy"
+        try:
+            await self._publish(self.nats_config.all_agents_channel, AgentMessage(
+                message_type="announcement",
+                from_agent=self.agent_metadata.name,
+                content=f"Agent '{self.agent_metadata.name}' is draining",
+                metadata=self.agent_metadata.to_dict()
+            ))
+        except Exception as error:
+            logger.error(f"Error sending drain announcement: {error}")
+        
+        # Remove interest in new work; messages already delivered are still processed
+        drains = [asyncio.create_task(sub.drain()) for sub in self.work_subscriptions]
+        for sub in self.work_subscriptions:
+            if sub in self.subscriptions:
+                self.subscriptions.remove(sub)
+        self.work_subscriptions = []
+        
+        pending = set(drains) | set(self.inflight_tasks)
+        if pending:
+            _, still_running = await asyncio.wait(pending, timeout=max(0.0, deadline - loop.time()))
+        else:
+            still_running = set()
+        
+        # Newly kicked-off work from the drained queue
+        late = set(self.inflight_tasks) - pending
+        if late:
+            _, late_running = await asyncio.wait(late, timeout=max(0.0, deadline - loop.time()))
+            still_running |= late_running
+        
+        if still_running:
+            logger.warning(f"Drain deadline reached with {len(still_running)} task(s) still running")
+            return False
+        logger.info(f"Agent '{self.agent_metadata.name}' drained")
+        return True
+    
+    async def disconnect_nats(self, drain: bool = True, drain_timeout: Optional[float] = None):
+        """
+        Disconnect from NATS and cleanup.
+        
+        By default in-flight work is drained first (see drain_nats); pass drain=False
+        to cancel it, and drop queued messages, immediately.
+        """
+        if self.nats_client and not self.nats_client.is_closed:
+            if drain:
+                await self.drain_nats(drain_timeout)
+            
+            self.agent_metadata.status = "offline"
+            
             # Send offline announcement
             message = AgentMessage(
                 message_type="announcement",
                 from_agent=self.agent_metadata.name,
                 content=f"Agent '{self.agent_metadata.name}' going offline",
-                metadata={"status": "offline"}
+                metadata={"status": "offline", "instance_id": self.agent_metadata.instance_id}
             )
             
             try:
-                await self.nats_client.publish(
-                    self.nats_config.all_agents_channel,
-                    message.to_bytes()
-                )
+                await self._publish(self.nats_config.all_agents_channel, message)
             except Exception as error:
                 logger.error(f"Error sending offline announcement: {error}")
             
-            # Cancel background tasks
-            for task in self.background_tasks:
-                task.cancel()
+            # Cancel background tasks and anything that outlived the drain
+            for task in self.background_tasks + list(self.inflight_tasks):
+                if task is not asyncio.current_task():
+                    task.cancel()
             
-            # Drain and close
-            await self.nats_client.drain()
+            # Drain and close; without drain, messages still queued in subscriptions are dropped
+            if drain:
+                await self.nats_client.drain()
+            else:
+                try:
+                    await self.nats_client.flush()  # the offline announcement
+                except Exception as error:
+                    logger.error(f"Error flushing before close: {error}")
             await self.nats_client.close()
             
             logger.info(f"Disconnected from NATS")
     
+    async def iter_payload(self, message: AgentMessage) -> AsyncIterator[bytes]:
+        """
+        Stream a message's content as encoded chunks.
+        
+        For claim-checked messages the chunks are fetched from the payload store as
+        they are consumed, so a receiver can process a large blob without holding it
+        in memory twice.
+        """
+        ref = PayloadRef.from_metadata(message.metadata)
+        if ref is None:
+            if message.content:
+                yield message.content.encode('utf-8')
+            return
+        async for chunk in self.payload_store.iter_chunks(ref):
+            PAYLOAD_BYTES.labels(self.agent_metadata.name, "fetched").inc(len(chunk))
+            yield chunk
+    
+    async def resolve_payload(self, message: AgentMessage) -> str:
+        """Fetch claim-checked content into message.content (no-op for inline content)"""
+        ref = PayloadRef.from_metadata(message.metadata)
+        if ref is not None:
+            chunks = [chunk async for chunk in self.iter_payload(message)]
+            message.content = b"".join(chunks).decode(ref.encoding)
+            message.metadata.pop(PAYLOAD_METADATA_KEY, None)
+        return message.content
+    
+    async def _offload_payload(self, message: AgentMessage):
+        """Claim check: move content above the threshold into the payload store, keeping a reference"""
+        if not self.payload_store or not message.content:
+            return
+        data = message.content.encode('utf-8')
+        if len(data) <= self.nats_config.payload_offload_threshold:
+            return
+        try:
+            ref, stored = await self.payload_store.put(data)
+        except PayloadStoreUnavailable:
+            # Logged by the store when it became unavailable; send inline until it retries
+            return
+        except Exception as error:
+            # e.g. JetStream not enabled on the server; send inline as before
+            logger.warning(f"Payload store unavailable, sending {len(data)} bytes inline: {error}")
+            ERRORS.labels(self.agent_metadata.name, "payload_store").inc()
+            return
+        PAYLOAD_BYTES.labels(self.agent_metadata.name, "stored" if stored else "deduplicated").inc(len(data))
+        message.metadata[PAYLOAD_METADATA_KEY] = ref.to_dict()
+        message.content = ""
+    
+    async def _publish(self, subject: str, message: AgentMessage):
+        """Publish an AgentMessage on a subject and count it"""
+        await self._offload_payload(message)
+        await self.nats_client.publish(subject, message.to_bytes(), headers=message.to_headers())
+        MESSAGES_PUBLISHED.labels(self.agent_metadata.name, message.message_type).inc()
+    
+    def _record_received(self, message):
+        """Count a received message (AgentMessage or MessageEnvelope) by type"""
+        MESSAGES_RECEIVED.labels(self.agent_metadata.name, message.message_type).inc()
+    
+    def _drop_from_headers(self, envelope: MessageEnvelope) -> bool:
+        """
+        Fast path: decide from routing headers alone whether a message can be ignored.
+        
+        Drops our own broadcasts echoed back to us and requests whose sender's
+        deadline has already passed. Returns True if the message was dropped.
+        """
+        reason = None
+        if envelope.from_agent == self.agent_metadata.name and envelope.message_type in ("announcement", "heartbeat"):
+            reason = "self_originated"
+        elif envelope.is_expired():
+            reason = "expired"
+        
+        if reason:
+            MESSAGES_DROPPED.labels(self.agent_metadata.name, reason).inc()
+            logger.debug(f"Dropped {envelope.message_type} from {envelope.from_agent}: {reason}")
+            return True
+        return False
+    
+    def _record_queue_wait(self, message: AgentMessage) -> Optional[Dict[str, str]]:
+        """Record the time a message waited before handling; returns the propagated trace context"""
+        parent = tracer.extract(message.metadata)
+        sent_at = message_sent_at(message.timestamp)
+        if sent_at is not None:
+            tracer.record("queue.wait", sent_at, time.time(), agent=self.agent_metadata.name,
+                          parent=parent, message_type=message.message_type)
+        return parent
+    
+    def _queued_message_count(self) -> int:
+        """Messages delivered to our subscriptions but not yet handled"""
+        return sum(getattr(sub, 'pending_msgs', 0) for sub in self.subscriptions)
+    
+    async def wait_until_stopped(self):
+        """Block until SIGTERM/SIGINT (or request_stop), so callers can drain and disconnect"""
+        self._stop_event = asyncio.Event()
+        _stop_events.add(self._stop_event)
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, _stop_all_agents)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not supported on this platform or not on the main thread
+                pass
+        try:
+            await self._stop_event.wait()
+        finally:
+            _stop_events.discard(self._stop_event)
+    
+    def request_stop(self):
+        """Ask a running wait_until_stopped() to return"""
+        if self._stop_event:
+            self._stop_event.set()
+    
     async def _on_error(self, error):
         """NATS error callback"""
         logger.error(f"NATS error: {error}")
@@ -6,12 +6,31 @@ including connection details, channel naming conventions, and message formats.
 """
 
 import os
+import time
+import uuid
 from typing import Dict, Any, List, Optional
 from dataclasses import dataclass, field
 from datetime import datetime
 import json
 
 
+# NATS headers carrying routing metadata, so receivers can filter without decoding bodies
+HEADER_MESSAGE_TYPE = "Agent-Message-Type"
+HEADER_FROM_AGENT = "Agent-From"
+HEADER_TO_AGENT = "Agent-To"
+HEADER_PRIORITY = "Agent-Priority"
+HEADER_MESSAGE_ID = "Agent-Message-Id"
+HEADER_DEADLINE = "Agent-Deadline"  # epoch seconds
+HEADER_CODEC = "Agent-Codec"
+
+DEFAULT_CODEC = "json"
+
+
+def subject_token(name: str) -> str:
+    """Normalize a name into a single NATS subject token"""
+    return name.lower().replace(' ', '_').replace('.', '_').replace('*', '_').replace('>', '_')
+
+
 @dataclass
 class NATSConfig:
     """Configuration for NATS connection and agent communication"""
@@ -28,15 +47,60 @@ class NATSConfig:
     request_prefix: str = "agents.request"
     response_prefix: str = "agents.response"
     handoff_prefix: str = "agents.handoff"
+    broadcast_prefix: str = "agents.broadcast"
+    heartbeat_prefix: str = "agents.heartbeat"
+    default_broadcast_topic: str = "general"
+    jobs_prefix: str = "agents.jobs"
     
     # Message settings
     message_timeout: int = 30  # seconds
     max_message_size: int = 1048576  # 1MB
     
+    # Claim check: content larger than this is stored out of band and sent as a reference
+    payload_offload_threshold: int = 256 * 1024  # bytes
+    payload_bucket: str = "agent_payloads"
+    payload_chunk_size: int = 128 * 1024  # bytes
+    payload_ttl: Optional[float] = 24 * 3600  # seconds to keep stored payloads; None = forever
+    
+    # Async jobs
+    job_bucket: str = "agent_jobs"  # JetStream KV bucket holding job records
+    job_ttl: Optional[float] = 7 * 24 * 3600  # seconds to keep job records
+    job_ack_timeout: float = 5.0  # seconds to wait for an agent to accept a job
+    
+    # Failure detection (phi-accrual over heartbeats). A dead peer is detected about
+    # 1.5 heartbeat intervals after its last heartbeat (~8s at 5s), well inside the 30s
+    # default request timeout; every agent receives every heartbeat, so a longer interval
+    # trades slower failover for less traffic on large meshes
+    heartbeat_interval: float = 5.0  # seconds
+    phi_threshold: float = 8.0  # suspicion level at which a peer is considered dead
+    failure_check_interval: float = 1.0  # seconds between detector evaluations
+    
+    # Hedged requests (opt-in): duplicate a slow request to a second replica
+    hedge_requests: bool = False
+    hedge_percentile: float = 95.0  # hedge once a request is slower than this percentile for the target
+    hedge_budget: float = 0.05  # max fraction of hedged requests that may send a duplicate
+    hedge_min_samples: int = 20  # latency samples per target before hedging starts
+    latency_window: int = 200  # recent latency samples kept per target
+    
+    # Shared embedding service (embedding_agent.py)
+    embedding_agent: str = "Embedding-Service"
+    embedding_model: str = field(default_factory=lambda: os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+    embedding_batch_size: int = 64  # max texts per forward pass
+    embedding_batch_window: float = 0.005  # seconds to wait for more texts before a forward pass
+    embedding_cache_size: int = 50000  # vectors kept, keyed by content hash; float32, ~75 MB at 384 dims
+    
+    # Shutdown settings
+    drain_timeout: float = 30.0  # seconds to let in-flight work finish on disconnect
+    
     # JetStream settings (optional, for persistence)
     use_jetstream: bool = False
     stream_name: str = "AGENT_MESSAGES"
     
+    # Monitoring settings (Prometheus /metrics endpoint, disabled when unset)
+    metrics_port: Optional[int] = field(
+        default_factory=lambda: int(os.getenv("AGENT_METRICS_PORT")) if os.getenv("AGENT_METRICS_PORT") else None
+    )
+    
     def get_direct_channel(self, agent_name: str) -> str:
         """Get the direct message channel for a specific agent"""
         return f"{self.agent_prefix}.{agent_name.lower().replace(' ', '_')}"
@@ -45,10 +109,43 @@ class NATSConfig:
         """Get the request channel for a specific agent"""
         return f"{self.request_prefix}.{agent_name.lower().replace(' ', '_')}"
     
+    def get_instance_request_channel(self, agent_name: str, instance_id: str) -> str:
+        """Get the request channel of one replica of an agent, outside its queue group"""
+        return f"{self.get_request_channel(agent_name)}.{subject_token(instance_id)}"
+    
     def get_response_channel(self, agent_name: str, request_id: str) -> str:
         """Get the response channel for a specific request"""
         return f"{self.response_prefix}.{agent_name.lower().replace(' ', '_')}.{request_id}"
     
+    def get_broadcast_channel(self, capability: str, topic: Optional[str] = None) -> str:
+        """Get the broadcast channel for agents with a capability, e.g. agents.broadcast.weather.alerts"""
+        topic = topic or self.default_broadcast_topic
+        return f"{self.broadcast_prefix}.{subject_token(capability)}.{subject_token(topic)}"
+    
+    def get_broadcast_subscription(self, capability: str, topic: Optional[str] = None) -> str:
+        """Get the subject an agent subscribes to for a capability (all topics unless one is given)"""
+        return f"{self.broadcast_prefix}.{subject_token(capability)}.{subject_token(topic) if topic else '*'}"
+    
+    def get_heartbeat_channel(self, agent_name: str) -> str:
+        """Get the heartbeat channel for a specific agent"""
+        return f"{self.heartbeat_prefix}.{subject_token(agent_name)}"
+    
+    def get_heartbeat_subscription(self) -> str:
+        """Get the subject matching every agent's heartbeats"""
+        return f"{self.heartbeat_prefix}.*"
+    
+    def get_job_submit_channel(self, agent_name: str) -> str:
+        """Get the channel an agent accepts job submissions on"""
+        return f"{self.jobs_prefix}.submit.{subject_token(agent_name)}"
+    
+    def get_job_channel(self, job_id: str) -> str:
+        """Get the channel carrying status and progress events for a job"""
+        return f"{self.jobs_prefix}.events.{subject_token(job_id)}"
+    
+    def get_queue_group(self, agent_name: str) -> str:
+        """Get the queue group shared by all replicas of an agent"""
+        return f"workers.{agent_name.lower().replace(' ', '_')}"
+    
     def get_handoff_channel(self, from_agent: str, to_agent: str) -> str:
         """Get the handoff channel for agent-to-agent task transfer"""
         from_name = from_agent.lower().replace(' ', '_')
@@ -69,6 +166,8 @@ class AgentMetadata:
     version: str = "1.0.0"
     registered_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
     last_heartbeat: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    # Tells apart replicas that share a name (and queue group)
+    instance_id: str = field(default_factory=lambda: uuid.uuid4().hex)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary for JSON serialization"""
@@ -81,20 +180,22 @@ class AgentMetadata:
             "model": self.model,
             "version": self.version,
             "registered_at": self.registered_at,
-            "last_heartbeat": self.last_heartbeat
+            "last_heartbeat": self.last_heartbeat,
+            "instance_id": self.instance_id
         }
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'AgentMetadata':
         """Create from dictionary"""
-        return cls(**data)
+        # Agents that predate instance ids count as a single instance
+        return cls(**{"instance_id": "", **data})
 
 
 @dataclass
 class AgentMessage:
     """Standard message format for agent-to-agent communication"""
     
-    message_type: str  # request, response, handoff, announcement, heartbeat
+    message_type: str  # request, response, handoff, announcement, heartbeat, job, job_event
     from_agent: str
     to_agent: Optional[str] = None  # None for broadcast
     content: str = ""
@@ -103,6 +204,7 @@ class AgentMessage:
     message_id: Optional[str] = None
     in_reply_to: Optional[str] = None
     priority: int = 3  # 1 (highest) to 5 (lowest)
+    deadline: Optional[float] = None  # epoch seconds after which the sender no longer wants a result
     
     def to_json(self) -> str:
         """Convert to JSON string"""
@@ -115,7 +217,8 @@ class AgentMessage:
             "timestamp": self.timestamp,
             "message_id": self.message_id,
             "in_reply_to": self.in_reply_to,
-            "priority": self.priority
+            "priority": self.priority,
+            "deadline": self.deadline
         })
     
     @classmethod
@@ -129,9 +232,100 @@ class AgentMessage:
         return self.to_json().encode('utf-8')
     
     @classmethod
-    def from_bytes(cls, data: bytes) -> 'AgentMessage':
+    def from_bytes(cls, data: bytes, codec: str = DEFAULT_CODEC) -> 'AgentMessage':
         """Create from bytes from NATS"""
+        if codec != DEFAULT_CODEC:
+            raise ValueError(f"Unsupported message codec: {codec}")
         return cls.from_json(data.decode('utf-8'))
+    
+    def to_headers(self) -> Dict[str, str]:
+        """NATS headers with the routing fields of this message"""
+        headers = {
+            HEADER_MESSAGE_TYPE: self.message_type,
+            HEADER_FROM_AGENT: self.from_agent,
+            HEADER_PRIORITY: str(self.priority),
+            HEADER_CODEC: DEFAULT_CODEC,
+        }
+        if self.to_agent:
+            headers[HEADER_TO_AGENT] = self.to_agent
+        if self.message_id:
+            headers[HEADER_MESSAGE_ID] = self.message_id
+        if self.deadline is not None:
+            headers[HEADER_DEADLINE] = repr(self.deadline)
+        return headers
+
+
+class MessageEnvelope:
+    """
+    Routing view of a received NATS message.
+    
+    Routing fields come from headers when the sender set them; the body is only
+    decoded when `message` is first accessed (or when headers are missing).
+    """
+    
+    def __init__(self, data: bytes, headers: Optional[Dict[str, str]] = None):
+        self.data = data
+        self.headers = headers or {}
+        self.codec = self.headers.get(HEADER_CODEC, DEFAULT_CODEC)
+        self._message: Optional[AgentMessage] = None
+    
+    @classmethod
+    def from_msg(cls, msg) -> 'MessageEnvelope':
+        """Wrap a nats Msg"""
+        return cls(msg.data, getattr(msg, 'headers', None))
+    
+    @property
+    def message(self) -> AgentMessage:
+        """The decoded message (decoded once, on first use)"""
+        if self._message is None:
+            self._message = AgentMessage.from_bytes(self.data, self.codec)
+        return self._message
+    
+    @property
+    def decoded(self) -> bool:
+        return self._message is not None
+    
+    def _header(self, name: str) -> Optional[str]:
+        return self.headers.get(name)
+    
+    @property
+    def message_type(self) -> str:
+        value = self._header(HEADER_MESSAGE_TYPE)
+        return value if value is not None else self.message.message_type
+    
+    @property
+    def from_agent(self) -> str:
+        value = self._header(HEADER_FROM_AGENT)
+        return value if value is not None else self.message.from_agent
+    
+    @property
+    def to_agent(self) -> Optional[str]:
+        if HEADER_MESSAGE_TYPE in self.headers:
+            return self._header(HEADER_TO_AGENT)
+        return self.message.to_agent
+    
+    @property
+    def priority(self) -> int:
+        value = self._header(HEADER_PRIORITY)
+        return int(value) if value is not None else self.message.priority
+    
+    @property
+    def message_id(self) -> Optional[str]:
+        if HEADER_MESSAGE_TYPE in self.headers:
+            return self._header(HEADER_MESSAGE_ID)
+        return self.message.message_id
+    
+    @property
+    def deadline(self) -> Optional[float]:
+        if HEADER_MESSAGE_TYPE in self.headers:
+            value = self._header(HEADER_DEADLINE)
+            return float(value) if value is not None else None
+        return self.message.deadline
+    
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        """True if the sender's deadline has passed"""
+        deadline = self.deadline
+        return deadline is not None and (now or time.time()) > deadline
 
 
 # Global config instance
@@ -0,0 +1,233 @@
+"""
+In-process NATS transport
+
+A minimal stand-in for the nats-py client that routes messages between agents
+living in the same Python process. It implements the subset of the client API
+used by NATSAgentMixin (publish, subscribe with queue groups, request/reply,
+drain, close) with NATS subject semantics (`*` and `>` wildcards).
+
+Use it by pointing an agent at an `inproc://` URL:
+
+    NATSConfig(nats_url="inproc://bench")
+
+Every URL names a separate broker, so several meshes can coexist in one process.
+Like nats-py, each subscription delivers to its callback one message at a time.
+"""
+
+import asyncio
+import random
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from nats.errors import NoRespondersError, TimeoutError as NATSTimeoutError
+
+
+INPROC_SCHEME = "inproc://"
+
+
+def subject_matches(pattern: str, subject: str) -> bool:
+    """Match a subject against a NATS subscription pattern"""
+    pattern_tokens = pattern.split(".")
+    subject_tokens = subject.split(".")
+    for index, token in enumerate(pattern_tokens):
+        if token == ">":
+            return len(subject_tokens) > index
+        if index >= len(subject_tokens):
+            return False
+        if token != "*" and token != subject_tokens[index]:
+            return False
+    return len(pattern_tokens) == len(subject_tokens)
+
+
+class InProcessMsg:
+    """A delivered message, shaped like nats.aio.msg.Msg"""
+
+    def __init__(self, client: "InProcessNATS", subject: str, reply: str, data: bytes,
+                 headers: Optional[Dict[str, str]] = None):
+        self._client = client
+        self.subject = subject
+        self.reply = reply
+        self.data = data
+        self.headers = headers
+
+    async def respond(self, data: bytes):
+        if not self.reply:
+            raise ValueError("Message has no reply subject")
+        await self._client.publish(self.reply, data)
+
+
+class InProcessSubscription:
+    """A subscription with its own delivery queue and callback task"""
+
+    def __init__(self, client: "InProcessNATS", subject: str, queue: str, cb: Optional[Callable]):
+        self._client = client
+        self.subject = subject
+        self.queue = queue
+        self._cb = cb
+        self._pending: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self.delivered = 0
+        if cb is not None:
+            self._task = asyncio.create_task(self._deliver_loop())
+
+    @property
+    def pending_msgs(self) -> int:
+        return self._pending.qsize()
+
+    def _enqueue(self, msg: InProcessMsg):
+        if not self._closed:
+            self._pending.put_nowait(msg)
+
+    async def _deliver_loop(self):
+        while True:
+            msg = await self._pending.get()
+            if msg is None:
+                break
+            self.delivered += 1
+            try:
+                await self._cb(msg)
+            except Exception as error:
+                await self._client._report_error(error)
+            finally:
+                self._pending.task_done()
+
+    async def next_msg(self, timeout: Optional[float] = 1.0) -> InProcessMsg:
+        msg = await asyncio.wait_for(self._pending.get(), timeout)
+        self._pending.task_done()
+        self.delivered += 1
+        return msg
+
+    async def unsubscribe(self):
+        """Stop delivery immediately, dropping anything still pending"""
+        self._client._remove(self)
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+
+    async def drain(self):
+        """Stop receiving new messages but finish delivering pending ones"""
+        self._client._remove(self)
+        self._closed = True
+        if self._task:
+            self._pending.put_nowait(None)
+            # wait() rather than await: the task may already have been cancelled
+            await asyncio.wait([self._task])
+
+
+class InProcessBroker:
+    """Routes published messages to matching subscriptions"""
+
+    def __init__(self):
+        self.subscriptions: List[InProcessSubscription] = []
+
+    def add(self, sub: InProcessSubscription):
+        self.subscriptions.append(sub)
+
+    def remove(self, sub: InProcessSubscription):
+        if sub in self.subscriptions:
+            self.subscriptions.remove(sub)
+
+    def route(self, msg: InProcessMsg) -> int:
+        """Deliver to every plain subscriber and one member of each queue group"""
+        groups: Dict[str, List[InProcessSubscription]] = {}
+        delivered = 0
+        for sub in list(self.subscriptions):
+            if not subject_matches(sub.subject, msg.subject):
+                continue
+            if sub.queue:
+                groups.setdefault(sub.queue, []).append(sub)
+            else:
+                sub._enqueue(msg)
+                delivered += 1
+        for members in groups.values():
+            random.choice(members)._enqueue(msg)
+            delivered += 1
+        return delivered
+
+
+_brokers: Dict[str, InProcessBroker] = {}
+
+
+def get_broker(url: str) -> InProcessBroker:
+    """Get (or create) the broker for an inproc:// URL"""
+    return _brokers.setdefault(url, InProcessBroker())
+
+
+class InProcessNATS:
+    """Subset of nats.aio.client.Client backed by an in-process broker"""
+
+    def __init__(self, url: str, error_cb: Optional[Callable] = None):
+        self.url = url
+        self._broker = get_broker(url)
+        self._error_cb = error_cb
+        self._subscriptions: List[InProcessSubscription] = []
+        self._closed = False
+
+    @property
+    def is_closed(self) -> bool:
+        return self._closed
+
+    @property
+    def is_connected(self) -> bool:
+        return not self._closed
+
+    def new_inbox(self) -> str:
+        return f"_INBOX.{uuid.uuid4().hex}"
+
+    async def publish(self, subject: str, payload: bytes = b"", reply: str = "",
+                      headers: Optional[Dict[str, str]] = None):
+        if self._closed:
+            raise RuntimeError("Connection closed")
+        self._broker.route(InProcessMsg(self, subject, reply, payload, headers))
+
+    async def subscribe(self, subject: str, queue: str = "", cb: Optional[Callable] = None,
+                        **kwargs: Any) -> InProcessSubscription:
+        sub = InProcessSubscription(self, subject, queue, cb)
+        self._broker.add(sub)
+        self._subscriptions.append(sub)
+        return sub
+
+    async def request(self, subject: str, payload: bytes = b"", timeout: float = 0.5,
+                      headers: Optional[Dict[str, Any]] = None, **kwargs: Any) -> InProcessMsg:
+        inbox = self.new_inbox()
+        sub = await self.subscribe(inbox)
+        try:
+            msg = InProcessMsg(self, subject, inbox, payload, headers)
+            if self._broker.route(msg) == 0:
+                raise NoRespondersError
+            try:
+                return await sub.next_msg(timeout=timeout)
+            except asyncio.TimeoutError:
+                raise NATSTimeoutError
+        finally:
+            await sub.unsubscribe()
+
+    async def flush(self, timeout: float = 10):
+        return None
+
+    async def drain(self):
+        for sub in list(self._subscriptions):
+            await sub.drain()
+        self._subscriptions.clear()
+        self._closed = True
+
+    async def close(self):
+        for sub in list(self._subscriptions):
+            await sub.unsubscribe()
+        self._subscriptions.clear()
+        self._closed = True
+
+    def _remove(self, sub: InProcessSubscription):
+        self._broker.remove(sub)
+        if sub in self._subscriptions:
+            self._subscriptions.remove(sub)
+
+    async def _report_error(self, error: Exception):
+        if self._error_cb:
+            await self._error_cb(error)
+
+
+async def connect(url: str, error_cb: Optional[Callable] = None, **kwargs: Any) -> InProcessNATS:
+    """Connect to the in-process broker named by `url` (mirrors nats.connect)"""
+    return InProcessNATS(url, error_cb=error_cb)
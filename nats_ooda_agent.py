@@ -5,25 +5,40 @@ This agent extends the basic OODA agent with NATS messaging capabilities,
 allowing it to communicate with other agents via a Slack-like messaging system.
 """
 
-from openai import OpenAI
 import json
 import random
 import asyncio
 import logging
+import time
+from typing import Literal
 
 from nats_agent_mixin import NATSAgentMixin
-from nats_config import nats_config
+from nats_config import NATSConfig, nats_config
+from agent_loop import assistant_message, run_until_done
+from conversation import CONSOLIDATE_PROMPT, Conversation, PrefixReuse
+from agent_metrics import record_completion
+from agent_tracing import tracer
+from llm_gateway import llm_client
+from streaming import STREAM_OPTIONS, stream_completion
+from tool_executor import ToolExecutor, ToolLimits
+from tool_registry import ToolRegistry, tool
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client for LM Studio
-client = OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="lm-studio")
+# LM Studio client; shares one connection pool and concurrency limit with every agent in the process
+client = llm_client()
 
 
-def get_current_weather(location: str, unit: str = "celsius"):
-    """Get the current weather for a location"""
+@tool
+def get_current_weather(location: str, unit: Literal["celsius", "fahrenheit"] = "celsius"):
+    """
+    Get the current weather in a given location
+
+    Args:
+        location: The city and state, e.g. San Francisco, CA
+    """
     return f"The weather in {location} is Sunny and {random.randint(40, 80)} degrees {unit}."
 
 
@@ -38,14 +53,21 @@ class NATSOODAAgent(NATSAgentMixin):
     - Hand off tasks to other agents
     """
     
-    def __init__(self, name: str, instructions: str, model: str, tools: list):
+    def __init__(self, name: str, instructions: str, model: str, tools: list,
+                 nats_config: NATSConfig = nats_config, stream: bool = True):
         self.name = name
         self.instructions = instructions
-        self.messages = [
-            {"role": "system", "content": self.instructions}
-        ]
+        self.messages = Conversation(self.instructions)
         self.model = model
         self.tools = tools
+        self.prefix_reuse = PrefixReuse(self.name)
+        
+        # Stream completions: tool calls start while the model is still writing, visible text goes to on_text
+        self.stream = stream
+        self.on_text = None
+        
+        # Runs the tool calls of a completion concurrently; repeated weather lookups are reused for 10 minutes
+        self.tool_executor = ToolExecutor(self.name, limits={"get_current_weather": ToolLimits(cache_ttl=600)})
         
         # Initialize NATS mixin
         super().__init__(nats_config=nats_config)
@@ -54,63 +76,62 @@ class NATSOODAAgent(NATSAgentMixin):
     
     def consolidate_context(self, messages):
         """Ask a language model to consolidate the context"""
-        completion = client.chat.completions.create(
-            model="qwen/qwen3-32b",
-            messages=[{
-                "role": "user",
-                "content": "Consolidate the following messages into a single message. Do not lose any information." + json.dumps(messages)
-            }],
-            tools=self.tools,
-            tool_choice="auto"
-        )
+        # The instruction goes after the history, so the history is served from the KV cache
+        request = messages.with_control(CONSOLIDATE_PROMPT)
+        self.prefix_reuse.observe(request, self.tools)
+        started = time.perf_counter()
+        with tracer.span("llm.consolidate", agent=self.name, model=self.model):
+            completion = client.chat.completions.create(
+                model="qwen/qwen3-32b",
+                messages=request,
+                tools=self.tools,
+                tool_choice="auto"
+            )
+        record_completion(self.name, self.model, started, completion)
         
-        # Recreate the messages list with the consolidated context
-        messages = [
-            {"role": "system", "content": self.instructions},
-            {"role": "user", "content": completion.choices[0].message.content}
-        ]
-        return messages
+        # Continue from the consolidated context under the same system prompt
+        return messages.consolidated(completion.choices[0].message.content)
     
     def prompt(self, messages):
         """Send a prompt to the language model"""
-        completion = client.chat.completions.create(
-            model="qwen/qwen3-32b",
-            messages=messages,
-            tools=self.tools,
-            tool_choice="auto"
-        )
+        self.prefix_reuse.observe(messages, self.tools)
+        batch = self.tool_executor.batch(self.handle_tool_call)
+        request = dict(model="qwen/qwen3-32b", messages=messages, tools=self.tools, tool_choice="auto")
+        started = time.perf_counter()
+        with tracer.span("llm.completion", agent=self.name, model=self.model, stream=self.stream):
+            if self.stream:
+                completion = stream_completion(
+                    client.chat.completions.create(**request, **STREAM_OPTIONS),
+                    on_tool_call=batch.submit, on_text=self.on_text, agent=self.name, model=self.model,
+                )
+            else:
+                completion = client.chat.completions.create(**request)
+        record_completion(self.name, self.model, started, completion)
+        self.last_completion = completion
+        if not self.stream:
+            for tool_call in completion.choices[0].message.tool_calls or []:
+                batch.submit(tool_call)
         
         print(completion.choices[0].message)
         result = completion.choices[0].message.content
         
         # Handle thinking tags
-        if "</think>" in result:
+        if result and "</think>" in result:
             result = result.split("</think>")[1]
         
         print(result)
+        messages.append(assistant_message(completion.choices[0].message))
         
         # Handle tool calls if there are any
         if completion.choices[0].message.tool_calls:
             print("Tool calls found")
-            for tool_call in completion.choices[0].message.tool_calls:
-                messages = self.handle_tool_call(tool_call, messages)
+            messages = batch.results(messages)
         
         return messages
     
     def handle_tool_call(self, tool_call, messages):
         """Handle tool calls - Act phase of OODA"""
-        for tool in self.tools:
-            if tool.get("function").get("name") == tool_call.function.name:
-                if tool_call.function.name == "get_current_weather":
-                    tool_call_arguments = json.loads(tool_call.function.arguments)
-                    result = get_current_weather(
-                        tool_call_arguments.get("location"),
-                        tool_call_arguments.get("unit", "celsius")
-                    )
-                    messages.append({"role": "tool", "content": result})
-                    return messages
-        
-        return messages
+        return registry.handle_tool_call(tool_call, messages, agent=self.name)
     
     def run(self, kickoff_message):
         """Run the agent once with a kickoff message"""
@@ -119,43 +140,16 @@ class NATSOODAAgent(NATSAgentMixin):
         self.messages = results
         return self.messages
     
-    def agentic_run(self, kickoff_message):
+    def agentic_run(self, kickoff_message, max_iterations=10, token_budget=None):
         """
         Run the agent with the OODA loop until completion.
         
-        This method:
-        1. Runs the kickoff message (Observe)
-        2. Decides whether to continue (Orient/Decide)
-        3. Acts and loops until complete
+        Each iteration is one completion: the model observes the conversation so far,
+        then either acts (tool calls, whose results feed the next iteration) or answers,
+        which ends the loop. Capped by max_iterations and token_budget (total tokens).
         """
-        # First run the kickoff message
         self.messages.append({"role": "user", "content": kickoff_message})
-        results = self.prompt(self.messages)
-        self.messages = results
-        
-        # Then run the agentic loop
-        continue_flag = "yes"
-        
-        while continue_flag == "yes":
-            messages = self.messages.copy()  # Observe
-            messages.append({
-                "role": "user",
-                "content": "Has the original kickoff prompt been completed, or should we continue? Respond with only yes (continue) or no (stop) with no other text."
-            })
-            results = self.prompt(messages)  # Decide
-            continue_flag = results[-1].get("content", "").lower()
-            
-            if continue_flag == "no":
-                break
-            
-            self.messages.append({
-                "role": "user",
-                "content": "Please continue with the original prompt."
-            })  # Decide
-            results = self.prompt(self.messages)  # Act
-            self.messages = results
-        
-        return self.messages
+        return run_until_done(self, max_iterations=max_iterations, token_budget=token_budget)
     
     async def run_with_nats(self, capabilities=None, description=None):
         """
@@ -176,9 +170,8 @@ class NATSOODAAgent(NATSAgentMixin):
             
             logger.info(f"Agent '{self.name}' is now listening for messages on NATS")
             
-            # Keep running until interrupted
-            while True:
-                await asyncio.sleep(1)
+            # Keep running until SIGTERM/SIGINT, then drain in-flight work in disconnect_nats()
+            await self.wait_until_stopped()
                 
         except KeyboardInterrupt:
             logger.info("Shutting down agent...")
@@ -189,26 +182,8 @@ class NATSOODAAgent(NATSAgentMixin):
 
 
 # Tool definitions
-tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_current_weather",
-            "description": "Get the current weather in a given location",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {
-                        "type": "string",
-                        "description": "The city and state, e.g. San Francisco, CA",
-                    },
-                    "unit": {"type": "string", "enum": ["celsius", "fahrenheit"]},
-                },
-                "required": ["location"],
-            },
-        }
-    }
-]
+registry = ToolRegistry(get_current_weather)
+tools = registry.schemas
 
 
 async def main():
@@ -221,9 +196,6 @@ async def main():
         
         When you receive a message via NATS from another agent, treat it as a request
         and fulfill it to the best of your ability using your available tools.
-        
-        Available tools:
-        {json.dumps(tools, indent=2)}
         """,
         model="qwen/qwen3-32b",
         tools=tools
@@ -0,0 +1,360 @@
+"""
+NATS Traffic Capture and Replay
+
+Records agent mesh traffic and replays it against another mesh, so a new build
+of nats_agent_mixin.py can be load-tested with production-shaped traffic.
+
+- record:    subscribe to agents.> (and reply inboxes) and append every message,
+             with its timestamp and headers, to a capture file (JSON lines; gzip if *.gz)
+- replay:    re-publish a capture at 1x, Nx or max speed, optionally sampled or
+             filtered by agent; messages that expected a reply are sent as requests
+             and their latency is measured
+- summarize: latency/throughput of the traffic in a capture (the baseline)
+- compare:   latency and throughput of two summaries or replay results side by side
+
+Usage:
+    python nats_traffic.py record traffic.jsonl.gz --duration 600
+    python nats_traffic.py summarize traffic.jsonl.gz --output baseline.json
+    python nats_traffic.py replay traffic.jsonl.gz --nats-url nats://test:4222 --speed 4 --output run.json
+    python nats_traffic.py compare baseline.json run.json
+"""
+
+import os
+import sys
+import gzip
+import json
+import math
+import time
+import base64
+import random
+import asyncio
+import logging
+import argparse
+import statistics
+from typing import Any, Dict, Iterator, List, Optional
+
+import nats
+from nats.errors import NoRespondersError, TimeoutError as NATSTimeoutError
+
+import nats_inprocess
+from nats_config import HEADER_DEADLINE, HEADER_FROM_AGENT, HEADER_MESSAGE_TYPE, HEADER_TO_AGENT
+from nats_inprocess import subject_matches
+
+logger = logging.getLogger(__name__)
+
+
+INBOX_PREFIX = "_INBOX."
+# Presence traffic would register phantom agents on the test mesh
+PRESENCE_TYPES = ("announcement", "heartbeat")
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def encode_record(timestamp: float, subject: str, reply: str, headers: Optional[Dict[str, str]],
+                  data: bytes) -> str:
+    """One capture line; short keys keep the file compact"""
+    record = {"t": round(timestamp, 6), "s": subject, "d": base64.b64encode(data).decode("ascii")}
+    if reply:
+        record["r"] = reply
+    if headers:
+        record["h"] = headers
+    return json.dumps(record, separators=(",", ":"))
+
+
+def read_capture(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield capture records in file order, skipping a torn last line"""
+    with _open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+async def connect(url: str):
+    if url.startswith(nats_inprocess.INPROC_SCHEME):
+        return await nats_inprocess.connect(url)
+    return await nats.connect(servers=[url])
+
+
+async def record(nc, path: str, subjects: List[str], duration: Optional[float] = None,
+                 stop: Optional[asyncio.Event] = None) -> int:
+    """Append every message on `subjects` to `path` until `duration` passes or `stop` is set"""
+    count = 0
+    with _open(path, "a") as f:
+        async def handler(msg):
+            nonlocal count
+            f.write(encode_record(time.time(), msg.subject, msg.reply, msg.headers, msg.data) + "\n")
+            count += 1
+
+        subs = [await nc.subscribe(subject, cb=handler) for subject in subjects]
+        stop = stop or asyncio.Event()
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for sub in subs:
+                await sub.unsubscribe()
+            f.flush()
+    return count
+
+
+def select_records(records: List[Dict[str, Any]], agents: Optional[List[str]] = None,
+                   subject: Optional[str] = None, sample: float = 1.0, include_presence: bool = False,
+                   seed: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Drop reply traffic and apply the agent/subject filters and sampling rate"""
+    rng = random.Random(seed)
+    wanted = {a.lower() for a in agents} if agents else None
+    selected = []
+    for rec in records:
+        if rec["s"].startswith(INBOX_PREFIX):
+            continue
+        headers = rec.get("h") or {}
+        if not include_presence and headers.get(HEADER_MESSAGE_TYPE) in PRESENCE_TYPES:
+            continue
+        if subject and not subject_matches(subject, rec["s"]):
+            continue
+        if wanted is not None:
+            parties = {headers.get(HEADER_FROM_AGENT, "").lower(), headers.get(HEADER_TO_AGENT, "").lower()}
+            if not parties & wanted:
+                continue
+        if sample < 1.0 and rng.random() >= sample:
+            continue
+        selected.append(rec)
+    return selected
+
+
+def _target(rec: Dict[str, Any]) -> str:
+    return (rec.get("h") or {}).get(HEADER_TO_AGENT) or rec["s"]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 3) if value is not None else None
+    return {
+        "count": len(latencies),
+        "p50": ms(percentile(latencies, 50)),
+        "p95": ms(percentile(latencies, 95)),
+        "p99": ms(percentile(latencies, 99)),
+        "mean": ms(statistics.fmean(latencies)) if latencies else None,
+    }
+
+
+def summarize_capture(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Baseline latency/throughput from request/reply pairs observed in a capture"""
+    requests = {rec["r"]: rec for rec in records if rec.get("r") and not rec["s"].startswith(INBOX_PREFIX)}
+    latencies: Dict[str, List[float]] = {}
+    for rec in records:
+        request = requests.get(rec["s"])
+        if request is not None:
+            latencies.setdefault(_target(request), []).append(rec["t"] - request["t"])
+    published = [rec for rec in records if not rec["s"].startswith(INBOX_PREFIX)]
+    elapsed = (published[-1]["t"] - published[0]["t"]) if len(published) > 1 else 0.0
+    answered = sum(len(v) for v in latencies.values())
+    return {
+        "source": "capture",
+        "messages": len(published),
+        "requests": len(requests),
+        "ok": answered,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(answered / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": latency_summary([l for v in latencies.values() for l in v]),
+        "targets": {target: latency_summary(values) for target, values in sorted(latencies.items())},
+    }
+
+
+async def replay(nc, records: List[Dict[str, Any]], speed: float = 1.0, timeout: float = 30.0,
+                 concurrency: int = 100) -> Dict[str, Any]:
+    """
+    Re-publish records against `nc`, preserving their relative timing divided by
+    `speed` (0 = as fast as possible). Messages captured with a reply subject
+    are sent as requests and timed.
+    """
+    records = sorted(records, key=lambda rec: rec["t"])
+    outcomes = {"published": 0, "requests": 0, "ok": 0, "timeout": 0, "no_responders": 0, "error": 0}
+    latencies: Dict[str, List[float]] = {}
+    limit = asyncio.Semaphore(concurrency)
+    in_flight = set()
+
+    def rewrite_headers(rec: Dict[str, Any]) -> Optional[Dict[str, str]]:
+        headers = dict(rec.get("h") or {})
+        # Deadlines are absolute; shift them so they keep their original budget
+        if HEADER_DEADLINE in headers:
+            headers[HEADER_DEADLINE] = repr(time.time() + float(headers[HEADER_DEADLINE]) - rec["t"])
+        return headers or None
+
+    async def send_request(rec: Dict[str, Any]):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                await nc.request(rec["s"], base64.b64decode(rec["d"]), timeout=timeout, headers=rewrite_headers(rec))
+                outcomes["ok"] += 1
+                latencies.setdefault(_target(rec), []).append(time.perf_counter() - started)
+            except NoRespondersError:
+                outcomes["no_responders"] += 1
+            except (NATSTimeoutError, asyncio.TimeoutError):
+                outcomes["timeout"] += 1
+            except Exception as error:
+                logger.debug(f"Replay request to {rec['s']} failed: {error}")
+                outcomes["error"] += 1
+
+    first = records[0]["t"] if records else 0.0
+    started = time.perf_counter()
+    for rec in records:
+        if speed > 0:
+            delay = (rec["t"] - first) / speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if rec.get("r"):
+            outcomes["requests"] += 1
+            task = asyncio.create_task(send_request(rec))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+            if speed <= 0:
+                # Yield so max-speed replay doesn't queue every request before the first is sent
+                await asyncio.sleep(0)
+        else:
+            await nc.publish(rec["s"], base64.b64decode(rec["d"]), headers=rewrite_headers(rec))
+            outcomes["published"] += 1
+    if in_flight:
+        await asyncio.wait(in_flight)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "source": "replay",
+        "speed": speed,
+        "messages": len(records),
+        **outcomes,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(outcomes["ok"] / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": latency_summary([l for v in latencies.values() for l in v]),
+        "targets": {target: latency_summary(values) for target, values in sorted(latencies.items())},
+    }
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any]) -> str:
+    """Render latency and throughput of two runs side by side"""
+    def row(label: str, a: Optional[float], b: Optional[float]) -> str:
+        if a is None or b is None:
+            change = "n/a"
+        elif a == 0:
+            change = "n/a" if b == 0 else "+inf"
+        else:
+            change = f"{(b - a) / a * 100:+.1f}%"
+        fmt = lambda v: "-" if v is None else f"{v:.3f}"
+        return f"{label:<28}{fmt(a):>14}{fmt(b):>14}{change:>10}"
+
+    lines = [f"{'':<28}{before.get('source', 'before'):>14}{after.get('source', 'after'):>14}{'change':>10}"]
+    lines.append(row("throughput (req/s)", before.get("throughput_rps"), after.get("throughput_rps")))
+    lines.append(row("requests answered", before.get("ok"), after.get("ok")))
+    for key in ("p50", "p95", "p99", "mean"):
+        lines.append(row(f"latency {key} (ms)", before["latency_ms"].get(key), after["latency_ms"].get(key)))
+    for target in sorted(set(before.get("targets", {})) & set(after.get("targets", {}))):
+        for key in ("p50", "p95"):
+            lines.append(row(f"  {target[:18]} {key}", before["targets"][target].get(key),
+                             after["targets"][target].get(key)))
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Capture and replay NATS agent traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+    default_url = os.getenv("NATS_URL", "nats://localhost:4222")
+
+    rec = commands.add_parser("record", help="Append mesh traffic to a capture file")
+    rec.add_argument("capture")
+    rec.add_argument("--nats-url", default=default_url)
+    rec.add_argument("--subject", action="append", help="Subjects to capture (default: agents.> and reply inboxes)")
+    rec.add_argument("--duration", type=float, help="Seconds to record (default: until Ctrl-C)")
+
+    rep = commands.add_parser("replay", help="Re-publish a capture against a mesh")
+    rep.add_argument("capture")
+    rep.add_argument("--nats-url", default=default_url)
+    rep.add_argument("--speed", type=float, default=1.0, help="Time compression factor; 0 = max speed")
+    rep.add_argument("--agent", action="append", help="Only messages from/to this agent (repeatable)")
+    rep.add_argument("--subject", help="Only subjects matching this pattern, e.g. agents.request.*")
+    rep.add_argument("--sample", type=float, default=1.0, help="Fraction of messages to replay")
+    rep.add_argument("--seed", type=int, help="Seed for sampling")
+    rep.add_argument("--include-presence", action="store_true", help="Also replay announcements/heartbeats")
+    rep.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout")
+    rep.add_argument("--concurrency", type=int, default=100, help="Max outstanding requests")
+    rep.add_argument("--output", help="Write JSON results to this file")
+
+    summ = commands.add_parser("summarize", help="Baseline latency/throughput of a capture")
+    summ.add_argument("capture")
+    summ.add_argument("--output", help="Write JSON results to this file")
+
+    cmp_ = commands.add_parser("compare", help="Compare two summaries/replay results")
+    cmp_.add_argument("before")
+    cmp_.add_argument("after")
+
+    args = parser.parse_args(argv)
+
+    def emit(results: Dict[str, Any], output: Optional[str]):
+        text = json.dumps(results, indent=2)
+        if output:
+            with open(output, "w") as f:
+                f.write(text + "\n")
+            print(f"Results written to {output}")
+        else:
+            print(text)
+
+    if args.command == "record":
+        async def run_record():
+            nc = await connect(args.nats_url)
+            try:
+                subjects = args.subject or ["agents.>", f"{INBOX_PREFIX}>"]
+                return await record(nc, args.capture, subjects, duration=args.duration)
+            finally:
+                await nc.close()
+        try:
+            count = asyncio.run(run_record())
+            print(f"Captured {count} messages to {args.capture}")
+        except KeyboardInterrupt:
+            print(f"Capture stopped; messages so far are in {args.capture}")
+
+    elif args.command == "replay":
+        records = select_records(list(read_capture(args.capture)), agents=args.agent, subject=args.subject,
+                                 sample=args.sample, include_presence=args.include_presence, seed=args.seed)
+
+        async def run_replay():
+            nc = await connect(args.nats_url)
+            try:
+                return await replay(nc, records, speed=args.speed, timeout=args.timeout,
+                                    concurrency=args.concurrency)
+            finally:
+                await nc.close()
+        emit(asyncio.run(run_replay()), args.output)
+
+    elif args.command == "summarize":
+        emit(summarize_capture(list(read_capture(args.capture))), args.output)
+
+    elif args.command == "compare":
+        with open(args.before) as f:
+            before = json.load(f)
+        with open(args.after) as f:
+            after = json.load(f)
+        print(compare(before, after))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,22 @@
-from openai import OpenAI
-client = OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="lm-studio")
+from llm_gateway import llm_client
+client = llm_client()  # shared, pooled client for LM_STUDIO_BASE_URL
 import json
 import random
+from typing import Literal
+from agent_loop import assistant_message, run_until_done
+from conversation import CONSOLIDATE_PROMPT, Conversation
+from streaming import STREAM_OPTIONS, stream_completion
+from tool_executor import ToolExecutor, ToolLimits
+from tool_registry import ToolRegistry, tool
 
-def get_current_weather(location: str, unit: str = "celsius"):
+@tool
+def get_current_weather(location: str, unit: Literal["celsius", "fahrenheit"] = "celsius"):
+    """
+    Get the current weather in a given location
+
+    Args:
+        location: The city and state, e.g. San Francisco, CA
+    """
     return f"The weather in {location} is Sunny and {random.randint(40, 80)} degrees."
 
 messages = []
@@ -12,56 +25,55 @@ class Agent:
     def __init__(self, name, instructions, model, tools):
         self.name = name
         self.instructions = instructions
-        self.messages = [
-            {"role": "system", "content": self.instructions}
-        ]
+        self.messages = Conversation(self.instructions)
         self.model = model
         self.tools = tools
+        # weather changes slowly: reuse results for repeated cities for 10 minutes
+        self.tool_executor = ToolExecutor(self.name, limits={"get_current_weather": ToolLimits(cache_ttl=600)})
+        
+    def show(self, text):
+        ## streamed answer text, printed as it arrives (think blocks left out)
+        print(text, end="", flush=True)
         
     def consolidate_context(self,messages):
-        ## ask a language model to consolidate the context
+        ## ask a language model to consolidate the context; the history stays a cached prefix
         completion = client.chat.completions.create(
             model="qwen/qwen3-32b",
-            messages=[{"role": "user", "content": "Consolidate the following messages into a single message. Do not lose any information."+json.dumps(messages)}],
+            messages=messages.with_control(CONSOLIDATE_PROMPT),
             tools=self.tools,
             tool_choice="auto"
         )
-        ## recreate the messages list with the consolidated context
-        messages = [
-            {"role": "system", "content": self.instructions},
-            {"role": "user", "content": completion.choices[0].message.content}
-        ]
-        return messages
+        ## start a new conversation from the consolidated context
+        return messages.consolidated(completion.choices[0].message.content)
 
 
     def prompt(self,messages):
-        completion = client.chat.completions.create(
-            model="qwen/qwen3-32b",
-            messages=messages,
-            tools=self.tools,
-            tool_choice="auto"
+        ## stream the completion: each tool call starts as soon as the model has written it
+        batch = self.tool_executor.batch(self.handle_tool_call)
+        completion = stream_completion(
+            client.chat.completions.create(
+                model="qwen/qwen3-32b",
+                messages=messages,
+                tools=self.tools,
+                tool_choice="auto",
+                **STREAM_OPTIONS
+            ),
+            on_tool_call=batch.submit, on_text=self.show, agent=self.name, model=self.model
         )
+        self.last_completion = completion
+        print()
         print(completion.choices[0].message)
-        result = completion.choices[0].message.content
-        result = result.split("</think>")[1]
-        print(result)
+        messages.append(assistant_message(completion.choices[0].message))
         ## handle tool calls if there are any 
         if completion.choices[0].message.tool_calls:
             print("Tool calls found")
-            for tool_call in completion.choices[0].message.tool_calls:
-                messages = self.handle_tool_call(tool_call,messages)
+            messages = batch.results(messages)
         
         
         return messages
     
     def handle_tool_call(self, tool_call,messages): # act
-        for tool in self.tools:
-            if tool.get("function").get("name") == tool_call.function.name:
-                if tool_call.function.name == "get_current_weather":
-                    tool_call_arguments = json.loads(tool_call.function.arguments)
-                    result = get_current_weather(tool_call_arguments.get("location"), tool_call_arguments.get("unit"))
-                messages.append({"role": "tool", "content": result})
-                return messages
+        return registry.handle_tool_call(tool_call, messages)
 
     def run(self, kickoff_message):
         self.messages.append({"role": "user", "content": kickoff_message})
@@ -69,56 +81,21 @@ class Agent:
         self.messages = results
         return self.messages
     
-    def agentic_run(self, kickoff_message):
-        ## first run the kickoff message
+    def agentic_run(self, kickoff_message, max_iterations=10, token_budget=None):
+        ## observe, decide and act in one completion per iteration until the model answers
         self.messages.append({"role": "user", "content": kickoff_message})
-        results = self.prompt(self.messages)
-        self.messages = results
-        ## then run the agentic loop
-        continue_flag = "yes"
-        
-        while continue_flag == "yes":
-            messages = self.messages.copy() # observe 
-            messages.append({"role": "user", "content": "Has the original kickoff prompt been completed, or should we continue? Respond with only yes (continue) or no (stop) with no other text."})
-            results = self.prompt(messages) # decide
-            continue_flag = results[-1].get("content").lower()
-            if continue_flag == "no":
-                break
-            self.messages.append({"role": "user", "content": "Please continue with the original prompt."}) # decide
-            results = self.prompt(self.messages)
-            self.messages = results
-        
-        return self.messages
+        return run_until_done(self, max_iterations=max_iterations, token_budget=token_budget)
     
     
     
-tools = [
-    {
-    "type": "function",
-    "function": {
-      "name": "get_current_weather",
-      "description": "Get the current weather in a given location",
-      "parameters": {
-        "type": "object",
-        "properties": {
-          "location": {
-            "type": "string",
-            "description": "The city and state, e.g. San Francisco, CA",
-          },
-          "unit": {"type": "string", "enum": ["celsius", "fahrenheit"]},
-        },
-        "required": ["location"],
-      },
-    }
-  }
-]
+registry = ToolRegistry(get_current_weather)
+tools = registry.schemas
 
 agent = Agent(
     name="First-Mate Agent",
     instructions=f"""
     You are a helpful assistant that can use function tools to help the user.
     You can use the get_current_weather tool for real-time access to the weather.
-    {tools}
     """,
     model="qwen/qwen3-32b",
     tools=tools
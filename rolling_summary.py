@@ -0,0 +1,191 @@
+"""
+Rolling Summary
+
+Keeps long conversations within budget without stopping the agent. Instead of
+sending the whole history to the model and replacing it with one summary,
+RollingSummarizer.compact() (called before each completion):
+
+- summarizes only the oldest window of turns into a summary block, and keeps
+  recent turns verbatim
+- merges summary blocks into one once max_summaries of them pile up, so older
+  history is summarized hierarchically rather than dropped
+- runs summaries on a background thread: compact() starts a job and returns at
+  once, and the finished summary is spliced in on a later call (if the window
+  is still at the head of the conversation)
+- caches summaries by the hash of the conversation up to the end of the window,
+  so the same window is never summarized twice
+
+Summary blocks are user messages starting with SUMMARY_PREFIX, placed right
+after the system prompt.
+"""
+
+import time
+import logging
+import threading
+import contextvars
+import collections
+import concurrent.futures
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent_metrics import record_completion
+from agent_tracing import tracer
+from conversation import Conversation
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_PREFIX = "[Summary of earlier conversation]"
+
+SUMMARY_PROMPT = (
+    "You compress agent conversations. Summarize the transcript you are given so the agent "
+    "can continue its work without it: keep the task, decisions, facts and figures, tool "
+    "results that matter, file names, URLs and open questions. Be concise. Reply with the summary only."
+)
+
+_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool() -> concurrent.futures.ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="summary")
+        return _pool
+
+
+def is_summary(message: Dict[str, Any]) -> bool:
+    content = message.get("content")
+    return message.get("role") == "user" and isinstance(content, str) and content.startswith(SUMMARY_PREFIX)
+
+
+def transcript(messages: List[Dict[str, Any]]) -> str:
+    """Messages as plain text for the summarizer"""
+    lines = []
+    for message in messages:
+        if is_summary(message):
+            lines.append(f"earlier summary: {message['content'][len(SUMMARY_PREFIX):].strip()}")
+            continue
+        if message.get("content"):
+            lines.append(f"{message.get('role')}: {message['content']}")
+        for call in message.get("tool_calls") or []:
+            function = call.get("function", {}) if isinstance(call, dict) else {}
+            lines.append(f"{message.get('role')} called {function.get('name')}({function.get('arguments', '')})")
+    return "\n".join(lines)
+
+
+def openai_summarizer(client: Any, model: str, agent: str = "agent",
+                      max_tokens: Optional[int] = None) -> Callable[[List[Dict[str, Any]]], str]:
+    """A summarize function using an OpenAI-compatible client"""
+    def summarize(messages: List[Dict[str, Any]]) -> str:
+        started = time.perf_counter()
+        with tracer.span("llm.summarize", agent=agent, model=model, messages=len(messages)):
+            completion = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_PROMPT},
+                    {"role": "user", "content": transcript(messages)},
+                ],
+                **({"max_tokens": max_tokens} if max_tokens else {}),
+            )
+        record_completion(agent, model, started, completion)
+        content = completion.choices[0].message.content or ""
+        # Reasoning models put their thinking before the answer
+        return content.split("</think>")[-1].strip()
+    return summarize
+
+
+class RollingSummarizer:
+    """Compacts the oldest turns of a Conversation into summary blocks in the background"""
+
+    def __init__(self, summarize: Callable[[List[Dict[str, Any]]], str], threshold_tokens: int,
+                 keep_recent_tokens: Optional[int] = None, window_tokens: Optional[int] = None,
+                 max_summaries: int = 4, cache_size: int = 256, name: str = "agent"):
+        self.summarize = summarize
+        self.threshold_tokens = threshold_tokens  # compact once the conversation is larger than this
+        self.keep_recent_tokens = keep_recent_tokens if keep_recent_tokens is not None else threshold_tokens // 2
+        self.window_tokens = window_tokens if window_tokens is not None else threshold_tokens
+        self.max_summaries = max_summaries
+        self.cache_size = cache_size
+        self.name = name
+        self._cache: collections.OrderedDict = collections.OrderedDict()  # prefix key -> summary
+        self._job: Optional[Tuple[str, int, int, concurrent.futures.Future]] = None  # key, start, end, future
+        self._lock = threading.Lock()
+
+    def compact(self, conversation: Conversation) -> Conversation:
+        """Apply a finished summary and start the next one if needed; never waits for the model"""
+        with self._lock:
+            conversation = self._collect(conversation)
+            if self._job is not None:
+                return conversation
+            window = self._next_window(conversation)
+            if window is None:
+                return conversation
+            start, end = window
+            key = conversation.prefix_key(end)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._splice(conversation, start, end, self._cache[key])
+            messages = list(conversation[start:end])
+            logger.info(f"{self.name}: summarizing messages {start}-{end} ({len(messages)}) in the background")
+            future = _shared_pool().submit(contextvars.copy_context().run, self.summarize, messages)
+            self._job = (key, start, end, future)
+            return conversation
+
+    @property
+    def pending(self) -> bool:
+        return self._job is not None
+
+    def _collect(self, conversation: Conversation) -> Conversation:
+        if self._job is None or not self._job[3].done():
+            return conversation
+        key, start, end, future = self._job
+        self._job = None
+        try:
+            summary = future.result()
+        except Exception as error:
+            logger.error(f"{self.name}: background summary failed: {error}")
+            return conversation
+        if not summary:
+            return conversation
+        self._cache[key] = summary
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        if len(conversation) < end or conversation.prefix_key(end) != key:
+            return conversation  # consolidated or reset meanwhile; the summary stays cached
+        return self._splice(conversation, start, end, summary)
+
+    def _splice(self, conversation: Conversation, start: int, end: int, summary: str) -> Conversation:
+        compacted = conversation.splice(start, end, [{"role": "user", "content": f"{SUMMARY_PREFIX}\n{summary}"}])
+        logger.info(f"{self.name}: compacted {end - start} messages, {conversation.tokens} -> {compacted.tokens} tokens")
+        return compacted
+
+    def _next_window(self, conversation: Conversation) -> Optional[Tuple[int, int]]:
+        """(start, end) of the next messages to summarize, or None"""
+        if conversation.tokens <= self.threshold_tokens:
+            return None
+        sizes = conversation.token_counts
+
+        # Summary blocks directly after the system prompt; merge them once there are enough
+        summaries = 1
+        while summaries < len(conversation) and is_summary(conversation[summaries]):
+            summaries += 1
+        if summaries - 1 >= self.max_summaries:
+            return 1, summaries
+
+        # Recent turns, kept verbatim
+        recent, kept = len(conversation), 0
+        while recent > summaries and kept + sizes[recent - 1] <= self.keep_recent_tokens:
+            recent -= 1
+            kept += sizes[recent]
+
+        end, taken = summaries, 0
+        while end < recent and taken < self.window_tokens:
+            taken += sizes[end]
+            end += 1
+        # Don't separate tool results from the assistant turn that called them
+        while end < len(conversation) and conversation[end].get("role") == "tool":
+            end += 1
+        if end == summaries or end >= len(conversation):
+            return None
+        return summaries, end
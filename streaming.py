@@ -0,0 +1,190 @@
+"""
+Streaming Completions
+
+Consumes a chat completion requested with `stream=True` as it is generated,
+instead of waiting for the whole response (including a qwen3 `<think>` block):
+
+- visible text is passed to `on_text` as it arrives, with `<think>...</think>`
+  left out, even when a tag is split across chunks
+- each tool call is passed to `on_tool_call` as soon as its arguments are a
+  complete JSON object (or the next call starts), while the model is still
+  generating the calls after it; with a ToolBatch's submit, tools run during
+  the rest of the completion
+- the assembled result has the shape of a non-streamed completion
+  (choices[0].message.content / tool_calls, finish_reason, usage), so
+  assistant_message(), completion_turn() and record_completion() work on it
+
+    batch = self.tool_executor.batch(self.handle_tool_call)
+    completion = stream_completion(
+        client.chat.completions.create(..., **STREAM_OPTIONS),
+        on_tool_call=batch.submit, on_text=self.on_text, agent=self.name, model=self.model,
+    )
+    messages.append(assistant_message(completion.choices[0].message))
+    messages = batch.results(messages)
+"""
+
+import json
+import time
+import logging
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from agent_metrics import LLM_FIRST_TOKEN
+
+logger = logging.getLogger(__name__)
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+# Request arguments for a streamed completion; usage only comes with the last chunk if asked for
+STREAM_OPTIONS = {"stream": True, "stream_options": {"include_usage": True}}
+
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+def _partial_tag(text: str, tag: str) -> int:
+    """Length of the longest end of `text` that could be the start of `tag`"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkFilter:
+    """Removes <think>...</think> blocks from text that arrives in pieces"""
+
+    def __init__(self):
+        self.thinking = False
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """The visible part of `text`; a possible partial tag at the end is held back"""
+        pending = self._pending + text
+        visible: List[str] = []
+        while pending:
+            tag = THINK_CLOSE if self.thinking else THINK_OPEN
+            at = pending.find(tag)
+            if at >= 0:
+                if not self.thinking:
+                    visible.append(pending[:at])
+                pending = pending[at + len(tag):]
+                self.thinking = not self.thinking
+                continue
+            held = _partial_tag(pending, tag)
+            if not self.thinking:
+                visible.append(pending[:len(pending) - held])
+            pending = pending[len(pending) - held:]
+            break
+        self._pending = pending
+        return "".join(visible)
+
+    def flush(self) -> str:
+        """Whatever was held back, once the stream has ended"""
+        pending, self._pending = self._pending, ""
+        return "" if self.thinking else pending
+
+
+def _complete_arguments(arguments: str) -> bool:
+    """Whether streamed arguments are a whole JSON object (a prefix of one never parses)"""
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        return isinstance(json.loads(arguments), dict)
+    except ValueError:
+        return False
+
+
+def _tool_call(call: Dict[str, Any], index: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        id=call["id"] or f"call_{index}",
+        type="function",
+        function=SimpleNamespace(name=call["name"], arguments=call["arguments"]),
+    )
+
+
+def stream_completion(chunks: Iterable[Any], on_tool_call: Optional[Callable[[Any], Any]] = None,
+                      on_text: Optional[Callable[[str], Any]] = None, agent: str = "agent",
+                      model: str = "") -> SimpleNamespace:
+    """
+    Read a streamed chat completion, dispatching tool calls and text as they complete.
+
+    Tool calls are dispatched once each, in order. The returned completion's
+    message content is the full text, think block included, as a non-streamed
+    completion would have it.
+    """
+    started = time.perf_counter()
+    first_token = False
+    content: List[str] = []
+    calls: List[Dict[str, Any]] = []  # by stream index: id, name, arguments so far
+    dispatched: List[SimpleNamespace] = []
+    finish_reason = None
+    usage = None
+    response_model = model
+    think = ThinkFilter()
+
+    def dispatch(upto: int):
+        # Calls arrive one after another, so every call before `upto` is finished
+        while len(dispatched) < upto:
+            call = _tool_call(calls[len(dispatched)], len(dispatched))
+            dispatched.append(call)
+            logger.debug(f"{agent}: tool call {call.function.name} complete after {time.perf_counter() - started:.2f}s")
+            if on_tool_call is not None:
+                on_tool_call(call)
+
+    for chunk in chunks:
+        usage = _field(chunk, "usage") or usage
+        response_model = _field(chunk, "model") or response_model
+        choices = _field(chunk, "choices") or []
+        if not choices:
+            continue
+        choice = choices[0]
+        finish_reason = _field(choice, "finish_reason") or finish_reason
+        delta = _field(choice, "delta")
+        if delta is None:
+            continue
+
+        text = _field(delta, "content")
+        if text:
+            if not first_token:
+                first_token = True
+                LLM_FIRST_TOKEN.labels(agent, model).observe(time.perf_counter() - started)
+            content.append(text)
+            visible = think.feed(text)
+            if visible and on_text is not None:
+                on_text(visible)
+
+        for fragment in _field(delta, "tool_calls") or []:
+            index = _field(fragment, "index")
+            if index is None:
+                index = max(len(calls) - 1, 0)
+            while len(calls) <= index:
+                calls.append({"id": None, "name": "", "arguments": ""})
+            dispatch(index)  # a new call has started
+            function = _field(fragment, "function")
+            if index < len(dispatched):
+                if _field(function, "arguments"):
+                    logger.warning(f"{agent}: ignoring more arguments for an already dispatched tool call")
+                continue
+            call = calls[index]
+            call["id"] = _field(fragment, "id") or call["id"]
+            call["name"] += _field(function, "name") or ""
+            call["arguments"] += _field(function, "arguments") or ""
+            if call["name"] and _complete_arguments(call["arguments"]):
+                dispatch(index + 1)
+
+    remainder = think.flush()
+    if remainder and on_text is not None:
+        on_text(remainder)
+    dispatch(len(calls))  # calls cut off or without arguments: the handler reports them
+
+    message = SimpleNamespace(role="assistant", content="".join(content) or None, tool_calls=dispatched or None)
+    return SimpleNamespace(
+        model=response_model,
+        choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+        usage=usage,
+    )
@@ -0,0 +1,144 @@
+"""
+Tests for draining an agent's in-flight work on shutdown
+"""
+
+import asyncio
+import time
+
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+class SlowAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.runs = []
+        super().__init__(nats_config=NATSConfig(nats_url=url))
+
+    def run(self, text):
+        self.runs.append(text)
+        time.sleep(self.delay)
+        return [{"role": "assistant", "content": f"{self.name} did {text}"}]
+
+
+async def connected(*agents):
+    for agent in agents:
+        await agent.connect_nats()
+    return agents
+
+
+def test_drain_lets_in_flight_requests_finish():
+    async def scenario():
+        caller, server = await connected(SlowAgent("Drain-Caller", "inproc://drain-finish"),
+                                         SlowAgent("Drain-Server", "inproc://drain-finish", delay=0.2))
+        request = asyncio.create_task(caller.request_from_agent("Drain-Server", "a", timeout=5))
+        await asyncio.sleep(0.05)
+
+        # Each request runs in its own task, not in the subscription's delivery loop
+        assert len(server.inflight_tasks) == 1
+        assert all(not task.get_coro().__qualname__.endswith("_deliver_loop") for task in server.inflight_tasks)
+
+        drained = await server.drain_nats(timeout=5)
+        answer = await request
+        late = await caller.request_from_agent("Drain-Server", "b", timeout=1)
+        await server.disconnect_nats()
+        await caller.disconnect_nats()
+        return drained, answer, late
+
+    drained, answer, late = asyncio.run(scenario())
+
+    assert drained is True
+    assert answer == "Drain-Server did a"
+    assert late is None  # no longer subscribed to new work
+
+
+def test_drain_gives_up_at_the_deadline_and_disconnect_cancels():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        caller, server = await connected(SlowAgent("Deadline-Caller", "inproc://drain-deadline"),
+                                         SlowAgent("Deadline-Server", "inproc://drain-deadline", delay=0.5))
+        request = asyncio.create_task(caller.request_from_agent("Deadline-Server", "a", timeout=2))
+        await asyncio.sleep(0.05)
+        in_flight = set(server.inflight_tasks)
+
+        started = loop.time()
+        drained = await server.drain_nats(timeout=0.1)
+        waited = loop.time() - started
+        await server.disconnect_nats(drain=False)
+        await asyncio.sleep(0)
+        answer = await request
+        await caller.disconnect_nats()
+        return drained, waited, in_flight, answer
+
+    drained, waited, in_flight, answer = asyncio.run(scenario())
+
+    assert drained is False
+    assert waited < 0.4
+    assert len(in_flight) == 1 and all(task.cancelled() for task in in_flight)
+    assert answer is None
+
+
+def test_disconnect_without_drain_drops_queued_requests():
+    async def scenario():
+        caller, server = await connected(SlowAgent("Drop-Caller", "inproc://drain-drop"),
+                                         SlowAgent("Drop-Server", "inproc://drain-drop", delay=0.3))
+        requests = [asyncio.create_task(caller.request_from_agent("Drop-Server", text, timeout=1))
+                    for text in "ab"]
+        await asyncio.sleep(0.05)
+        await server.disconnect_nats(drain=False)
+        answers = await asyncio.gather(*requests)
+        await caller.disconnect_nats()
+        return answers, server.runs
+
+    answers, runs = asyncio.run(scenario())
+
+    assert answers == [None, None]
+    assert runs == ["a"]  # the queued request was dropped, not run
+
+
+def test_replica_keeps_serving_while_another_drains():
+    async def scenario():
+        caller, leaving, staying = await connected(
+            SlowAgent("Rolling-Caller", "inproc://drain-rolling"),
+            SlowAgent("Rolling-Server", "inproc://drain-rolling"),
+            SlowAgent("Rolling-Server", "inproc://drain-rolling"),
+        )
+        assert await leaving.drain_nats(timeout=1)
+        answers = [await caller.request_from_agent("Rolling-Server", str(index), timeout=2) for index in range(5)]
+        for agent in (leaving, staying, caller):
+            await agent.disconnect_nats()
+        return answers
+
+    assert asyncio.run(scenario()) == [f"Rolling-Server did {index}" for index in range(5)]
+
+
+def test_requests_to_one_agent_run_one_at_a_time():
+    async def scenario():
+        caller, server = await connected(SlowAgent("Serial-Caller", "inproc://drain-serial"),
+                                         SlowAgent("Serial-Server", "inproc://drain-serial", delay=0.05))
+        running, overlaps = [], []
+        run = server.run
+
+        def tracked(text):
+            overlaps.append(len(running))
+            running.append(text)
+            try:
+                return run(text)
+            finally:
+                running.remove(text)
+
+        server.run = tracked
+        answers = await asyncio.gather(*(caller.request_from_agent("Serial-Server", str(index), timeout=5)
+                                         for index in range(3)))
+        await server.disconnect_nats()
+        await caller.disconnect_nats()
+        return answers, overlaps
+
+    answers, overlaps = asyncio.run(scenario())
+
+    assert answers == [f"Serial-Server did {index}" for index in range(3)]
+    assert overlaps == [0, 0, 0]  # run() keeps the conversation on the agent
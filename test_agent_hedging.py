@@ -0,0 +1,109 @@
+"""
+Tests for hedged requests between replicas of an agent
+"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+from prometheus_client import REGISTRY
+
+import nats_agent_mixin
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+class ReplicaAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url, label="", **config):
+        self.name = name
+        self.label = label
+        self.delay = 0.0
+        super().__init__(nats_config=NATSConfig(nats_url=url, hedge_min_samples=5, **config))
+
+    def run(self, text):
+        time.sleep(self.delay)
+        return [{"role": "assistant", "content": f"{self.label}: {text}"}]
+
+
+def hedged(agent, outcome):
+    return REGISTRY.get_sample_value("agent_hedged_requests_total", {
+        "agent": agent, "target": "Hedge-Server", "outcome": outcome})
+
+
+async def replicas(caller_name, url, labels, **config):
+    """A caller and replicas of Hedge-Server, with enough latency samples for hedging"""
+    caller = ReplicaAgent(caller_name, url, hedge_requests=True, **config)
+    await caller.connect_nats()
+    servers = [ReplicaAgent("Hedge-Server", url, label) for label in labels]
+    for server in servers:
+        await server.connect_nats()
+    for index in range(5):
+        await caller.request_from_agent("Hedge-Server", str(index), timeout=5, hedge=False)
+    return caller, servers
+
+
+def pick_slow(monkeypatch, slow):
+    """Send the first copy to the slow replica, as random.choice would some of the time"""
+    def choice(options):
+        instance = slow.agent_metadata.instance_id
+        return instance if instance in options else options[0]
+
+    monkeypatch.setattr(nats_agent_mixin, "random", SimpleNamespace(choice=choice))
+
+
+def test_hedge_goes_to_another_replica_and_wins(monkeypatch):
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        caller, (slow, fast) = await replicas("Hedge-Caller", "inproc://hedge-replica", ["slow", "fast"],
+                                              hedge_budget=1.0)
+        assert sorted(caller.peer_registry.available_instances("Hedge-Server")) == sorted(
+            server.agent_metadata.instance_id for server in (slow, fast))
+        pick_slow(monkeypatch, slow)
+        slow.delay = 1.0
+
+        started = loop.time()
+        answer = await caller.request_from_agent("Hedge-Server", "Boston", timeout=5)
+        elapsed = loop.time() - started
+        for agent in (caller, slow, fast):
+            await agent.disconnect_nats(drain=False)
+        return answer, elapsed
+
+    answer, elapsed = asyncio.run(scenario())
+
+    assert answer == "fast: Boston"
+    assert elapsed < 0.5  # didn't wait for the slow replica
+    assert hedged("Hedge-Caller", "sent") == 1
+    assert hedged("Hedge-Caller", "won") == 1
+
+
+def test_hedges_stay_within_the_budget(monkeypatch):
+    async def scenario():
+        caller, (slow, fast) = await replicas("Budget-Caller", "inproc://hedge-budget", ["slow", "fast"])
+        pick_slow(monkeypatch, slow)
+        slow.delay = 0.3
+        answer = await caller.request_from_agent("Hedge-Server", "Boston", timeout=5)
+        for agent in (caller, slow, fast):
+            await agent.disconnect_nats(drain=False)
+        return answer
+
+    # One hedge in one request is over the default 5% budget, so the slow reply is waited for
+    assert asyncio.run(scenario()) == "slow: Boston"
+    assert hedged("Budget-Caller", "over_budget") == 1
+    assert not hedged("Budget-Caller", "sent")
+
+
+def test_single_replica_without_alternative_is_not_hedged():
+    async def scenario():
+        caller, (only,) = await replicas("Alone-Caller", "inproc://hedge-alone", ["only"], hedge_budget=1.0)
+        only.delay = 0.3
+        answer = await caller.request_from_agent("Hedge-Server", "Boston", timeout=5)
+        for agent in (caller, only):
+            await agent.disconnect_nats(drain=False)
+        return answer
+
+    assert asyncio.run(scenario()) == "only: Boston"
+    assert hedged("Alone-Caller", "no_target") == 1
+    assert not hedged("Alone-Caller", "sent")
@@ -0,0 +1,141 @@
+"""
+Tests for long-running jobs: job records, their stores and submit/wait between agents
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from nats.js.errors import BucketNotFoundError, KeyNotFoundError
+
+from agent_jobs import JOB_FAILED, JOB_RUNNING, JOB_SUCCEEDED, Job, KVJobStore, LocalJobStore
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+class FakeKeyValue:
+    def __init__(self):
+        self.entries = {}
+
+    async def put(self, key, value):
+        self.entries[key] = value
+
+    async def get(self, key):
+        if key not in self.entries:
+            raise KeyNotFoundError
+        return SimpleNamespace(value=self.entries[key])
+
+
+class FakeJetStream:
+    """The key_value/create_key_value surface of JetStream, starting without the bucket"""
+
+    def __init__(self):
+        self.buckets = {}
+        self.created = []
+
+    async def key_value(self, bucket):
+        await asyncio.sleep(0)  # let concurrent callers interleave
+        if bucket not in self.buckets:
+            raise BucketNotFoundError
+        return self.buckets[bucket]
+
+    async def create_key_value(self, bucket, description, ttl):
+        self.created.append((bucket, ttl))
+        return self.buckets.setdefault(bucket, FakeKeyValue())
+
+
+class WriterAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url, **config):
+        self.name = name
+        super().__init__(nats_config=NATSConfig(nats_url=url, **config))
+
+    def run(self, text):
+        if text == "fail":
+            raise ValueError("out of ideas")
+        for step in (1, 2):
+            self.report_progress(step / 4, f"Section {step}")
+        return [{"role": "assistant", "content": text * 10}]
+
+
+def test_job_records_round_trip_through_the_local_store():
+    async def scenario():
+        store = LocalJobStore()
+        job = Job(job_id="j1", agent="Writer", submitted_by="Planner")
+        await store.put(job)
+        job.status = JOB_RUNNING  # the store keeps a copy, not the object
+        return await store.get("j1"), await store.get("missing")
+
+    stored, missing = asyncio.run(scenario())
+
+    assert stored == Job(job_id="j1", agent="Writer", submitted_by="Planner",
+                         created_at=stored.created_at, updated_at=stored.updated_at)
+    assert not stored.done
+    assert missing is None
+
+
+def test_kv_store_creates_its_bucket_once():
+    js = FakeJetStream()
+    store = KVJobStore(SimpleNamespace(jetstream=lambda: js), "agent_jobs", ttl=60.0)
+
+    async def scenario():
+        jobs = [Job(job_id=f"j{index}", agent="Writer", submitted_by="Planner") for index in range(3)]
+        await asyncio.gather(*(store.put(job) for job in jobs))
+        jobs[0].status = JOB_SUCCEEDED
+        await store.put(jobs[0])
+        return await store.get("j0"), await store.get("missing")
+
+    stored, missing = asyncio.run(scenario())
+
+    assert js.created == [("agent_jobs", 60.0)]
+    assert stored.status == JOB_SUCCEEDED and stored.done
+    assert missing is None
+
+
+def test_submitted_job_reports_progress_and_result():
+    async def scenario():
+        url = "inproc://jobs"
+        # A small offload threshold claim-checks the result
+        planner = WriterAgent("Job-Planner", url)
+        writer = WriterAgent("Job-Writer", url, payload_offload_threshold=64)
+        await planner.connect_nats()
+        await writer.connect_nats()
+        events, completed = [], asyncio.get_running_loop().create_future()
+        job_id = await planner.submit_job("Job-Writer", "chapter ", on_progress=events.append,
+                                          on_complete=completed.set_result)
+        finished = await asyncio.wait_for(completed, 5)
+        waited = await planner.wait_for_job(job_id, timeout=1)  # already done
+        record = await writer.job_store.get(job_id)
+        await planner.disconnect_nats()
+        await writer.disconnect_nats()
+        return job_id, events, finished, waited, record
+
+    job_id, events, finished, waited, record = asyncio.run(scenario())
+
+    assert [(event.status, event.progress) for event in events] == [
+        (JOB_RUNNING, 0.0), (JOB_RUNNING, 0.25), (JOB_RUNNING, 0.5), (JOB_SUCCEEDED, 1.0)]
+    assert all(event.result is None for event in events)  # events don't carry the result
+    assert finished.job_id == job_id and finished.result == "chapter " * 10
+    assert waited.status == JOB_SUCCEEDED and waited.result == "chapter " * 10
+    assert record.result_ref is not None
+
+
+def test_failed_and_unaccepted_jobs():
+    async def scenario():
+        url = "inproc://jobs-failing"
+        planner = WriterAgent("Fail-Planner", url, job_ack_timeout=0.2)
+        writer = WriterAgent("Fail-Writer", url)
+        await planner.connect_nats()
+        await writer.connect_nats()
+        job_id = await planner.submit_job("Fail-Writer", "fail")
+        failed = await planner.wait_for_job(job_id, timeout=5)
+        nobody = await planner.submit_job("Nobody", "chapter")
+        await planner.disconnect_nats()
+        await writer.disconnect_nats()
+        return failed, nobody
+
+    failed, nobody = asyncio.run(scenario())
+
+    assert failed.status == JOB_FAILED and failed.error == "out of ideas"
+    assert nobody is None
@@ -0,0 +1,124 @@
+"""
+Tests for the shared act-until-done loop
+"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from agent_loop import CONTINUE_PROMPT, FINISH_PROMPT, assistant_message, fill_missing_tool_results, run_until_done
+
+
+def tool_call(name, call_id="call-1", **arguments):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": json.dumps(arguments)}}
+
+
+def completion(content=None, tool_calls=None, finish_reason=None, tokens=10):
+    finish_reason = finish_reason or ("tool_calls" if tool_calls else "stop")
+    return {"content": content, "tool_calls": tool_calls, "finish_reason": finish_reason,
+            "usage": {"total_tokens": tokens}}
+
+
+class ScriptedAgent:
+    """Answers prompt() with the next scripted completion, answering tool calls unless told not to"""
+
+    name = "Scripted"
+
+    def __init__(self, *completions, answer_tools=True):
+        self.completions = list(completions)
+        self.answer_tools = answer_tools
+        self.messages = [{"role": "user", "content": "Plan a day trip"}]
+        self.last_completion = None
+
+    def prompt(self, messages):
+        self.last_completion = self.completions.pop(0)
+        messages.append(assistant_message(self.last_completion))
+        for call in self.last_completion.get("tool_calls") or []:
+            if self.answer_tools:
+                messages.append({"role": "tool", "tool_call_id": call["id"], "content": "Sunny"})
+        return messages
+
+
+def test_tool_calls_lead_to_another_iteration_until_an_answer():
+    agent = ScriptedAgent(completion(tool_calls=[tool_call("get_weather", city="Salem")]),
+                          completion("Go to Salem"))
+
+    messages = run_until_done(agent)
+
+    assert [message["role"] for message in messages] == ["user", "assistant", "tool", "assistant"]
+    assert messages[-1]["content"] == "Go to Salem"
+    assert not agent.completions
+
+
+def test_finish_tool_ends_the_loop_with_its_summary():
+    agent = ScriptedAgent(completion("Done", tool_calls=[tool_call("finish", summary="Booked Salem")]),
+                          completion("never asked"))
+
+    messages = run_until_done(agent, require_finish=True)
+
+    assert messages[-1] == {"role": "assistant", "content": "Booked Salem"}
+    assert len(agent.completions) == 1
+
+
+def test_truncated_or_unfinished_answers_are_continued():
+    truncated = ScriptedAgent(completion("Day 1: Sal", finish_reason="length"), completion("em"))
+    unfinished = ScriptedAgent(completion("Step 1 done"), completion("Step 2 done"),
+                               completion(tool_calls=[tool_call("finish", summary="All done")]))
+
+    run_until_done(truncated)
+    run_until_done(unfinished, require_finish=True)
+
+    assert [message["content"] for message in truncated.messages if message["role"] == "user"][1:] == [
+        CONTINUE_PROMPT]
+    assert [message["content"] for message in unfinished.messages if message["role"] == "user"][1:] == [
+        FINISH_PROMPT, FINISH_PROMPT]
+
+
+def test_errors_budgets_and_iteration_limits_stop_the_loop():
+    looping = [completion(tool_calls=[tool_call("get_weather")], tokens=40) for _ in range(5)]
+
+    failed = ScriptedAgent({"finish_reason": "error"}, completion("never asked"))
+    run_until_done(failed)
+    over_budget = ScriptedAgent(*looping)
+    run_until_done(over_budget, token_budget=100)
+    capped = ScriptedAgent(*looping)
+    run_until_done(capped, max_iterations=2)
+
+    assert len(failed.completions) == 1
+    assert len(over_budget.completions) == 2  # 3 x 40 tokens reached the budget
+    assert len(capped.completions) == 3
+
+
+def test_unanswered_tool_calls_get_a_result():
+    agent = ScriptedAgent(completion(tool_calls=[tool_call("get_weather", "a"), tool_call("get_time", "b")]),
+                          completion("Sunny"), answer_tools=False)
+
+    messages = run_until_done(agent)
+
+    assert messages[2:4] == [
+        {"role": "tool", "tool_call_id": "a", "content": "Tool 'get_weather' was not run."},
+        {"role": "tool", "tool_call_id": "b", "content": "Tool 'get_time' was not run."},
+    ]
+    assert fill_missing_tool_results(list(messages)) == messages  # nothing left to answer
+
+
+def test_enhanced_agent_continues_after_a_tool_call_only_turn(monkeypatch):
+    for module in ("pydantic_settings", "loguru"):  # first_mate_agent's config and logging
+        pytest.importorskip(module)
+    from first_mate_agent import enhanced_agent
+
+    # OpenAI tool-call objects, and no content on a turn that only calls tools
+    weather_call = SimpleNamespace(id="call-1", type="function", function=SimpleNamespace(
+        name="get_current_weather", arguments=json.dumps({"location": "Salem, MA"})))
+    completions = [completion(None, [weather_call]), completion("<think>sunny</think>Go to Salem")]
+    monkeypatch.setattr(enhanced_agent.lm_client, "chat_completion",
+                        lambda messages, tools=None, tool_choice=None: completions.pop(0))
+    agent = enhanced_agent.create_default_agent()
+
+    messages = agent.agentic_run("Where should I go today?")
+
+    assert not completions  # the tool call led to a second completion
+    tool_results = [message for message in messages if message["role"] == "tool"]
+    assert len(tool_results) == 1 and "Salem, MA" in tool_results[0]["content"]
+    assert messages[-1]["content"] == "Go to Salem"
@@ -0,0 +1,76 @@
+"""
+Tests for the Prometheus metrics recorded by agents
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from prometheus_client import REGISTRY
+
+from agent_metrics import record_completion, track_tool_call
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class EchoAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        super().__init__(nats_config=NATSConfig(nats_url=url))
+
+    def run(self, text):
+        return [{"role": "assistant", "content": f"echo {text}"}]
+
+
+def test_completion_latency_and_tokens():
+    usage = SimpleNamespace(prompt_tokens=12, completion_tokens=5)
+
+    record_completion("metrics-llm", "test-model", 0.0, SimpleNamespace(usage=usage))
+
+    labels = dict(agent="metrics-llm", model="test-model")
+    assert sample("agent_llm_latency_seconds_count", **labels) == 1
+    assert sample("agent_llm_tokens_total", kind="prompt", **labels) == 12
+    assert sample("agent_llm_tokens_total", kind="completion", **labels) == 5
+
+
+def test_tool_calls_counted_by_outcome():
+    with track_tool_call("metrics-tools", "lookup"):
+        pass
+    with pytest.raises(ValueError):
+        with track_tool_call("metrics-tools", "lookup"):
+            raise ValueError("bad city")
+
+    labels = dict(agent="metrics-tools", tool="lookup")
+    assert sample("agent_tool_calls_total", status="ok", **labels) == 1
+    assert sample("agent_tool_calls_total", status="error", **labels) == 1
+    assert sample("agent_tool_latency_seconds_count", **labels) == 2
+
+
+def test_requests_counted_by_status():
+    async def scenario():
+        caller = EchoAgent("Metrics-Caller", "inproc://metrics")
+        server = EchoAgent("Metrics-Server", "inproc://metrics")
+        await caller.connect_nats()
+        await server.connect_nats()
+        try:
+            assert await caller.request_from_agent("Metrics-Server", "ping", timeout=5) == "echo ping"
+            assert await caller.request_from_agent("Nobody", "ping", timeout=5) is None
+        finally:
+            await caller.disconnect_nats()
+            await server.disconnect_nats()
+
+    asyncio.run(scenario())
+
+    assert sample("agent_requests_total", agent="Metrics-Caller", target="Metrics-Server", status="ok") == 1
+    assert sample("agent_requests_total", agent="Metrics-Caller", target="Nobody", status="no_responders") == 1
+    assert sample("agent_request_latency_seconds_count",
+                  agent="Metrics-Caller", target="Metrics-Server", outcome="ok") == 1
+    assert sample("agent_messages_received_total", agent="Metrics-Server", message_type="request") == 1
+    assert sample("agent_messages_published_total", agent="Metrics-Server", message_type="response") == 1
@@ -0,0 +1,165 @@
+"""
+Tests for claim-check payload storage
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from nats.js.errors import ObjectNotFoundError
+from prometheus_client import REGISTRY
+
+import agent_payloads
+from agent_payloads import (
+    LocalPayloadStore, ObjectStorePayloadStore, PayloadRef, PayloadStoreUnavailable, content_digest,
+)
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeObjectStore:
+    """The get_info/put surface of a JetStream object store, with settable mtimes"""
+
+    def __init__(self):
+        self.mtimes = {}
+        self.puts = []
+
+    async def get_info(self, name):
+        if name not in self.mtimes:
+            raise ObjectNotFoundError
+        return SimpleNamespace(mtime=self.mtimes[name])
+
+    async def put(self, name, data, meta=None):
+        self.puts.append(name)
+        self.mtimes[name] = datetime.now(timezone.utc).isoformat()
+
+
+class FakeJetStream:
+    def __init__(self, store=None):
+        self.store = store
+        self.calls = 0
+
+    async def object_store(self, bucket):
+        self.calls += 1
+        if self.store is None:
+            raise ConnectionError("JetStream not enabled")
+        return self.store
+
+
+def object_store(js, ttl=3600.0):
+    return ObjectStorePayloadStore(SimpleNamespace(jetstream=lambda: js), "payloads", 4, ttl)
+
+
+class EchoAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        super().__init__(nats_config=NATSConfig(nats_url=url, payload_offload_threshold=64, payload_chunk_size=16))
+
+    def run(self, text):
+        return [{"role": "assistant", "content": f"{len(text)} characters"}]
+
+
+def test_local_store_chunks_and_deduplicates():
+    async def scenario():
+        store = LocalPayloadStore("payloads", chunk_size=4)
+        ref, stored = await store.put(b"0123456789")
+        _, again = await store.put(b"0123456789")
+        return ref, stored, again, [chunk async for chunk in store.iter_chunks(ref)]
+
+    ref, stored, again, chunks = asyncio.run(scenario())
+
+    assert ref == PayloadRef(digest=content_digest(b"0123456789"), size=10, bucket="payloads")
+    assert (stored, again) == (True, False)
+    assert chunks == [b"0123", b"4567", b"89"]
+
+
+def test_local_store_expires_blobs(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(agent_payloads, "time", SimpleNamespace(monotonic=clock))
+
+    async def scenario():
+        store = LocalPayloadStore("payloads", chunk_size=4, ttl=60)
+        ref, _ = await store.put(b"blob")
+        clock.now += 61
+        return [chunk async for chunk in store.iter_chunks(ref)]
+
+    with pytest.raises(KeyError):
+        asyncio.run(scenario())
+
+
+def test_unavailable_jetstream_is_retried_with_backoff(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(agent_payloads, "time", SimpleNamespace(monotonic=clock))
+    js = FakeJetStream()
+    store = object_store(js)
+
+    async def attempt():
+        with pytest.raises(PayloadStoreUnavailable):
+            await store.put(b"blob")
+
+    async def scenario():
+        await attempt()
+        await attempt()  # answered from the backoff, without asking JetStream
+        assert js.calls == 1
+        clock.now += agent_payloads.UNAVAILABLE_BACKOFF
+        await attempt()
+        assert js.calls == 2
+        clock.now += agent_payloads.UNAVAILABLE_BACKOFF  # the backoff doubled
+        await attempt()
+        assert js.calls == 2
+        js.store = FakeObjectStore()
+        clock.now += agent_payloads.UNAVAILABLE_BACKOFF
+        return await store.put(b"blob")
+
+    ref, stored = asyncio.run(scenario())
+
+    assert stored and ref.digest == content_digest(b"blob")
+    assert store._failures == 0
+
+
+def test_object_store_refreshes_blobs_past_half_their_ttl():
+    fake = FakeObjectStore()
+    store = object_store(FakeJetStream(fake), ttl=3600.0)
+    young, old = content_digest(b"young"), content_digest(b"old")
+    now = datetime.now(timezone.utc)
+    fake.mtimes[young] = (now - timedelta(minutes=10)).strftime("%Y-%m-%dT%H:%M:%S.%f123Z")  # nanoseconds
+    fake.mtimes[old] = (now - timedelta(minutes=40)).isoformat()
+
+    async def scenario():
+        return [(await store.put(data))[1] for data in (b"young", b"old", b"new", b"young")]
+
+    assert asyncio.run(scenario()) == [False, True, True, False]
+    assert fake.puts == [old, content_digest(b"new")]
+
+
+def test_large_content_travels_by_claim_check():
+    async def scenario():
+        caller = EchoAgent("Claim-Caller", "inproc://payloads")
+        server = EchoAgent("Claim-Server", "inproc://payloads")
+        await caller.connect_nats()
+        await server.connect_nats()
+        answers = [await caller.request_from_agent("Claim-Server", "x" * 1000, timeout=5) for _ in range(2)]
+        await caller.disconnect_nats()
+        await server.disconnect_nats()
+        return answers
+
+    assert asyncio.run(scenario()) == ["1000 characters"] * 2
+
+    def payload_bytes(agent, op):
+        return REGISTRY.get_sample_value("agent_payload_bytes_total", {"agent": agent, "op": op})
+
+    assert payload_bytes("Claim-Caller", "stored") == 1000
+    assert payload_bytes("Claim-Caller", "deduplicated") == 1000
+    assert payload_bytes("Claim-Server", "fetched") == 2000
@@ -0,0 +1,142 @@
+"""
+Tests for peer tracking, phi-accrual failure detection and request failover
+"""
+
+import asyncio
+import math
+import time
+
+from prometheus_client import REGISTRY
+
+from agent_registry import PeerRegistry, PhiAccrualDetector
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import AgentMetadata, NATSConfig
+
+
+def metadata(name, instance_id, capabilities=("weather",), status="available"):
+    return AgentMetadata(name=name, description="", capabilities=list(capabilities), status=status,
+                         instance_id=instance_id)
+
+
+class WorkerAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url, delay=0.0):
+        self.name = name
+        self.delay = delay
+        super().__init__(nats_config=NATSConfig(nats_url=url, heartbeat_interval=0.05,
+                                                failure_check_interval=0.01))
+
+    def run(self, text):
+        time.sleep(self.delay)
+        return [{"role": "assistant", "content": f"{self.name}: {text}"}]
+
+
+def test_phi_grows_with_silence():
+    detector = PhiAccrualDetector(expected_interval=5.0)
+    for beat in range(10):
+        detector.heartbeat(now=beat * 5.0)
+    last = 45.0
+
+    assert detector.phi(now=last + 5.0) < 1
+    assert detector.phi(now=last + 7.0) < 8 < detector.phi(now=last + 8.0)
+    assert detector.phi(now=last + 600) == math.inf  # long silences don't overflow
+
+
+def test_default_detection_beats_the_request_timeout():
+    config = NATSConfig()
+    registry = PeerRegistry(config.heartbeat_interval, config.phi_threshold)
+    registry.observe(metadata("Weather-Bot", "a"), now=0.0)
+
+    detected = next(second for second in range(1, 60) if registry.check(now=float(second)))
+
+    assert detected < config.message_timeout / 2
+
+
+def test_name_is_down_only_when_every_instance_is():
+    registry = PeerRegistry(heartbeat_interval=1.0)
+    registry.observe(metadata("Weather-Bot", "a"), now=0.0)
+    registry.observe(metadata("Weather-Bot", "b"), now=0.0)
+
+    registry.mark_offline("Weather-Bot", "a")
+    assert not registry.is_down("Weather-Bot") and registry.is_available("Weather-Bot")
+    assert list(registry.peers["Weather-Bot"]) == ["b"]  # the departed replica is forgotten
+
+    assert registry.check(now=2.0) == [("Weather-Bot", 2.0)]
+    assert registry.is_down("Weather-Bot")
+    assert registry.check(now=3.0) == []  # reported once
+
+    registry.observe(metadata("Weather-Bot", "c"), now=3.0)  # a replacement replica
+    assert not registry.is_down("Weather-Bot")
+    assert list(registry.peers["Weather-Bot"]) == ["c"]
+
+
+def test_alternative_shares_the_most_capabilities():
+    registry = PeerRegistry()
+    registry.observe(metadata("Weather-Bot", "a", ("weather", "forecast")))
+    registry.observe(metadata("Forecaster", "b", ("weather", "forecast")))
+    registry.observe(metadata("Almanac", "c", ("weather",)))
+    registry.observe(metadata("Busy-Forecaster", "d", ("weather", "forecast"), status="busy"))
+    registry.observe(metadata("Planner", "e", ("travel",)))
+
+    assert registry.find_alternative("Weather-Bot") == "Forecaster"
+    assert registry.find_alternative("Weather-Bot", exclude={"Forecaster"}) == "Almanac"
+    assert registry.find_alternative("Weather-Bot", exclude={"Forecaster", "Almanac"}) is None
+    assert registry.find_alternative("Unknown") is None
+
+
+def test_pending_request_fails_over_when_its_target_dies():
+    async def scenario():
+        url = "inproc://failover"
+        caller = WorkerAgent("Failover-Caller", url)
+        stuck = WorkerAgent("Failover-Stuck", url, delay=1.0)
+        backup = WorkerAgent("Failover-Backup", url)
+        await caller.connect_nats()
+        await stuck.connect_nats(capabilities=["weather"])
+        await backup.connect_nats(capabilities=["weather"])
+        await asyncio.sleep(0.2)  # a few heartbeats to learn the interval
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        request = asyncio.create_task(caller.request_from_agent("Failover-Stuck", "Boston", timeout=5))
+        await asyncio.sleep(0.05)
+        for task in stuck.background_tasks:  # the agent hangs: no more heartbeats
+            task.cancel()
+        answer = await request
+        elapsed = loop.time() - started
+
+        # New requests to the dead agent are re-routed before they are sent
+        again = await caller.request_from_agent("Failover-Stuck", "Salem", timeout=5)
+        for agent in (caller, stuck, backup):
+            await agent.disconnect_nats(drain=False)
+        return answer, again, elapsed
+
+    answer, again, elapsed = asyncio.run(scenario())
+
+    assert answer == "Failover-Backup: Boston"
+    assert again == "Failover-Backup: Salem"
+    assert elapsed < 1.0  # didn't wait for the stuck agent (or the timeout)
+    assert REGISTRY.get_sample_value("agent_request_failovers_total", {
+        "agent": "Failover-Caller", "target": "Failover-Stuck", "outcome": "rerouted"}) == 2
+
+
+def test_failure_check_survives_an_error():
+    async def scenario():
+        agent = WorkerAgent("Checker", "inproc://failure-check")
+        checks = []
+
+        def check(now):
+            checks.append(now)
+            if len(checks) == 1:
+                raise ValueError("math domain error")
+            return []
+
+        agent.peer_registry.check = check
+        await agent.connect_nats()
+        await asyncio.sleep(0.1)
+        await agent.disconnect_nats()
+        return checks
+
+    assert len(asyncio.run(scenario())) > 2
+    assert REGISTRY.get_sample_value("agent_errors_total", {"agent": "Checker", "where": "failure_check"}) == 1
@@ -0,0 +1,66 @@
+"""
+Tests for the virtual-clock mesh simulator
+"""
+
+import asyncio
+import random
+import time
+
+from agent_simulator import (
+    AgentProfile, Latency, Policy, Scenario, VirtualClockLoop, compare_policies, render_table, simulate,
+)
+
+
+def scenario(rps=0.5, duration=300.0):
+    return Scenario(
+        agents=[AgentProfile("Sim-Weather", Latency(1.0, 3.0), Latency(0.1, 1.0)),
+                AgentProfile("Sim-Planner", Latency(1.0, 3.0), Latency(0.1, 1.0), weight=0.5)],
+        rps=rps,
+        duration=duration,
+        llm_slots=2,
+    )
+
+
+def test_virtual_clock_skips_waiting():
+    async def nap():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await asyncio.gather(asyncio.sleep(3600), asyncio.sleep(60))
+        return loop.time() - started
+
+    wall = time.perf_counter()
+    with asyncio.Runner(loop_factory=VirtualClockLoop) as runner:
+        virtual = runner.run(nap())
+
+    assert virtual == 3600
+    assert time.perf_counter() - wall < 1
+
+
+def test_latency_distributions():
+    rng = random.Random(0)
+    samples = sorted(Latency(1.0, 5.0).sample(rng) for _ in range(5000))
+
+    assert Latency(2.0, kind="constant").sample(rng) == 2.0
+    assert 0.9 < samples[2500] < 1.1
+    assert 4.0 < samples[4750] < 6.0
+
+
+def test_same_seed_gives_the_same_result():
+    first, second = (simulate(scenario(), Policy(replicas=2, hedge=True), seed=7) for _ in range(2))
+    other = simulate(scenario(), Policy(replicas=2, hedge=True), seed=8)
+
+    assert first == second
+    assert first["requests"] != other["requests"] or first["latency_s"] != other["latency_s"]
+
+
+def test_replicas_and_hedging_under_load():
+    policies = [Policy(replicas=1), Policy(replicas=2), Policy(replicas=2, hedge=True, hedge_budget=0.1)]
+    one, two, hedged = compare_policies(scenario(rps=1.0), policies, seed=1)
+
+    assert one["requests"]["sent"] == two["requests"]["sent"] == hedged["requests"]["sent"]  # same arrivals
+    assert two["latency_s"]["p95"] < one["latency_s"]["p95"]
+    assert one["hedges_sent"] == two["hedges_sent"] == 0
+    assert 0 < hedged["hedges_sent"] <= 0.1 * hedged["requests"]["sent"]
+
+    table = render_table([one, two, hedged]).splitlines()
+    assert len(table) == 5 and table[-1].startswith("replicas=2, hedge 10%@p95")
@@ -0,0 +1,94 @@
+"""
+Tests for trace propagation and span export
+"""
+
+import asyncio
+
+import pytest
+
+from agent_tracing import TRACE_METADATA_KEY, Tracer, load_spans, render_waterfall, tracer
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+class TracedAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        super().__init__(nats_config=NATSConfig(nats_url=url))
+
+    def run(self, text):
+        with tracer.span("llm.call"):
+            return [{"role": "assistant", "content": text.upper()}]
+
+
+def test_spans_nest_and_are_exported(tmp_path):
+    spans = Tracer(str(tmp_path / "traces.jsonl"))
+
+    with spans.span("request", agent="Planner") as root:
+        with spans.span("tool.call", tool="search") as child:
+            pass
+
+    exported = load_spans(str(tmp_path / "traces.jsonl"))
+    assert [span["name"] for span in exported] == ["tool.call", "request"]  # written as they finish
+    assert child.trace_id == root.trace_id
+    assert child.parent_id == root.span_id and root.parent_id is None
+    assert child.agent == "Planner"  # inherited from the enclosing span
+    assert "tool.call [Planner]" in render_waterfall(exported)
+
+
+def test_failed_span_is_marked():
+    spans = Tracer()
+
+    with pytest.raises(RuntimeError):
+        with spans.span("tool.call") as span:
+            raise RuntimeError("backend down")
+
+    assert span.status == "error"
+    assert span.attributes["error"] == "backend down"
+    assert spans.current_span() is None
+
+
+def test_inject_and_extract_continue_the_trace():
+    spans = Tracer()
+    assert spans.inject({}) == {}
+    assert Tracer.extract({TRACE_METADATA_KEY: "garbage"}) is None
+
+    with spans.span("nats.request") as sender:
+        metadata = spans.inject({"original_request": "hi"})
+
+    context = Tracer.extract(metadata)
+    with spans.span("agent.handle_request", parent=context) as receiver:
+        pass
+
+    assert context == {"trace_id": sender.trace_id, "span_id": sender.span_id}
+    assert receiver.trace_id == sender.trace_id
+    assert receiver.parent_id == sender.span_id
+
+
+def test_request_joins_the_callers_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracer, "path", str(tmp_path / "traces.jsonl"))
+
+    async def scenario():
+        caller = TracedAgent("Trace-Caller", "inproc://tracing")
+        server = TracedAgent("Trace-Server", "inproc://tracing")
+        await caller.connect_nats()
+        await server.connect_nats()
+        try:
+            with tracer.span("user.request"):
+                return await caller.request_from_agent("Trace-Server", "hello", timeout=5)
+        finally:
+            await caller.disconnect_nats()
+            await server.disconnect_nats()
+
+    assert asyncio.run(scenario()) == "HELLO"
+
+    spans = {span["name"]: span for span in load_spans(str(tmp_path / "traces.jsonl"))}
+    assert {span["trace_id"] for span in spans.values()} == {spans["user.request"]["trace_id"]}
+    assert spans["nats.request"]["parent_id"] == spans["user.request"]["span_id"]
+    assert spans["agent.handle_request"]["parent_id"] == spans["nats.request"]["span_id"]
+    assert spans["agent.handle_request"]["agent"] == "Trace-Server"
+    # Spans opened by the agent's run() in its worker thread join the request's span
+    assert spans["llm.call"]["parent_id"] == spans["agent.handle_request"]["span_id"]
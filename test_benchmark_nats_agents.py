@@ -0,0 +1,45 @@
+"""
+Tests for the NATS agent mesh benchmark
+"""
+
+import asyncio
+
+import nats_ooda_agent
+import trip_planner_agent
+from benchmark_nats_agents import FakeLLMClient, parse_args, percentile, run_benchmark
+from streaming import STREAM_OPTIONS, stream_completion
+
+
+def test_percentile_is_nearest_rank():
+    values = [5, 1, 4, 2, 3]
+
+    assert percentile([], 50) is None
+    assert percentile(values, 50) == 3
+    assert percentile(values, 95) == 5
+    assert percentile(values, 1) == 1
+
+
+def test_fake_llm_streams_at_the_token_rate():
+    llm = FakeLLMClient(latency=0, tokens_per_sec=1000, output_tokens=3)
+
+    completion = stream_completion(llm.chat.completions.create(messages=[], **STREAM_OPTIONS))
+
+    assert completion.choices[0].message.content == "<think>ok</think>token token token"
+    assert completion.choices[0].finish_reason == "stop"
+    assert completion.usage.completion_tokens == 3
+
+
+def test_short_run_reports_every_request(monkeypatch):
+    # run_benchmark swaps in the fake LLM for the agents' module-level clients
+    monkeypatch.setattr(nats_ooda_agent, "client", nats_ooda_agent.client)
+    monkeypatch.setattr(trip_planner_agent, "client", trip_planner_agent.client)
+    args = parse_args(["--agents", "2", "--duration", "0.3", "--warmup", "0", "--concurrency", "2",
+                       "--timeout", "5", "--llm-latency", "0.005", "--llm-output-tokens", "2",
+                       "--llm-tokens-per-sec", "1000"])
+
+    results = asyncio.run(run_benchmark(args))
+
+    requests = results["requests"]
+    assert requests["sent"] > 0 and requests["ok"] == requests["sent"]
+    assert results["latency_ms"]["p50"] <= results["latency_ms"]["p99"]
+    assert sum(agent["requests"] for agent in results["agents"].values()) >= requests["ok"]
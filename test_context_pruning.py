@@ -0,0 +1,94 @@
+"""
+Tests for pruning stale tool output, and its hysteresis
+"""
+
+from context_pruning import PRUNED_MARKER, PruningPolicy, prune_tool_outputs
+from conversation import Conversation
+
+
+def words(text):
+    return len(text.split())
+
+
+def search_turn(turn, result_words=300):
+    call_id = f"call_{turn}"
+    return [
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": call_id, "type": "function",
+             "function": {"name": "search", "arguments": f"{{\"query\": \"topic {turn}\"}}"}},
+        ]},
+        {"role": "tool", "tool_call_id": call_id, "content": "word " * result_words},
+    ]
+
+
+def conversation(turns, result_words=300):
+    history = [{"role": "user", "content": "Research these topics."}]
+    for turn in range(turns):
+        history += search_turn(turn, result_words)
+    return Conversation("You are a research agent.", history, count=words)
+
+
+def policy(**overrides):
+    settings = dict(threshold_tokens=2000, target_tokens=1000, keep_turns=3, max_chars=400, head_chars=100)
+    settings.update(overrides)
+    return PruningPolicy(**settings)
+
+
+def pruned_indexes(messages):
+    return [index for index, message in enumerate(messages)
+            if PRUNED_MARKER in str(message.get("content"))]
+
+
+def test_untouched_under_threshold():
+    messages = conversation(5)
+    assert messages.tokens < 2000
+    assert prune_tool_outputs(messages, policy()) is messages
+
+
+def test_prunes_down_to_the_low_water_mark():
+    messages = conversation(8)
+    assert messages.tokens > 2000
+
+    pruned = prune_tool_outputs(messages, policy())
+
+    assert pruned.tokens <= 1000
+    assert pruned is not messages and messages.tokens > 2000
+    # Needed fewer than keep_turns kept, but never fewer than min_keep_turns
+    assert pruned[-1]["content"] == messages[-1]["content"]
+
+
+def test_keep_turns_is_enough_when_it_reaches_the_target():
+    messages = conversation(8)
+
+    pruned = prune_tool_outputs(messages, policy(target_tokens=1500))
+
+    assert pruned.tokens <= 1500
+    assert pruned_indexes(pruned) == [3, 5, 7, 9, 11]  # the last 3 turns are kept
+
+
+def test_left_alone_until_the_threshold_is_crossed_again():
+    messages = prune_tool_outputs(conversation(8), policy())
+    rewrites = []
+    for turn in range(8, 20):
+        messages.extend(search_turn(turn))
+        pruned = prune_tool_outputs(messages, policy())
+        if pruned is not messages:
+            rewrites.append(turn)
+            assert pruned.tokens < 1500
+        messages = pruned
+
+    # Every few turns of growth rather than every turn; the stubs left behind add up,
+    # so the gaps shrink until the rolling summary takes over
+    assert rewrites == [11, 15, 18]
+
+
+def test_out_of_reach_target_only_rewrites_the_turn_that_aged_out():
+    settings = policy(threshold_tokens=500, target_tokens=100, min_keep_turns=1)
+    messages = prune_tool_outputs(conversation(8), settings)
+    assert messages.tokens > 500  # the kept turn alone is over the threshold
+
+    messages.extend(search_turn(8))
+    pruned = prune_tool_outputs(messages, settings)
+
+    assert pruned_indexes(pruned) == pruned_indexes(messages) + [len(messages) - 3]
+    assert pruned.prefix_key(len(messages) - 3) == messages.prefix_key(len(messages) - 3)
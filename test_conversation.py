@@ -0,0 +1,82 @@
+"""
+Tests for the running token counts of Conversation
+"""
+
+from conversation import MESSAGE_OVERHEAD, Conversation, message_tokens
+
+
+def words(text):
+    return len(text.split())
+
+
+def measured(conversation):
+    """Token counts measured from scratch, for comparison with the running ones"""
+    return [message_tokens(message, words) for message in conversation]
+
+
+def conversation():
+    return Conversation("You are a helpful agent.", [
+        {"role": "user", "content": "What is the weather in Boston?"},
+        {"role": "assistant", "content": None, "tool_calls": [
+            {"id": "call_1", "type": "function",
+             "function": {"name": "get_current_weather", "arguments": "{\"location\": \"Boston\"}"}},
+        ]},
+        {"role": "tool", "tool_call_id": "call_1", "content": "Sunny and 20 degrees"},
+        {"role": "assistant", "content": "It is sunny in Boston."},
+    ], count=words)
+
+
+def test_counts_messages_as_they_are_added():
+    messages = conversation()
+    messages.append({"role": "user", "content": "And tomorrow?"})
+    messages += [{"role": "assistant", "content": "Rain."}]
+
+    assert messages.token_counts == measured(messages)
+    assert messages.tokens == sum(measured(messages))
+    assert messages.token_counts[-1] == MESSAGE_OVERHEAD + 1
+
+
+def test_setitem_updates_the_total():
+    messages = conversation()
+    messages[3] = {"role": "tool", "tool_call_id": "call_1", "content": "[pruned]"}
+    messages[-1] = {"role": "assistant", "content": "It is sunny in Boston, 20 degrees, light wind."}
+
+    assert messages.token_counts == measured(messages)
+    assert messages.tokens == sum(measured(messages))
+
+
+def test_slice_assignment_and_deletion_recount():
+    messages = conversation()
+    messages[1:3] = [{"role": "user", "content": "Weather?"}]
+    assert messages.tokens == sum(measured(messages))
+
+    del messages[1]
+    messages.pop()
+    assert messages.token_counts == measured(messages)
+    assert messages.tokens == sum(measured(messages))
+
+
+def test_splice_counts_the_copy_and_leaves_the_original():
+    messages = conversation()
+    before = messages.tokens
+    summary = {"role": "user", "content": "Summary: the user asked about the weather in Boston; it is sunny."}
+
+    spliced = messages.splice(1, 4, [summary])
+
+    assert len(spliced) == 3
+    assert spliced.token_counts == measured(spliced)
+    assert spliced.tokens == sum(measured(spliced))
+    assert messages.tokens == before == sum(measured(messages))
+    assert spliced.prefix_key(1) == messages.prefix_key(1)
+    assert spliced.prefix_key(2) != messages.prefix_key(2)
+
+
+def test_copy_and_control_prompt_leave_the_original():
+    messages = conversation()
+    before = messages.tokens
+
+    request = messages.with_control("Consolidate the conversation.")
+
+    assert request.tokens == before + MESSAGE_OVERHEAD + 3
+    assert messages.tokens == before
+    assert len(request) == len(messages) + 1
@@ -0,0 +1,128 @@
+"""
+Tests for the shared embedding service's batching and caching
+"""
+
+import asyncio
+import threading
+from array import array
+
+import pytest
+
+import embedding_agent
+from embedding_agent import EmbeddingAgent, EmbeddingBatcher
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+
+
+class FakeEncoder:
+    """Stands in for a model forward pass: one vector per text, recording each batch"""
+
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, texts):
+        self.release.wait()
+        self.batches.append(list(texts))
+        if "bad" in texts:
+            raise ValueError("CUDA out of memory")
+        return [array("f", [float(len(text)), 1.0]) for text in texts]
+
+
+def test_concurrent_callers_share_a_batch():
+    encode = FakeEncoder()
+    batcher = EmbeddingBatcher(encode, max_wait=0.05, name="embed-share")
+
+    async def scenario():
+        results = await asyncio.gather(batcher.embed(["a", "bb"]), batcher.embed(["ccc"]), batcher.embed(["a"]))
+        batcher.close()
+        return results
+
+    first, second, third = asyncio.run(scenario())
+
+    assert encode.batches == [["a", "bb", "ccc"]]  # "a" twice in flight is encoded once
+    assert [list(vector) for vector in first + second] == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    assert third[0] is first[0]
+
+
+def test_batches_form_while_the_previous_one_runs():
+    encode = FakeEncoder()
+    batcher = EmbeddingBatcher(encode, max_batch_size=2, max_wait=0, name="embed-backlog")
+
+    async def scenario():
+        encode.release.clear()  # the first forward pass is slow
+        first = asyncio.create_task(batcher.embed(["one"]))
+        await asyncio.sleep(0.01)
+        rest = asyncio.create_task(batcher.embed(["two", "three", "four"]))
+        await asyncio.sleep(0.01)
+        encode.release.set()
+        await asyncio.gather(first, rest)
+        again = await batcher.embed(["two", "five"])  # "two" comes from the cache
+        batcher.close()
+        return again
+
+    again = asyncio.run(scenario())
+
+    assert encode.batches == [["one"], ["two", "three"], ["four"], ["five"]]
+    assert [list(vector) for vector in again] == [[3.0, 1.0], [4.0, 1.0]]
+
+
+def test_failed_batch_fails_its_callers_only():
+    encode = FakeEncoder()
+    batcher = EmbeddingBatcher(encode, max_wait=0.05, cache_size=1, name="embed-failure")
+
+    async def scenario():
+        with pytest.raises(ValueError, match="out of memory"):
+            await batcher.embed(["bad", "good"])
+        vectors = await batcher.embed(["good", "fine"])  # the worker keeps running
+        await batcher.embed(["good"])
+        batcher.close()
+        return vectors
+
+    assert [list(vector) for vector in asyncio.run(scenario())] == [[4.0, 1.0], [4.0, 1.0]]
+    # "good" was evicted from the one-vector cache by "fine", so it was encoded again
+    assert encode.batches == [["bad", "good"], ["good", "fine"], ["good"]]
+
+
+class FakeModelAgent(EmbeddingAgent):
+    def __init__(self, encode, url):
+        super().__init__(model="fake-model", nats_config=NATSConfig(nats_url=url, embedding_agent="Embed-Service",
+                                                                    embedding_batch_window=0.05))
+        self.encode = encode
+
+    def _encode(self, texts):
+        return self.encode(texts)
+
+
+class Client(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        super().__init__(nats_config=NATSConfig(nats_url=url, embedding_agent="Embed-Service"))
+
+
+def test_requests_from_different_agents_share_a_batch(monkeypatch):
+    monkeypatch.setitem(embedding_agent._models, ("fake-model", "cpu"), object())  # nothing to load
+    encode = FakeEncoder()
+
+    async def scenario():
+        url = "inproc://embeddings"
+        service = FakeModelAgent(encode, url)
+        clients = [Client(f"Embed-Client-{index}", url) for index in range(3)]
+        for agent in [service] + clients:
+            await agent.connect_nats()
+        vectors = await asyncio.gather(*(client.embed([f"text {index}"]) for index, client in enumerate(clients)))
+        bad = await clients[0].request_from_agent("Embed-Service", '{"texts": [1, 2]}', timeout=5)
+        for agent in clients + [service]:
+            await agent.disconnect_nats()
+        return vectors, bad
+
+    vectors, bad = asyncio.run(scenario())
+
+    assert vectors == [[[6.0, 1.0]]] * 3
+    assert encode.batches == [["text 0", "text 1", "text 2"]]
+    assert "error" in bad
@@ -0,0 +1,80 @@
+"""
+Tests for the OpenAI-compatible mock LLM server, through the openai client
+"""
+
+import openai
+import pytest
+
+from mock_llm_server import MockLLMConfig, build_reply, start_mock_server
+from streaming import STREAM_OPTIONS, stream_completion
+
+
+@pytest.fixture
+def mock_llm():
+    servers = []
+
+    def start(**settings):
+        server = start_mock_server(MockLLMConfig(ttft=0, tokens_per_sec=10000, **settings))
+        servers.append(server)
+        client = openai.OpenAI(base_url=f"http://127.0.0.1:{server.server_port}/v1", api_key="mock",
+                               max_retries=0)
+        return server, client
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_plain_completion_with_think_block(mock_llm):
+    _, client = mock_llm(output_tokens=5, think_tokens=3)
+
+    completion = client.chat.completions.create(model="qwen/qwen3-32b", messages=[{"role": "user", "content": "hi"}])
+
+    content = completion.choices[0].message.content
+    assert content.startswith("<think>") and "</think>" in content
+    assert content.split("</think>\n\n")[1] == "the agent weather is sunny"
+    assert completion.choices[0].finish_reason == "stop"
+    assert completion.usage.completion_tokens == 10  # 5 words, 3 think words and the two tags
+
+
+def test_scripted_tool_call_streams_like_lm_studio(mock_llm):
+    server, client = mock_llm(script=[
+        {"tool_calls": [{"name": "get_current_weather", "arguments": {"location": "Boston"}}]},
+        {"content": "It is sunny in Boston."},
+    ])
+    calls = []
+
+    first = stream_completion(
+        client.chat.completions.create(model="qwen/qwen3-32b", messages=[], **STREAM_OPTIONS),
+        on_tool_call=calls.append,
+    )
+    second = client.chat.completions.create(model="qwen/qwen3-32b", messages=[])
+    third = client.chat.completions.create(model="qwen/qwen3-32b", messages=[])
+
+    assert [(call.function.name, call.function.arguments) for call in calls] == [
+        ("get_current_weather", '{"location": "Boston"}'),
+    ]
+    assert first.choices[0].finish_reason == "tool_calls"
+    assert first.usage is not None and first.usage.completion_tokens > 0
+    assert second.choices[0].message.content == third.choices[0].message.content == "It is sunny in Boston."
+    assert server.RequestHandlerClass.state.stats["streamed"] == 1
+
+
+def test_scripted_and_injected_errors(mock_llm):
+    _, client = mock_llm(script=[{"error": {"status": 503, "message": "model reloading"}}, {"content": "ok"}])
+    with pytest.raises(openai.APIStatusError) as scripted:
+        client.chat.completions.create(model="m", messages=[])
+    assert scripted.value.status_code == 503
+    assert client.chat.completions.create(model="m", messages=[]).choices[0].message.content == "ok"
+
+    _, flaky = mock_llm(error_rate=1.0, error_status=429)
+    with pytest.raises(openai.RateLimitError):
+        flaky.chat.completions.create(model="m", messages=[])
+
+
+def test_max_tokens_cuts_the_reply():
+    reply = build_reply({}, MockLLMConfig(output_tokens=10), max_tokens=4)
+
+    assert "".join(reply["pieces"]) == "the agent weather is"
+    assert reply["finish_reason"] == "length"
@@ -0,0 +1,81 @@
+"""
+Tests for interest-based broadcasts and heartbeat subjects
+"""
+
+import asyncio
+
+from prometheus_client import REGISTRY
+
+import nats_inprocess
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import HEADER_MESSAGE_TYPE, NATSConfig
+
+
+class ListeningAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url, **config):
+        self.name = name
+        self.broadcasts = []
+        super().__init__(nats_config=NATSConfig(nats_url=url, **config))
+
+    async def _handle_broadcast_message(self, msg):
+        self.broadcasts.append(msg.subject)
+        await super()._handle_broadcast_message(msg)
+
+
+def test_broadcasts_reach_only_interested_agents():
+    async def scenario():
+        url = "inproc://broadcasts"
+        sender = ListeningAgent("Cast-Sender", url)
+        weather = ListeningAgent("Cast-Weather", url)
+        alerts_only = ListeningAgent("Cast-Alerts", url)
+        travel = ListeningAgent("Cast-Travel", url)
+        await sender.connect_nats()
+        await weather.connect_nats(capabilities=["weather"])
+        await alerts_only.connect_nats(capabilities=["weather"], topics=["alerts"])
+        await travel.connect_nats(capabilities=["travel", "weather"])
+
+        await sender.broadcast_message("Storm warning", audience=["weather"], topic="alerts")
+        await sender.broadcast_message("Nice day", audience=["weather"])
+        await sender.broadcast_message("Flights delayed", audience=["travel", "weather"])
+        await asyncio.sleep(0.05)
+        for agent in (sender, weather, alerts_only, travel):
+            await agent.disconnect_nats()
+        return weather.broadcasts, alerts_only.broadcasts, travel.broadcasts, sender.broadcasts
+
+    weather, alerts_only, travel, sender = asyncio.run(scenario())
+
+    assert weather == ["agents.broadcast.weather.alerts", "agents.broadcast.weather.general",
+                       "agents.broadcast.weather.general"]
+    assert alerts_only == ["agents.broadcast.weather.alerts"]
+    assert sorted(travel) == ["agents.broadcast.travel.general", "agents.broadcast.weather.alerts",
+                              "agents.broadcast.weather.general", "agents.broadcast.weather.general"]
+    assert sender == []
+    # The broadcast to both of its capabilities arrived twice and was handled once
+    assert REGISTRY.get_sample_value("agent_messages_dropped_total",
+                                     {"agent": "Cast-Travel", "reason": "duplicate"}) == 1
+
+
+def test_heartbeats_stay_off_agents_all():
+    async def scenario():
+        url = "inproc://heartbeats"
+        monitor = await nats_inprocess.connect(url)
+        everyone = await monitor.subscribe("agents.all")
+        heartbeats = await monitor.subscribe("agents.heartbeat.*")
+        agent = ListeningAgent("Beat-Agent", url, heartbeat_interval=0.02)
+        await agent.connect_nats()
+        await asyncio.sleep(0.1)
+        await agent.disconnect_nats()
+        subjects = {"all": [], "heartbeat": []}
+        for name, sub in (("all", everyone), ("heartbeat", heartbeats)):
+            while sub.pending_msgs:
+                subjects[name].append((await sub.next_msg()).headers[HEADER_MESSAGE_TYPE])
+        await monitor.close()
+        return subjects
+
+    subjects = asyncio.run(scenario())
+
+    assert set(subjects["all"]) == {"announcement"}  # online, draining, offline
+    assert len(subjects["heartbeat"]) >= 3 and set(subjects["heartbeat"]) == {"heartbeat"}
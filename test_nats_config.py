@@ -0,0 +1,88 @@
+"""
+Tests for message routing headers and the envelope that reads them
+"""
+
+import asyncio
+import time
+
+from prometheus_client import REGISTRY
+
+import nats_inprocess
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import HEADER_DEADLINE, HEADER_MESSAGE_TYPE, AgentMessage, MessageEnvelope, NATSConfig
+
+
+class CountingAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        self.runs = []
+        super().__init__(nats_config=NATSConfig(nats_url=url))
+
+    def run(self, text):
+        self.runs.append(text)
+        return [{"role": "assistant", "content": "done"}]
+
+
+def request(**fields):
+    return AgentMessage(message_type="request", from_agent="Planner", to_agent="Weather-Bot",
+                        content="weather in Boston?", message_id="m1", **fields)
+
+
+def test_routing_fields_come_from_headers_without_decoding():
+    message = request(priority=1, deadline=time.time() + 60)
+
+    envelope = MessageEnvelope(message.to_bytes(), message.to_headers())
+
+    assert (envelope.message_type, envelope.from_agent, envelope.to_agent) == ("request", "Planner", "Weather-Bot")
+    assert (envelope.priority, envelope.message_id) == (1, "m1")
+    assert envelope.deadline == message.deadline
+    assert not envelope.is_expired()
+    assert not envelope.decoded
+    assert envelope.message.content == "weather in Boston?"
+
+
+def test_messages_without_headers_are_read_from_the_body():
+    message = request(deadline=1.0)
+
+    envelope = MessageEnvelope(message.to_bytes())
+
+    assert envelope.from_agent == "Planner"
+    assert envelope.decoded
+    assert envelope.is_expired()
+
+
+def test_optional_fields_are_absent_when_headers_are_present():
+    headers = AgentMessage(message_type="heartbeat", from_agent="Planner").to_headers()
+
+    envelope = MessageEnvelope(b"not json", headers)
+
+    assert HEADER_DEADLINE not in headers and headers[HEADER_MESSAGE_TYPE] == "heartbeat"
+    assert envelope.to_agent is None and envelope.message_id is None and envelope.deadline is None
+    assert not envelope.decoded
+
+
+def test_expired_requests_are_dropped_before_decoding():
+    async def scenario():
+        agent = CountingAgent("Header-Server", "inproc://headers")
+        await agent.connect_nats()
+        sender = await nats_inprocess.connect("inproc://headers")
+        expired = request(deadline=time.time() - 1)
+        subject = agent.nats_config.get_request_channel("Header-Server")
+        # A body that can't be decoded shows the drop was decided from headers alone
+        await sender.publish(subject, b"not json", headers=expired.to_headers())
+        await sender.publish(subject, request().to_bytes(), headers=request().to_headers())
+        await asyncio.sleep(0.1)
+        await sender.close()
+        await agent.disconnect_nats()
+        return agent.runs
+
+    assert asyncio.run(scenario()) == ["weather in Boston?"]
+    assert REGISTRY.get_sample_value("agent_messages_dropped_total",
+                                     {"agent": "Header-Server", "reason": "expired"}) == 1
+    assert not REGISTRY.get_sample_value("agent_errors_total", {"agent": "Header-Server", "where": "request_handler"})
+    # Its own announcements come back on agents.all and are dropped the same way
+    assert REGISTRY.get_sample_value("agent_messages_dropped_total",
+                                     {"agent": "Header-Server", "reason": "self_originated"}) >= 1
@@ -0,0 +1,106 @@
+"""
+Tests for the in-process NATS transport
+"""
+
+import asyncio
+
+import pytest
+from nats.errors import NoRespondersError, TimeoutError as NATSTimeoutError
+
+import nats_inprocess
+from nats_inprocess import subject_matches
+
+
+@pytest.mark.parametrize("pattern, subject, expected", [
+    ("agents.request.weather", "agents.request.weather", True),
+    ("agents.request.weather", "agents.request.trip", False),
+    ("agents.heartbeat.*", "agents.heartbeat.weather", True),
+    ("agents.heartbeat.*", "agents.heartbeat", False),
+    ("agents.heartbeat.*", "agents.heartbeat.weather.extra", False),
+    ("agents.*.weather", "agents.direct.weather", True),
+    ("agents.>", "agents.jobs.weather.submit", True),
+    ("agents.>", "agents", False),
+    ("agents.request", "agents.request.weather", False),
+])
+def test_subject_matches(pattern, subject, expected):
+    assert subject_matches(pattern, subject) is expected
+
+
+def test_queue_group_gets_one_copy_and_plain_subscribers_all():
+    async def scenario():
+        client = await nats_inprocess.connect("inproc://queue-groups")
+        received = {"replica_a": [], "replica_b": [], "monitor": []}
+
+        def collect(name):
+            async def handler(msg):
+                received[name].append(msg.data)
+            return handler
+
+        await client.subscribe("agents.request.*", queue="weather", cb=collect("replica_a"))
+        await client.subscribe("agents.request.*", queue="weather", cb=collect("replica_b"))
+        await client.subscribe("agents.>", cb=collect("monitor"))
+        for index in range(10):
+            await client.publish("agents.request.weather", str(index).encode())
+        await client.drain()
+        return received
+
+    received = asyncio.run(scenario())
+
+    assert len(received["monitor"]) == 10
+    assert sorted(received["replica_a"] + received["replica_b"]) == sorted(received["monitor"])
+
+
+def test_request_reply_no_responders_and_timeout():
+    async def scenario():
+        client = await nats_inprocess.connect("inproc://request-reply")
+
+        async def echo(msg):
+            await msg.respond(msg.data.upper())
+
+        async def silent(msg):
+            pass
+
+        await client.subscribe("echo", cb=echo)
+        await client.subscribe("silent", cb=silent)
+
+        reply = await client.request("echo", b"ping", timeout=1)
+        with pytest.raises(NoRespondersError):
+            await client.request("nobody", b"ping", timeout=1)
+        with pytest.raises(NATSTimeoutError):
+            await client.request("silent", b"ping", timeout=0.05)
+        await client.close()
+        return reply.data
+
+    assert asyncio.run(scenario()) == b"PING"
+
+
+def test_drain_delivers_pending_but_unsubscribe_drops_them():
+    async def scenario():
+        client = await nats_inprocess.connect("inproc://drain")
+        handled = {"drained": [], "dropped": []}
+
+        def slow(name):
+            async def handler(msg):
+                await asyncio.sleep(0.01)
+                handled[name].append(msg.data)
+            return handler
+
+        drained = await client.subscribe("work.drained", cb=slow("drained"))
+        dropped = await client.subscribe("work.dropped", cb=slow("dropped"))
+        for index in range(3):
+            await client.publish("work.drained", str(index).encode())
+            await client.publish("work.dropped", str(index).encode())
+        await asyncio.sleep(0)  # both callbacks are now busy with their first message
+
+        await dropped.unsubscribe()
+        await drained.drain()
+        # Drained subscriptions no longer receive anything
+        with pytest.raises(NoRespondersError):
+            await client.request("work.drained", b"late", timeout=0.05)
+        await client.close()
+        return handled
+
+    handled = asyncio.run(scenario())
+
+    assert handled["drained"] == [b"0", b"1", b"2"]
+    assert handled["dropped"] == []
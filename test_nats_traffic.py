@@ -0,0 +1,148 @@
+"""
+Tests for capturing, summarizing and replaying mesh traffic
+"""
+
+import asyncio
+import json
+import time
+
+import nats_traffic
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import (
+    HEADER_DEADLINE, HEADER_FROM_AGENT, HEADER_MESSAGE_TYPE, HEADER_TO_AGENT, AgentMessage, NATSConfig,
+)
+from nats_traffic import compare, encode_record, percentile, read_capture, select_records, summarize_capture
+
+
+class EchoAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        self.runs = []
+        super().__init__(nats_config=NATSConfig(nats_url=url))
+
+    def run(self, text):
+        self.runs.append(text)
+        return [{"role": "assistant", "content": text.upper()}]
+
+
+def line(timestamp, subject, reply="", message_type=None, from_agent=None, to_agent=None):
+    headers = {key: value for key, value in ((HEADER_MESSAGE_TYPE, message_type), (HEADER_FROM_AGENT, from_agent),
+                                             (HEADER_TO_AGENT, to_agent)) if value}
+    return encode_record(timestamp, subject, reply, headers, b"{}")
+
+
+def test_percentile_is_nearest_rank():
+    values = [float(value) for value in range(1, 21)]
+
+    assert percentile(values, 50) == 10.0
+    assert percentile(values, 95) == 19.0
+    assert percentile(values, 99) == 20.0
+    assert percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50) == 3.0  # the rank rounds up, never to even
+    assert percentile([3.0], 50) == 3.0
+    assert percentile([], 50) is None
+
+
+def test_capture_files_skip_a_torn_last_line(tmp_path):
+    path = str(tmp_path / "traffic.jsonl.gz")
+    with nats_traffic._open(path, "w") as f:
+        f.write(line(1.0, "agents.request.weather_bot", reply="_INBOX.1") + "\n\n")
+        f.write('{"t": 2.0, "s": "agents.dir')
+
+    assert [(rec["t"], rec["s"], rec["r"]) for rec in read_capture(path)] == [
+        (1.0, "agents.request.weather_bot", "_INBOX.1")]
+
+
+def test_select_records_filters_and_samples():
+    records = [json.loads(text) for text in (
+        line(1.0, "agents.request.weather_bot", "_INBOX.1", "request", "Planner", "Weather-Bot"),
+        line(1.5, "_INBOX.1", message_type="response", from_agent="Weather-Bot"),
+        line(2.0, "agents.heartbeat.weather_bot", message_type="heartbeat", from_agent="Weather-Bot"),
+        line(3.0, "agents.direct.trip_planner", message_type="direct", from_agent="User", to_agent="Trip-Planner"),
+    )]
+
+    assert [rec["t"] for rec in select_records(records)] == [1.0, 3.0]
+    assert [rec["t"] for rec in select_records(records, include_presence=True)] == [1.0, 2.0, 3.0]
+    assert [rec["t"] for rec in select_records(records, agents=["weather-bot"])] == [1.0]
+    assert [rec["t"] for rec in select_records(records, subject="agents.direct.*")] == [3.0]
+    sampled = [select_records(records * 50, sample=0.5, seed=seed) for seed in (1, 1, 2)]
+    assert sampled[0] == sampled[1] != sampled[2]
+    assert 30 < len(sampled[0]) < 70
+
+
+def test_summary_pairs_requests_with_their_replies():
+    records = [json.loads(text) for text in (
+        line(10.0, "agents.request.weather_bot", "_INBOX.1", to_agent="Weather-Bot"),
+        line(10.2, "_INBOX.1"),
+        line(11.0, "agents.request.weather_bot", "_INBOX.2", to_agent="Weather-Bot"),
+        line(12.0, "agents.request.trip_planner", "_INBOX.3", to_agent="Trip-Planner"),  # unanswered
+        line(12.0, "_INBOX.2"),
+    )]
+
+    summary = summarize_capture(records)
+
+    assert (summary["messages"], summary["requests"], summary["ok"]) == (3, 3, 2)
+    assert summary["elapsed_s"] == 2.0 and summary["throughput_rps"] == 1.0
+    assert summary["targets"]["Weather-Bot"]["p50"] == 200.0
+    assert summary["latency_ms"]["p99"] == 1000.0
+    assert "Trip-Planner" not in summary["targets"]
+
+
+def test_recorded_traffic_replays_against_another_mesh(tmp_path):
+    path = str(tmp_path / "traffic.jsonl")
+
+    async def capture():
+        url = "inproc://traffic-production"
+        caller, weather = EchoAgent("Traffic-Caller", url), EchoAgent("Traffic-Weather", url)
+        await caller.connect_nats()
+        await weather.connect_nats()
+        nc, stop = await nats_traffic.connect(url), asyncio.Event()
+        recording = asyncio.create_task(nats_traffic.record(nc, path, ["agents.>", "_INBOX.>"], stop=stop))
+        await asyncio.sleep(0)
+        for city in ("boston", "salem"):
+            await caller.request_from_agent("Traffic-Weather", city, timeout=5)
+        await asyncio.sleep(0.05)
+        stop.set()
+        count = await recording
+        for client in (caller, weather):
+            await client.disconnect_nats()
+        await nc.close()
+        return count
+
+    async def run_replay(records):
+        url = "inproc://traffic-test"
+        weather = EchoAgent("Traffic-Weather", url)
+        await weather.connect_nats()
+        nc = await nats_traffic.connect(url)
+        results = await nats_traffic.replay(nc, records, speed=0)
+        await weather.disconnect_nats()
+        await nc.close()
+        return results, weather.runs
+
+    assert asyncio.run(capture()) == 4  # two requests and their replies
+    records = select_records(list(read_capture(path)))
+    results, runs = asyncio.run(run_replay(records))
+
+    assert sorted(runs) == ["boston", "salem"]
+    assert (results["requests"], results["ok"], results["timeout"]) == (2, 2, 0)
+    assert results["latency_ms"]["count"] == 2
+    assert "throughput (req/s)" in compare(summarize_capture(list(read_capture(path))), results)
+
+
+def test_replayed_deadlines_keep_their_budget():
+    message = AgentMessage(message_type="direct", from_agent="Planner", to_agent="Weather-Bot",
+                           deadline=time.time() - 50)  # captured a minute ago with a 10s budget
+    records = [{"t": time.time() - 60, "s": "agents.direct.weather_bot", "d": "e30=",
+                "h": message.to_headers()}]
+
+    async def scenario():
+        nc = await nats_traffic.connect("inproc://traffic-deadline")
+        sub = await nc.subscribe("agents.direct.weather_bot")
+        await nats_traffic.replay(nc, records, speed=0)
+        msg = await sub.next_msg(timeout=1)
+        await nc.close()
+        return float(msg.headers[HEADER_DEADLINE]) - time.time()
+
+    assert 9 < asyncio.run(scenario()) <= 10
@@ -0,0 +1,78 @@
+"""
+Tests for the rolling summarizer's choice of windows
+"""
+
+import pytest
+
+from conversation import Conversation
+from rolling_summary import SUMMARY_PREFIX, RollingSummarizer, is_summary
+
+
+def words(text):
+    return len(text.split())
+
+
+def tool_turn(call_id, results):
+    """An assistant turn calling a tool `results` times, followed by the results"""
+    calls = [
+        {"id": f"{call_id}_{i}", "type": "function", "function": {"name": "search", "arguments": "{}"}}
+        for i in range(results)
+    ]
+    return [{"role": "assistant", "content": None, "tool_calls": calls}] + [
+        {"role": "tool", "tool_call_id": call["id"], "content": "result " * 20} for call in calls
+    ]
+
+
+def conversation():
+    history = [{"role": "user", "content": "Research agents " * 10}]
+    for turn in range(6):
+        history += tool_turn(f"call{turn}", results=3)
+    history.append({"role": "assistant", "content": "Done " * 10})
+    return Conversation("You are a research agent.", history, count=words)
+
+
+def orphaned_results(messages):
+    """Tool results whose tool call isn't in the assistant turn before them"""
+    orphans, calls = [], set()
+    for message in messages:
+        if message.get("role") == "assistant":
+            calls = {call["id"] for call in message.get("tool_calls") or []}
+        elif message.get("role") == "tool" and message["tool_call_id"] not in calls:
+            orphans.append(message["tool_call_id"])
+    return orphans
+
+
+@pytest.mark.parametrize("window_tokens", range(5, 200, 7))
+def test_window_never_splits_a_tool_call_from_its_results(window_tokens):
+    messages = conversation()
+    summarizer = RollingSummarizer(lambda window: "summary", threshold_tokens=50,
+                                   keep_recent_tokens=40, window_tokens=window_tokens)
+
+    start, end = summarizer._next_window(messages)
+
+    assert start == 1
+    assert messages[end]["role"] != "tool"
+    assert orphaned_results(messages[end:]) == []
+
+
+def test_compacted_conversation_keeps_tool_results_with_their_calls():
+    messages = conversation()
+    summarizer = RollingSummarizer(lambda window: "what happened", threshold_tokens=50,
+                                   keep_recent_tokens=40, window_tokens=60)
+
+    assert summarizer.compact(messages) is messages  # summarizing in the background
+    summarizer._job[3].result(timeout=5)
+    compacted = summarizer.compact(messages)
+
+    assert is_summary(compacted[1])
+    assert compacted[1]["content"] == f"{SUMMARY_PREFIX}\nwhat happened"
+    assert compacted.tokens < messages.tokens
+    assert orphaned_results(compacted) == []
+
+
+def test_nothing_to_do_under_threshold():
+    messages = conversation()
+    summarizer = RollingSummarizer(lambda window: "summary", threshold_tokens=messages.tokens)
+
+    assert summarizer.compact(messages) is messages
+    assert not summarizer.pending
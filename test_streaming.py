@@ -0,0 +1,98 @@
+"""
+Tests for streamed completions: think-block filtering and early tool dispatch
+"""
+
+from streaming import ThinkFilter, stream_completion
+
+
+def text_chunk(text):
+    return {"choices": [{"delta": {"content": text}, "finish_reason": None}]}
+
+
+def tool_chunk(index, arguments, call_id=None, name=None):
+    function = {"arguments": arguments}
+    if name:
+        function["name"] = name
+    return {"choices": [{"delta": {"tool_calls": [{"index": index, "id": call_id, "function": function}]},
+                         "finish_reason": None}]}
+
+
+def end_chunk(finish_reason):
+    return {"choices": [{"delta": {}, "finish_reason": finish_reason}]}
+
+
+def filtered(pieces):
+    think = ThinkFilter()
+    return "".join(think.feed(piece) for piece in pieces) + think.flush()
+
+
+def test_think_block_is_removed():
+    assert filtered(["<think>plan the trip</think>Boston is lovely."]) == "Boston is lovely."
+
+
+def test_tags_split_across_chunks():
+    assert filtered(["Hi <th", "ink>hidden</thi", "nk> there", "<", "think>more</think>!"]) == "Hi  there!"
+
+
+def test_split_tag_is_held_back_until_it_is_known():
+    think = ThinkFilter()
+
+    assert think.feed("Answer <thi") == "Answer "
+    assert think.feed("s is not a tag") == "<this is not a tag"
+    assert think.feed(" a < b") == " a < b"
+
+
+def test_unclosed_think_block_stays_hidden():
+    assert filtered(["Visible<think>never closed"]) == "Visible"
+
+
+def test_text_streams_without_the_think_block():
+    shown = []
+    completion = stream_completion(
+        [text_chunk("<think>hmm"), text_chunk("</think>Sun"), text_chunk("ny."), end_chunk("stop")],
+        on_text=shown.append,
+    )
+
+    assert "".join(shown) == "Sunny."
+    assert completion.choices[0].message.content == "<think>hmm</think>Sunny."
+    assert completion.choices[0].finish_reason == "stop"
+    assert completion.choices[0].message.tool_calls is None
+
+
+def test_tool_calls_dispatched_as_soon_as_complete():
+    events = []
+
+    def chunks():
+        for chunk in [
+            tool_chunk(0, "", call_id="call_a", name="get_weather"),
+            tool_chunk(0, '{"location": '),
+            tool_chunk(0, '"Boston"}'),
+            tool_chunk(1, '{"location": "Salem"', call_id="call_b", name="get_weather"),
+            tool_chunk(1, "}"),
+            tool_chunk(2, "", call_id="call_c", name="get_time"),
+            end_chunk("tool_calls"),
+        ]:
+            events.append("chunk")
+            yield chunk
+
+    def on_tool_call(call):
+        events.append(call.id)
+
+    completion = stream_completion(chunks(), on_tool_call=on_tool_call)
+
+    # Each call goes out once its arguments are a complete JSON object, before the rest of the stream
+    assert events == ["chunk", "chunk", "chunk", "call_a", "chunk", "chunk", "call_b", "chunk", "chunk", "call_c"]
+    calls = completion.choices[0].message.tool_calls
+    assert [(call.id, call.function.name, call.function.arguments) for call in calls] == [
+        ("call_a", "get_weather", '{"location": "Boston"}'),
+        ("call_b", "get_weather", '{"location": "Salem"}'),
+        ("call_c", "get_time", ""),
+    ]
+    assert completion.choices[0].finish_reason == "tool_calls"
+
+
+def test_calls_without_ids_get_one():
+    calls = []
+    stream_completion([tool_chunk(0, "{}", name="ping")], on_tool_call=calls.append)
+
+    assert [call.id for call in calls] == ["call_0"]
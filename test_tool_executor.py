@@ -0,0 +1,121 @@
+"""
+Tests for the concurrent tool executor
+"""
+
+import json
+import time
+
+from tool_executor import ToolExecutor, ToolLimits, memo_key
+from tool_registry import ToolRegistry, tool
+
+
+def tool_call(call_id, name, arguments="{}"):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+
+
+def sleeper(tool_call, messages):
+    """A handle_tool_call that sleeps for the call's "seconds" argument"""
+    seconds = json.loads(tool_call["function"]["arguments"]).get("seconds", 0)
+    time.sleep(seconds)
+    messages.append({"role": "tool", "tool_call_id": tool_call["id"], "content": f"slept {seconds}"})
+    return messages
+
+
+def test_results_keep_call_order():
+    executor = ToolExecutor("test")
+    calls = [tool_call(f"call_{i}", "sleep", f'{{"seconds": {0.2 - i * 0.05}}}') for i in range(4)]
+
+    started = time.monotonic()
+    messages = executor.execute(calls, sleeper, [{"role": "user", "content": "go"}])
+
+    assert time.monotonic() - started < 0.4  # concurrent, not 0.5s one after another
+    assert [message.get("tool_call_id") for message in messages] == [None, "call_0", "call_1", "call_2", "call_3"]
+
+
+def test_timed_out_call_gets_an_error_in_its_place():
+    executor = ToolExecutor("test", {"sleep": ToolLimits(timeout=0.1)})
+    calls = [tool_call("slow", "sleep", '{"seconds": 1}'), tool_call("fast", "sleep", '{"seconds": 0}')]
+
+    started = time.monotonic()
+    messages = executor.execute(calls, sleeper, [])
+
+    assert time.monotonic() - started < 0.5
+    assert messages == [
+        {"role": "tool", "tool_call_id": "slow", "content": "Tool 'sleep' timed out"},
+        {"role": "tool", "tool_call_id": "fast", "content": "slept 0"},
+    ]
+
+
+def test_memo_key_ignores_argument_order_and_whitespace():
+    assert memo_key("f", '{"a": 1, "b": 2}') == memo_key("f", '{"b":2,"a":1}')
+    assert memo_key("f", '{"a": 1}') != memo_key("g", '{"a": 1}')
+
+
+def test_memoized_until_ttl_expires():
+    runs = []
+
+    def counting(tool_call, messages):
+        runs.append(tool_call["id"])
+        return sleeper(tool_call, messages)
+
+    executor = ToolExecutor("test", {"sleep": ToolLimits(cache_ttl=0.2)})
+    first = executor.execute([tool_call("a", "sleep"), tool_call("b", "sleep")], counting, [])
+    again = executor.execute([tool_call("c", "sleep", '{ }')], counting, [])
+    time.sleep(0.3)
+    expired = executor.execute([tool_call("d", "sleep")], counting, [])
+
+    assert runs == ["a", "d"]
+    assert first[1] == {"role": "tool", "tool_call_id": "b", "content": "Same call as a; see its result."}
+    assert again == [{"role": "tool", "tool_call_id": "c", "content": "slept 0"}]
+    assert expired[0]["tool_call_id"] == "d"
+
+
+def test_uncached_tools_always_run():
+    runs = []
+
+    def counting(tool_call, messages):
+        runs.append(tool_call["id"])
+        return sleeper(tool_call, messages)
+
+    executor = ToolExecutor("test")
+    executor.execute([tool_call("a", "sleep"), tool_call("b", "sleep")], counting, [])
+
+    assert sorted(runs) == ["a", "b"]
+
+
+def test_failed_calls_are_not_memoized():
+    attempts = []
+
+    @tool
+    def flaky(city: str) -> str:
+        """Fails on the first call"""
+        attempts.append(city)
+        if len(attempts) == 1:
+            raise RuntimeError("backend unavailable")
+        return f"sunny in {city}"
+
+    registry = ToolRegistry(flaky)
+    executor = ToolExecutor("test", {"flaky": ToolLimits(cache_ttl=60)})
+
+    first = executor.execute([tool_call("a", "flaky", '{"city": "Boston"}')], registry.handle_tool_call, [])
+    second = executor.execute([tool_call("b", "flaky", '{"city": "Boston"}')], registry.handle_tool_call, [])
+    third = executor.execute([tool_call("c", "flaky", '{"city": "Boston"}')], registry.handle_tool_call, [])
+
+    assert first[0]["content"] == "Tool 'flaky' failed: backend unavailable"
+    assert second[0]["content"] == third[0]["content"] == "sunny in Boston"
+    assert third[0]["tool_call_id"] == "c"
+    assert len(attempts) == 2  # the success was memoized, the failure wasn't
+
+
+def test_invalid_arguments_are_not_memoized():
+    @tool
+    def lookup(city: str) -> str:
+        """Looks a city up"""
+        return city
+
+    registry = ToolRegistry(lookup)
+    executor = ToolExecutor("test", {"lookup": ToolLimits(cache_ttl=60)})
+
+    executor.execute([tool_call("a", "lookup", '{"town": "Boston"}')], registry.handle_tool_call, [])
+
+    assert executor._memo == {}
@@ -0,0 +1,104 @@
+"""
+Tests for the decorator-based tool registry
+"""
+
+import asyncio
+from typing import List, Literal, Optional
+
+from tool_registry import ToolFailure, ToolRegistry, tool
+
+
+@tool
+def get_current_weather(location: str, unit: Literal["celsius", "fahrenheit"] = "celsius",
+                        days: Optional[int] = None, tags: List[str] = ()) -> str:
+    """
+    Get the current weather in a given location
+
+    Args:
+        location: The city and state, e.g. San Francisco, CA
+        unit: Temperature unit
+    """
+    return f"{location}: 20 {unit}"
+
+
+def call(arguments, call_id="call_1", name="get_current_weather"):
+    return {"id": call_id, "type": "function", "function": {"name": name, "arguments": arguments}}
+
+
+def test_schema_from_signature_and_docstring():
+    function = get_current_weather.__tool__.schema["function"]
+    parameters = function["parameters"]
+
+    assert function["name"] == "get_current_weather"
+    assert function["description"] == "Get the current weather in a given location"
+    assert parameters["required"] == ["location"]
+    assert parameters["properties"]["location"] == {
+        "type": "string",
+        "description": "The city and state, e.g. San Francisco, CA",
+    }
+    assert parameters["properties"]["unit"] == {
+        "type": "string",
+        "enum": ["celsius", "fahrenheit"],
+        "description": "Temperature unit",
+    }
+    assert parameters["properties"]["days"] == {"type": "integer"}
+    assert parameters["properties"]["tags"] == {"type": "array", "items": {"type": "string"}}
+
+
+def test_valid_call_runs_the_tool():
+    registry = ToolRegistry(get_current_weather)
+    messages = registry.handle_tool_call(call('{"location": "Boston", "unit": "fahrenheit", "days": null}'), [])
+
+    assert messages == [{"role": "tool", "tool_call_id": "call_1", "content": "Boston: 20 fahrenheit"}]
+    assert not isinstance(messages[0], ToolFailure)
+
+
+def test_invalid_arguments_are_explained_without_running():
+    registry = ToolRegistry(get_current_weather)
+
+    _, problem = registry.check("get_current_weather", {"unit": "kelvin", "days": "3", "city": "Boston"})
+
+    assert problem.startswith("Invalid arguments for get_current_weather: ")
+    assert "missing required argument 'location'" in problem
+    assert "unknown argument 'city'" in problem
+    assert "'unit' must be one of ['celsius', 'fahrenheit'], got 'kelvin'" in problem
+    assert "'days' must be integer, got str" in problem
+    assert "Expected parameters: " in problem
+
+
+def test_bad_calls_become_failure_messages():
+    registry = ToolRegistry(get_current_weather)
+
+    not_json = registry.handle_tool_call(call("{location"), [])[0]
+    unknown = registry.handle_tool_call(call("{}", name="get_forecast"), [])[0]
+    wrong_type = registry.handle_tool_call(call('{"location": "Boston", "tags": [1]}'), [])[0]
+
+    assert isinstance(not_json, ToolFailure) and "not valid JSON" in not_json["content"]
+    assert unknown["content"] == "Unknown tool 'get_forecast'. Available tools: get_current_weather"
+    assert "'tags' must be an array of string" in wrong_type["content"]
+
+
+def test_tool_exception_becomes_failure_message():
+    @tool
+    def broken() -> str:
+        """Always fails"""
+        raise ValueError("no data")
+
+    messages = ToolRegistry(broken).handle_tool_call(call("{}", name="broken"), [])
+
+    assert isinstance(messages[0], ToolFailure)
+    assert messages[0]["content"] == "Tool 'broken' failed: no data"
+
+
+def test_async_tools_are_awaited():
+    @tool
+    async def get_forecast(location: str) -> str:
+        """Forecast for a location"""
+        await asyncio.sleep(0)
+        return f"{location}: rain"
+
+    registry = ToolRegistry(get_forecast)
+    messages = registry.handle_tool_call(call('{"location": "Boston"}', name="get_forecast"), [], agent="test")
+
+    assert registry.execute("get_forecast", {"location": "Salem"}) == "Salem: rain"
+    assert messages == [{"role": "tool", "tool_call_id": "call_1", "content": "Boston: rain"}]
@@ -0,0 +1,134 @@
+"""
+Tests for the workflow orchestrator: validation, fan-out, concurrency and resuming runs
+"""
+
+import asyncio
+
+import pytest
+
+from nats_agent_mixin import NATSAgentMixin
+from nats_config import NATSConfig
+from workflow import CheckpointStore, Step, Workflow, WorkflowError, WorkflowRunner
+
+
+class WeatherAgent(NATSAgentMixin):
+    tools = []
+    model = "test-model"
+
+    def __init__(self, name, url):
+        self.name = name
+        super().__init__(nats_config=NATSConfig(nats_url=url))
+
+    def run(self, text):
+        return [{"role": "assistant", "content": f"Sunny ({text})"}]
+
+
+class Flaky:
+    """A tool that fails for the given items until healed, counting its calls"""
+
+    def __init__(self, failing=(), result=None):
+        self.failing = set(failing)
+        self.result = result
+        self.calls = []
+
+    def __call__(self, results):
+        item = results.get("item")
+        self.calls.append(item)
+        if item in self.failing:
+            raise ValueError(f"no data for {item}")
+        return self.result or f"done {item}"
+
+
+def test_invalid_workflows_are_rejected():
+    with pytest.raises(WorkflowError, match="cycle"):
+        Workflow("loop", [Step("a", tool=str, depends_on=["c"]), Step("b", tool=str, depends_on=["a"]),
+                          Step("c", tool=str, depends_on=["b"]), Step("d", tool=str)])
+    with pytest.raises(WorkflowError, match="unknown step 'x'"):
+        Workflow("dangling", [Step("a", tool=str, depends_on=["x"])])
+    with pytest.raises(WorkflowError, match="Duplicate"):
+        Workflow("twice", [Step("a", tool=str), Step("a", tool=str)])
+    with pytest.raises(WorkflowError, match="exactly one"):
+        Workflow("both", [Step("a", tool=str, agent="Weather-Bot")])
+
+
+def test_steps_run_in_dependency_order():
+    workflow = Workflow("diamond", [
+        Step("report", tool=lambda r: f"{r['north']} + {r['south']}", depends_on=["north", "south"]),
+        Step("north", tool=lambda r: f"north of {r['start']}", depends_on=["start"]),
+        Step("south", tool=lambda r: f"south of {r['start']}", depends_on=["start"]),
+        Step("start", tool=lambda r: r["city"]),
+    ])
+
+    results = asyncio.run(WorkflowRunner(agent=None).run(workflow, {"city": "Boston"}))
+
+    assert workflow.order == ["start", "north", "south", "report"]
+    assert results["report"] == "north of Boston + south of Boston"
+
+
+def test_fan_out_items_run_concurrently_up_to_the_limit():
+    running, peak = [0], [0]
+
+    async def slow(results):
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+        await asyncio.sleep(0.05)
+        running[0] -= 1
+        return results["item"]
+
+    workflow = Workflow("wide", [Step("cities", tool=lambda r: ["Boston", "Salem", "Lowell", "Quincy"]),
+                                 Step("each", tool=slow, depends_on=["cities"], foreach=lambda r: r["cities"])])
+
+    results = asyncio.run(WorkflowRunner(agent=None, max_concurrency=2).run(workflow))
+
+    assert results["each"] == ["Boston", "Salem", "Lowell", "Quincy"]  # in item order
+    assert peak[0] == 2
+
+
+def test_fan_out_to_an_agent():
+    async def scenario():
+        url = "inproc://workflow"
+        planner = WeatherAgent("Flow-Planner", url)
+        weather = WeatherAgent("Flow-Weather", url)
+        await planner.connect_nats()
+        await weather.connect_nats()
+        workflow = Workflow("day-trip", [
+            Step("nearby", tool=lambda r: ["Salem", "Lowell"]),
+            Step("weather", agent="Flow-Weather", depends_on=["nearby"], foreach=lambda r: r["nearby"],
+                 prompt="Weather in {item} for {traveller}?"),
+        ])
+        results = await WorkflowRunner(planner).run(workflow, {"traveller": "Ann"})
+        await planner.disconnect_nats()
+        await weather.disconnect_nats()
+        return results
+
+    assert asyncio.run(scenario())["weather"] == ["Sunny (Weather in Salem for Ann?)",
+                                                  "Sunny (Weather in Lowell for Ann?)"]
+
+
+def test_failed_run_resumes_where_it_stopped(tmp_path):
+    cities = Flaky(result=["Salem", "Lowell", "Quincy"])
+    each, summary, other = Flaky(failing={"Lowell"}), Flaky(), Flaky()
+
+    def workflow():
+        return Workflow("resumable", [
+            Step("cities", tool=cities),
+            Step("each", tool=each, depends_on=["cities"], foreach=lambda r: r["cities"], retries=1),
+            Step("summary", tool=summary, depends_on=["each"]),
+            Step("other", tool=other),
+        ])
+
+    with pytest.raises(WorkflowError) as failure:
+        asyncio.run(WorkflowRunner(None, CheckpointStore(str(tmp_path))).run(workflow(), run_id="run-1"))
+
+    assert failure.value.failed == {"each": "1 of 3 item(s) failed: no data for Lowell",
+                                    "summary": "skipped: a dependency failed"}
+    assert sorted(each.calls) == ["Lowell", "Lowell", "Quincy", "Salem"]  # Lowell was retried once
+
+    # A new runner, reading the checkpoint from disk, only re-runs what didn't finish
+    each.failing.clear()
+    each.calls.clear()
+    results = asyncio.run(WorkflowRunner(None, CheckpointStore(str(tmp_path))).run(workflow(), run_id="run-1"))
+
+    assert each.calls == ["Lowell"]
+    assert len(cities.calls) == 1 and len(other.calls) == 1 and len(summary.calls) == 1
+    assert results["each"] == ["done Salem", "done Lowell", "done Quincy"]
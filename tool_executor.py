@@ -0,0 +1,229 @@
+"""
+Tool Executor
+
+Runs the tool calls of one completion concurrently instead of one after the
+other. A kickoff asking for the weather in 30 cities comes back as 30 tool
+calls; they now take about as long as the slowest one.
+
+- Handlers run in a shared thread pool; a handler returning a coroutine (an
+  async tool) is run to completion on an event loop in its worker thread
+- Each tool can have its own concurrency cap and timeout (ToolLimits)
+- Tools that opt in (ToolLimits.cache_ttl) are memoized on (name, canonical
+  arguments): identical calls in one completion run once, and later identical
+  calls within the TTL are answered from the memo without executing; failed
+  calls (a ToolFailure from the ToolRegistry, a timeout or an error) are not kept
+- Results are appended in the original tool_call order, so the conversation
+  stays valid whatever order the calls finish in
+
+Agents keep their existing `handle_tool_call(tool_call, messages)`: each call is
+handled against its own empty message list and the lists are joined in order.
+A streaming agent submits each call to a ToolBatch as soon as it is complete,
+before the model has finished the rest of the completion.
+"""
+
+import json
+import time
+import asyncio
+import inspect
+import logging
+import threading
+import contextvars
+import concurrent.futures
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from agent_metrics import TOOL_CALLS
+from tool_registry import ToolFailure
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_TOOL_TIMEOUT = 60.0
+MEMO_PRUNE_SIZE = 1024  # drop expired memo entries once this many are held
+
+
+@dataclass
+class ToolLimits:
+    """Per-tool execution settings; None means no limit"""
+
+    max_concurrency: Optional[int] = None
+    # Seconds, including time spent waiting for a slot. A handler can't be interrupted, so
+    # a timed-out call keeps its worker in the shared pool (max_workers threads) until it
+    # returns; tools that can hang should enforce their own timeout too
+    timeout: Optional[float] = DEFAULT_TOOL_TIMEOUT
+    cache_ttl: Optional[float] = None  # seconds to reuse results of identical calls; None = never (non-deterministic tools)
+
+
+def memo_key(name: str, arguments: Any) -> str:
+    """(tool name, arguments) with argument order and whitespace normalized"""
+    try:
+        parsed = json.loads(arguments) if isinstance(arguments, str) else arguments
+        canonical = json.dumps(parsed, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        canonical = str(arguments)
+    return f"{name}:{canonical}"
+
+
+_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _shared_pool(max_workers: int) -> concurrent.futures.ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool")
+        return _pool
+
+
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+class ToolExecutor:
+    """Executes a completion's tool calls concurrently through an agent's handle_tool_call"""
+
+    def __init__(self, agent_name: str, limits: Optional[Dict[str, ToolLimits]] = None,
+                 default_timeout: Optional[float] = DEFAULT_TOOL_TIMEOUT, max_workers: int = 32):
+        self.agent_name = agent_name
+        self.limits = limits or {}
+        self.default_timeout = default_timeout
+        self.max_workers = max_workers  # size of the pool shared by every executor in the process
+        self._slots: Dict[str, threading.BoundedSemaphore] = {}
+        self._slots_lock = threading.Lock()
+        self._memo: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}  # key -> (expires at, tool messages)
+        self._memo_lock = threading.Lock()
+
+    def _limits(self, tool_name: str) -> ToolLimits:
+        return self.limits.get(tool_name) or ToolLimits(timeout=self.default_timeout)
+
+    def _slot(self, tool_name: str) -> Optional[threading.BoundedSemaphore]:
+        cap = self._limits(tool_name).max_concurrency
+        if cap is None:
+            return None
+        with self._slots_lock:
+            return self._slots.setdefault(tool_name, threading.BoundedSemaphore(cap))
+
+    def _call(self, handler: Callable, tool_call: Any, deadline: Optional[float]) -> List[Dict[str, Any]]:
+        slot = self._slot(_field(_field(tool_call, "function"), "name", ""))
+        if slot is not None:
+            wait = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not slot.acquire(timeout=wait):
+                return []  # timed out waiting for a slot; the caller already gave up on it
+        try:
+            result = handler(tool_call, [])
+            if inspect.iscoroutine(result):
+                result = asyncio.run(result)
+            return result or []
+        finally:
+            if slot is not None:
+                slot.release()
+
+    @staticmethod
+    def _error(tool_call: Any, message: str) -> Dict[str, Any]:
+        return ToolFailure(role="tool", tool_call_id=_field(tool_call, "id"), content=message)
+
+    def _recall(self, key: str, tool_call: Any) -> Optional[List[Dict[str, Any]]]:
+        with self._memo_lock:
+            entry = self._memo.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._memo[key]
+                return None
+            results = entry[1]
+        return [{**message, "tool_call_id": _field(tool_call, "id")} for message in results]
+
+    def _remember(self, key: str, ttl: float, results: List[Dict[str, Any]]):
+        stored = [{k: v for k, v in message.items() if k != "tool_call_id"} for message in results]
+        with self._memo_lock:
+            now = time.monotonic()
+            if len(self._memo) >= MEMO_PRUNE_SIZE:
+                for stale in [k for k, (expires, _) in self._memo.items() if expires < now]:
+                    del self._memo[stale]
+            self._memo[key] = (now + ttl, stored)
+
+    def batch(self, handler: Callable) -> "ToolBatch":
+        """Start the tool calls of one completion; calls can be submitted as they arrive (e.g. while streaming)"""
+        return ToolBatch(self, handler)
+
+    def execute(self, tool_calls: List[Any], handler: Callable, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Run `handler(tool_call, [])` for every call and append the results to `messages` in call order.
+
+        A call that raises or exceeds its timeout gets an error tool message instead
+        (a timed-out handler keeps running in its thread; its result is discarded).
+        Memoized calls answered from the memo don't execute; a repeat of an earlier
+        call in the same completion gets a short pointer to that call's result.
+        """
+        batch = self.batch(handler)
+        for tool_call in tool_calls:
+            batch.submit(tool_call)
+        return batch.results(messages)
+
+
+class ToolBatch:
+    """The tool calls of one completion: each starts when submitted, results are collected in submission order"""
+
+    def __init__(self, executor: ToolExecutor, handler: Callable):
+        self.executor = executor
+        self.handler = handler
+        self._calls: List[Any] = []
+        self._plans: List[Tuple] = []  # per call: (name, memo key, memo hit, index of an identical earlier call, future, deadline)
+        self._first_by_key: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def submit(self, tool_call: Any):
+        """Start a call now (unless the memo or an identical earlier call in this batch answers it)"""
+        executor = self.executor
+        index = len(self._calls)
+        self._calls.append(tool_call)
+        function = _field(tool_call, "function")
+        name = _field(function, "name", "")
+        limits = executor._limits(name)
+        key = memo_key(name, _field(function, "arguments", "{}")) if limits.cache_ttl is not None else None
+        if key is not None:
+            hit = executor._recall(key, tool_call)
+            if hit is not None:
+                self._plans.append((name, key, hit, None, None, None))
+                return
+            if key in self._first_by_key:
+                self._plans.append((name, key, None, self._first_by_key[key], None, None))
+                return
+            self._first_by_key[key] = index
+        deadline = None if limits.timeout is None else time.monotonic() + limits.timeout
+        # Copy the context per call so trace spans nest under the caller's
+        future = _shared_pool(executor.max_workers).submit(
+            contextvars.copy_context().run, executor._call, self.handler, tool_call, deadline
+        )
+        self._plans.append((name, key, None, None, future, deadline))
+
+    def results(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Wait for every submitted call and append the results to `messages` in submission order"""
+        executor = self.executor
+        for tool_call, (name, key, hit, earlier, future, deadline) in zip(self._calls, self._plans):
+            if hit is not None or earlier is not None:
+                TOOL_CALLS.labels(executor.agent_name, name, "memoized").inc()
+                messages.extend(hit or [{
+                    "role": "tool",
+                    "tool_call_id": _field(tool_call, "id"),
+                    "content": f"Same call as {_field(self._calls[earlier], 'id')}; see its result.",
+                }])
+                continue
+            try:
+                results = future.result(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+                # Failures (ToolFailure messages) are retried on the next call rather than memoized
+                if key is not None and results and not any(isinstance(result, ToolFailure) for result in results):
+                    executor._remember(key, executor._limits(name).cache_ttl, results)
+            except concurrent.futures.TimeoutError:
+                logger.error(f"{executor.agent_name}: tool {name} timed out after {executor._limits(name).timeout}s")
+                results = [executor._error(tool_call, f"Tool '{name}' timed out")]
+            except Exception as error:
+                logger.error(f"{executor.agent_name}: tool {name} failed: {error}")
+                results = [executor._error(tool_call, f"Tool '{name}' failed: {error}")]
+            messages.extend(results or [executor._error(tool_call, f"Tool '{name}' returned no result")])
+        return messages
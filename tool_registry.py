@@ -0,0 +1,321 @@
+"""
+Tool Registry
+
+Tools are plain functions (or methods) marked with @tool. The JSON schema the
+model sees is generated once, when the function is defined, from its signature,
+type hints and docstring, together with a validator for its arguments:
+
+- schemas can't drift from the functions they describe
+- dispatch is a dict lookup by name instead of a scan or an if/elif chain
+- malformed arguments (missing, unknown, wrong type, outside the enum) are
+  answered with a tool message saying what is wrong, without running the tool,
+  so the model can correct the call in its next turn
+
+    @tool
+    def get_current_weather(location: str, unit: Literal["celsius", "fahrenheit"] = "celsius") -> str:
+        '''
+        Get the current weather in a given location
+
+        Args:
+            location: The city and state, e.g. San Francisco, CA
+        '''
+
+    registry = ToolRegistry(get_current_weather)
+    client.chat.completions.create(..., tools=registry.schemas)
+    registry.handle_tool_call(tool_call, messages, agent="First-Mate")
+
+Methods are collected from an instance with ToolRegistry.from_object(agent).
+An async tool's coroutine is run to completion, so call async tools from a worker
+thread (as ToolExecutor does), not from a running event loop.
+"""
+
+import json
+import asyncio
+import inspect
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union, get_args, get_origin, get_type_hints
+
+from agent_metrics import TOOL_CALLS, track_tool_call
+from agent_tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+_JSON_TYPES = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+_PYTHON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list, tuple),
+    "object": (dict,),
+}
+
+
+class ToolFailure(dict):
+    """A tool message reporting a call that was rejected or raised; sent like any other, but never memoized"""
+
+
+@dataclass(frozen=True)
+class ToolSpec:
+    """A tool's schema and the validator compiled from it"""
+
+    name: str
+    schema: Dict[str, Any]
+    validate: Callable[[Any], List[str]]  # arguments -> problems, empty when valid
+
+    @classmethod
+    def from_schema(cls, schema: Dict[str, Any]) -> "ToolSpec":
+        function = schema["function"]
+        return cls(function["name"], schema, _compile_validator(function.get("parameters") or {}))
+
+
+def _type_schema(annotation: Any) -> Tuple[Dict[str, Any], bool]:
+    """(JSON schema, accepts None) for a type hint; unknown hints accept anything"""
+    origin, args = get_origin(annotation), get_args(annotation)
+    if origin is Union:
+        members = [arg for arg in args if arg is not type(None)]
+        schema = _type_schema(members[0])[0] if len(members) == 1 else {}
+        return schema, len(members) < len(args)
+    if origin is Literal:
+        return {"type": _JSON_TYPES.get(type(args[0]), "string"), "enum": list(args)}, None in args
+    if origin in (list, tuple):
+        schema = {"type": "array"}
+        if args and args[0] is not Ellipsis:
+            item = _type_schema(args[0])[0]
+            if item:
+                schema["items"] = item
+        return schema, False
+    if origin is dict:
+        return {"type": "object"}, False
+    if annotation in _JSON_TYPES:
+        return {"type": _JSON_TYPES[annotation]}, False
+    return {}, annotation is type(None)
+
+
+def _parse_docstring(doc: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """(description, {parameter: description}) from a docstring with a Google-style Args: section"""
+    summary: List[str] = []
+    params: Dict[str, str] = {}
+    current = None
+    section = "summary"
+    for line in inspect.cleandoc(doc or "").splitlines():
+        stripped = line.strip()
+        if stripped in ("Args:", "Arguments:", "Parameters:"):
+            section = "args"
+        elif section == "summary":
+            if not stripped and summary:
+                section = "body"
+            elif stripped:
+                summary.append(stripped)
+        elif section == "args":
+            if not stripped:
+                current = None
+            elif not line.startswith(" ") and stripped.endswith(":"):
+                section = "body"  # Returns:, Raises:, ...
+            elif ":" in stripped and not line.startswith(" " * 8):
+                name, _, text = stripped.partition(":")
+                current = name.split("(")[0].strip()
+                params[current] = text.strip()
+            elif current is not None:
+                params[current] = f"{params[current]} {stripped}".strip()
+    return " ".join(summary), params
+
+
+def _compile_validator(parameters: Dict[str, Any], nullable: Tuple[str, ...] = ()) -> Callable[[Any], List[str]]:
+    properties = parameters.get("properties") or {}
+    required = tuple(parameters.get("required") or ())
+    known = frozenset(properties)
+    checks = []
+    for param, schema in properties.items():
+        json_type = schema.get("type")
+        items = (schema.get("items") or {}).get("type")
+        checks.append((
+            param,
+            json_type,
+            _PYTHON_TYPES.get(json_type),
+            tuple(schema["enum"]) if "enum" in schema else None,
+            items,
+            _PYTHON_TYPES.get(items),
+        ))
+
+    def matches(value: Any, types: Tuple[type, ...]) -> bool:
+        # bool is an int in Python but not in JSON
+        return isinstance(value, types) and (bool in types or not isinstance(value, bool))
+
+    def validate(arguments: Any) -> List[str]:
+        if not isinstance(arguments, dict):
+            return ["arguments must be a JSON object"]
+        problems = [f"missing required argument '{param}'" for param in required if param not in arguments]
+        problems += [f"unknown argument '{param}'" for param in arguments if param not in known]
+        for param, json_type, types, enum, items, item_types in checks:
+            if param not in arguments:
+                continue
+            value = arguments[param]
+            if value is None and param in nullable:
+                continue
+            if types is not None and not matches(value, types):
+                problems.append(f"'{param}' must be {json_type}, got {type(value).__name__}")
+            elif enum is not None and value not in enum:
+                problems.append(f"'{param}' must be one of {list(enum)}, got {value!r}")
+            elif item_types is not None and not all(matches(item, item_types) for item in value):
+                problems.append(f"'{param}' must be an array of {items}")
+        return problems
+
+    return validate
+
+
+def _spec_for(function: Callable, name: Optional[str] = None, description: Optional[str] = None) -> ToolSpec:
+    summary, param_docs = _parse_docstring(function.__doc__)
+    try:
+        hints = get_type_hints(function)
+    except Exception:
+        hints = {}
+
+    properties: Dict[str, Any] = {}
+    required: List[str] = []
+    nullable: List[str] = []
+    for param in inspect.signature(function).parameters.values():
+        if param.name in ("self", "cls") or param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        schema, accepts_none = _type_schema(hints.get(param.name, Any))
+        if param.name in param_docs:
+            schema["description"] = param_docs[param.name]
+        properties[param.name] = schema
+        if param.default is param.empty:
+            required.append(param.name)
+        if accepts_none or param.default is None:
+            nullable.append(param.name)
+
+    parameters = {"type": "object", "properties": properties, "required": required}
+    schema = {
+        "type": "function",
+        "function": {
+            "name": name or function.__name__,
+            "description": description or summary,
+            "parameters": parameters,
+        },
+    }
+    return ToolSpec(name or function.__name__, schema, _compile_validator(parameters, tuple(nullable)))
+
+
+def tool(function: Optional[Callable] = None, *, name: Optional[str] = None, description: Optional[str] = None):
+    """
+    Mark a function or method as a tool; `@tool` or `@tool(name=..., description=...)`.
+
+    The schema and validator are attached as `function.__tool__`; the function
+    itself is returned unchanged and can still be called directly.
+    """
+    def decorate(function: Callable) -> Callable:
+        function.__tool__ = _spec_for(function, name=name, description=description)
+        return function
+    return decorate(function) if function is not None else decorate
+
+
+class ToolRegistry:
+    """Tools by name, with their schemas in registration order"""
+
+    def __init__(self, *functions: Callable):
+        self._tools: Dict[str, Tuple[ToolSpec, Callable]] = {}
+        self.schemas: List[Dict[str, Any]] = []
+        for function in functions:
+            self.register(function)
+
+    @classmethod
+    def from_object(cls, obj: Any) -> "ToolRegistry":
+        """A registry of the @tool methods of `obj`, bound to it, in definition order"""
+        names: Dict[str, None] = {}
+        for klass in reversed(type(obj).__mro__):
+            for attribute, member in vars(klass).items():
+                if hasattr(member, "__tool__"):
+                    names[attribute] = None
+        return cls(*(getattr(obj, attribute) for attribute in names))
+
+    def register(self, function: Callable, schema: Optional[Dict[str, Any]] = None) -> ToolSpec:
+        """Add a tool; an explicit OpenAI-style `schema` overrides the generated one"""
+        if schema is not None:
+            spec = ToolSpec.from_schema(schema)
+        else:
+            spec = getattr(function, "__tool__", None) or _spec_for(function)
+        if spec.name in self._tools:
+            self.schemas.remove(self._tools[spec.name][0].schema)
+        self._tools[spec.name] = (spec, function)
+        self.schemas.append(spec.schema)
+        return spec
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._tools)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    def __len__(self) -> int:
+        return len(self._tools)
+
+    def check(self, name: str, arguments: Any) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(parsed arguments, None) if the call can run, else (None, message for the model)"""
+        entry = self._tools.get(name)
+        if entry is None:
+            return None, f"Unknown tool '{name}'. Available tools: {', '.join(self._tools)}"
+        spec = entry[0]
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments or "{}")
+            except json.JSONDecodeError as error:
+                return None, f"Invalid arguments for {name}: not valid JSON ({error})"
+        problems = spec.validate(arguments)
+        if problems:
+            parameters = json.dumps(spec.schema["function"].get("parameters", {}))
+            return None, f"Invalid arguments for {name}: {'; '.join(problems)}. Expected parameters: {parameters}"
+        return arguments, None
+
+    def execute(self, name: str, arguments: Any) -> str:
+        """Validate and run one call; arguments as a JSON string or a dict"""
+        parsed, error = self.check(name, arguments)
+        if error is not None:
+            return error
+        return self._call(name, parsed)
+
+    def _call(self, name: str, arguments: Dict[str, Any]) -> str:
+        """Run a tool; an async tool is run to completion on an event loop of its own (as in ToolExecutor)"""
+        result = self._tools[name][1](**arguments)
+        if inspect.iscoroutine(result):
+            result = asyncio.run(result)
+        return str(result)
+
+    def handle_tool_call(self, tool_call: Any, messages: List[Dict[str, Any]],
+                         agent: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Run a tool call and append its tool message, the handle_tool_call(tool_call, messages) agents use.
+
+        With `agent`, the call is timed and counted in the tool metrics and traced.
+        A tool that raises, or a call with invalid arguments, gets an error message
+        (a ToolFailure) instead of failing the turn.
+        """
+        function = tool_call["function"] if isinstance(tool_call, dict) else tool_call.function
+        call_id = tool_call.get("id") if isinstance(tool_call, dict) else tool_call.id
+        name = function["name"] if isinstance(function, dict) else function.name
+        arguments = function.get("arguments") if isinstance(function, dict) else function.arguments
+
+        parsed, problem = self.check(name, arguments)
+        if problem is not None:
+            logger.warning(problem)
+            if agent is not None:
+                TOOL_CALLS.labels(agent, name, "invalid").inc()
+            messages.append(ToolFailure(role="tool", tool_call_id=call_id, content=problem))
+            return messages
+        try:
+            if agent is None:
+                result = self._call(name, parsed)
+            else:
+                with track_tool_call(agent, name), tracer.span("tool", agent=agent, tool=name):
+                    result = self._call(name, parsed)
+        except Exception as error:
+            logger.error(f"Tool {name} failed: {error}")
+            messages.append(ToolFailure(role="tool", tool_call_id=call_id, content=f"Tool '{name}' failed: {error}"))
+            return messages
+
+        messages.append({"role": "tool", "tool_call_id": call_id, "content": result})
+        return messages
@@ -5,25 +5,40 @@ This agent plans day trips to nearby cities. It uses NATS to communicate
 with the Weather Agent to check weather conditions before making recommendations.
 """
 
-from openai import OpenAI
 import json
 import random
 import asyncio
 import logging
+import time
 
 from nats_agent_mixin import NATSAgentMixin
-from nats_config import nats_config
+from nats_config import NATSConfig, nats_config
+from agent_loop import assistant_message, run_until_done
+from conversation import CONSOLIDATE_PROMPT, Conversation, PrefixReuse
+from agent_metrics import record_completion
+from agent_tracing import tracer
+from llm_gateway import llm_client
+from streaming import STREAM_OPTIONS, stream_completion
+from tool_executor import ToolExecutor, ToolLimits
+from tool_registry import ToolRegistry, tool
+from workflow import Step, Workflow, WorkflowRunner
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client for LM Studio
-client = OpenAI(base_url="http://127.0.0.1:1234/v1", api_key="lm-studio")
+# LM Studio client; shares one connection pool and concurrency limit with every agent in the process
+client = llm_client()
 
 
+@tool
 def get_nearby_cities(from_city: str) -> str:
-    """Get a list of nearby cities for day trips"""
+    """
+    Get a list of nearby cities that are good for day trips from a given city
+
+    Args:
+        from_city: The city you're starting from, e.g. 'San Francisco' or 'Boston'
+    """
     # Simulated database of nearby cities
     city_recommendations = {
         "San Francisco": ["Napa Valley", "Berkeley", "San Jose", "Santa Cruz", "Monterey"],
@@ -41,8 +56,15 @@ def get_nearby_cities(from_city: str) -> str:
     })
 
 
+@tool
 def get_activities(city: str, weather_condition: str = "sunny") -> str:
-    """Get recommended activities for a city based on weather"""
+    """
+    Get recommended activities for a destination city based on the weather conditions
+
+    Args:
+        city: The destination city name
+        weather_condition: The weather condition (sunny, rainy, cloudy, etc.)
+    """
     
     outdoor_activities = [
         "hiking", "beach visit", "outdoor dining", "wine tasting", 
@@ -70,6 +92,34 @@ def get_activities(city: str, weather_condition: str = "sunny") -> str:
     })
 
 
+def day_trip_workflow(weather_agent: str = "Weather-Bot") -> Workflow:
+    """
+    The day trip plan as a DAG: nearby cities, then weather and activities for
+    every candidate city concurrently, then the combined options.
+    """
+    def cities(results):
+        return json.loads(results["nearby"])["nearby_cities"]
+    
+    def activities(results):
+        city, weather = results["item"]
+        return json.loads(get_activities(city, weather))
+    
+    def options(results):
+        return [
+            {"city": city, "weather": weather, "activities": plan}
+            for city, weather, plan in zip(cities(results), results["weather"], results["activities"])
+        ]
+    
+    return Workflow("day-trip", [
+        Step("nearby", tool=lambda results: get_nearby_cities(results["from_city"])),
+        Step("weather", agent=weather_agent, depends_on=["nearby"], foreach=cities,
+             prompt="What's the weather in {item}?", retries=1, timeout=60),
+        Step("activities", tool=activities, depends_on=["nearby", "weather"],
+             foreach=lambda results: list(zip(cities(results), results["weather"]))),
+        Step("options", tool=options, depends_on=["nearby", "weather", "activities"]),
+    ])
+
+
 class TripPlannerAgent(NATSAgentMixin):
     """
     Trip Planner Agent that uses NATS to communicate with Weather Agent.
@@ -81,53 +131,70 @@ class TripPlannerAgent(NATSAgentMixin):
     - Provides complete trip itineraries
     """
     
-    def __init__(self, name: str, instructions: str, model: str, tools: list):
+    def __init__(self, name: str, instructions: str, model: str, tools: list,
+                 nats_config: NATSConfig = nats_config, stream: bool = True):
         self.name = name
         self.instructions = instructions
-        self.messages = [
-            {"role": "system", "content": self.instructions}
-        ]
+        self.messages = Conversation(self.instructions)
         self.model = model
         self.tools = tools
+        self.prefix_reuse = PrefixReuse(self.name)
+        
+        # Stream completions: tool calls start while the model is still writing, visible text goes to on_text
+        self.stream = stream
+        self.on_text = None
         
         # Initialize NATS mixin
         super().__init__(nats_config=nats_config)
         
-        # Tool function registry
-        self.tool_functions = {
-            "get_nearby_cities": get_nearby_cities,
-            "get_activities": get_activities
-        }
+        # Runs DAG workflows; keeps checkpoints so failed runs can be resumed
+        self.workflow_runner = WorkflowRunner(self)
+        
+        # Tool functions by name, with argument validation
+        self.registry = trip_planner_registry
+        
+        # Runs the tool calls of a completion concurrently; nearby cities are static, activities are random
+        self.tool_executor = ToolExecutor(self.name, limits={"get_nearby_cities": ToolLimits(cache_ttl=3600)})
         
         logger.info(f"TripPlannerAgent '{self.name}' initialized")
     
     def consolidate_context(self, messages):
         """Ask a language model to consolidate the context"""
-        completion = client.chat.completions.create(
-            model="qwen/qwen3-32b",
-            messages=[{
-                "role": "user",
-                "content": "Consolidate the following messages into a single message. Do not lose any information." + json.dumps(messages)
-            }],
-            tools=self.tools,
-            tool_choice="auto"
-        )
+        # The instruction goes after the history, so the history is served from the KV cache
+        request = messages.with_control(CONSOLIDATE_PROMPT)
+        self.prefix_reuse.observe(request, self.tools)
+        started = time.perf_counter()
+        with tracer.span("llm.consolidate", agent=self.name, model=self.model):
+            completion = client.chat.completions.create(
+                model="qwen/qwen3-32b",
+                messages=request,
+                tools=self.tools,
+                tool_choice="auto"
+            )
+        record_completion(self.name, self.model, started, completion)
         
-        # Recreate the messages list with the consolidated context
-        messages = [
-            {"role": "system", "content": self.instructions},
-            {"role": "user", "content": completion.choices[0].message.content}
-        ]
-        return messages
+        # Continue from the consolidated context under the same system prompt
+        return messages.consolidated(completion.choices[0].message.content)
     
     def prompt(self, messages):
         """Send a prompt to the language model"""
-        completion = client.chat.completions.create(
-            model="qwen/qwen3-32b",
-            messages=messages,
-            tools=self.tools,
-            tool_choice="auto"
-        )
+        self.prefix_reuse.observe(messages, self.tools)
+        batch = self.tool_executor.batch(self.handle_tool_call)
+        request = dict(model="qwen/qwen3-32b", messages=messages, tools=self.tools, tool_choice="auto")
+        started = time.perf_counter()
+        with tracer.span("llm.completion", agent=self.name, model=self.model, stream=self.stream):
+            if self.stream:
+                completion = stream_completion(
+                    client.chat.completions.create(**request, **STREAM_OPTIONS),
+                    on_tool_call=batch.submit, on_text=self.on_text, agent=self.name, model=self.model,
+                )
+            else:
+                completion = client.chat.completions.create(**request)
+        record_completion(self.name, self.model, started, completion)
+        self.last_completion = completion
+        if not self.stream:
+            for tool_call in completion.choices[0].message.tool_calls or []:
+                batch.submit(tool_call)
         
         print(completion.choices[0].message)
         result = completion.choices[0].message.content
@@ -137,42 +204,18 @@ class TripPlannerAgent(NATSAgentMixin):
             result = result.split("</think>")[1]
         
         print(result)
+        messages.append(assistant_message(completion.choices[0].message))
         
         # Handle tool calls if there are any
         if completion.choices[0].message.tool_calls:
             print("Tool calls found")
-            for tool_call in completion.choices[0].message.tool_calls:
-                messages = self.handle_tool_call(tool_call, messages)
+            messages = batch.results(messages)
         
         return messages
     
     def handle_tool_call(self, tool_call, messages):
         """Handle tool calls"""
-        function_name = tool_call.function.name
-        tool_call_arguments = json.loads(tool_call.function.arguments)
-        
-        result = None
-        
-        if function_name in self.tool_functions:
-            # Call the tool function with the arguments
-            tool_func = self.tool_functions[function_name]
-            try:
-                # Get the function parameters and call it
-                if function_name == "get_nearby_cities":
-                    result = tool_func(tool_call_arguments.get("from_city"))
-                elif function_name == "get_activities":
-                    result = tool_func(
-                        tool_call_arguments.get("city"),
-                        tool_call_arguments.get("weather_condition", "sunny")
-                    )
-            except Exception as error:
-                logger.error(f"Error calling tool {function_name}: {error}")
-                result = json.dumps({"error": str(error)})
-        else:
-            result = json.dumps({"error": f"Unknown tool: {function_name}"})
-        
-        messages.append({"role": "tool", "content": result})
-        return messages
+        return self.registry.handle_tool_call(tool_call, messages, agent=self.name)
     
     def run(self, kickoff_message):
         """Run the agent once with a kickoff message"""
@@ -181,41 +224,27 @@ class TripPlannerAgent(NATSAgentMixin):
         self.messages = results
         return self.messages
     
-    def agentic_run(self, kickoff_message):
+    def agentic_run(self, kickoff_message, max_iterations=10, token_budget=None):
         """
         Run the agent with the OODA loop until completion.
         
         This method will automatically reach out to Weather Agent via NATS
-        when planning trips.
+        when planning trips. The loop ends when the model answers without calling
+        tools, or at max_iterations / token_budget (total tokens).
         """
-        # First run the kickoff message
         self.messages.append({"role": "user", "content": kickoff_message})
-        results = self.prompt(self.messages)
-        self.messages = results
-        
-        # Then run the agentic loop
-        continue_flag = "yes"
-        
-        while continue_flag == "yes":
-            messages = self.messages.copy()  # Observe
-            messages.append({
-                "role": "user",
-                "content": "Has the original kickoff prompt been completed, or should we continue? Respond with only yes (continue) or no (stop) with no other text."
-            })
-            results = self.prompt(messages)  # Decide
-            continue_flag = results[-1].get("content", "").lower()
-            
-            if continue_flag == "no":
-                break
-            
-            self.messages.append({
-                "role": "user",
-                "content": "Please continue with the original prompt."
-            })  # Decide
-            results = self.prompt(self.messages)  # Act
-            self.messages = results
+        return run_until_done(self, max_iterations=max_iterations, token_budget=token_budget)
+    
+    async def plan_day_trip(self, from_city: str, weather_agent: str = "Weather-Bot",
+                            run_id: str = None) -> list:
+        """
+        Gather day trip options from a city without LLM turns in between.
         
-        return self.messages
+        Weather for every candidate city is requested concurrently; pass the same
+        run_id again to resume a run that failed part-way.
+        """
+        results = await self.workflow_runner.run(day_trip_workflow(weather_agent), {"from_city": from_city}, run_id=run_id)
+        return results["options"]
     
     async def run_with_nats(self, capabilities=None, description=None):
         """
@@ -230,9 +259,8 @@ class TripPlannerAgent(NATSAgentMixin):
             
             logger.info(f"Agent '{self.name}' is now listening for messages on NATS")
             
-            # Keep running until interrupted
-            while True:
-                await asyncio.sleep(1)
+            # Keep running until SIGTERM/SIGINT, then drain in-flight work in disconnect_nats()
+            await self.wait_until_stopped()
                 
         except KeyboardInterrupt:
             logger.info("Shutting down agent...")
@@ -243,46 +271,8 @@ class TripPlannerAgent(NATSAgentMixin):
 
 
 # Tool definitions for the Trip Planner
-trip_planner_tools = [
-    {
-        "type": "function",
-        "function": {
-            "name": "get_nearby_cities",
-            "description": "Get a list of nearby cities that are good for day trips from a given city",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "from_city": {
-                        "type": "string",
-                        "description": "The city you're starting from, e.g. 'San Francisco' or 'Boston'",
-                    }
-                },
-                "required": ["from_city"],
-            },
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "get_activities",
-            "description": "Get recommended activities for a destination city based on the weather conditions",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "city": {
-                        "type": "string",
-                        "description": "The destination city name",
-                    },
-                    "weather_condition": {
-                        "type": "string",
-                        "description": "The weather condition (sunny, rainy, cloudy, etc.)",
-                    }
-                },
-                "required": ["city"],
-            },
-        }
-    }
-]
+trip_planner_registry = ToolRegistry(get_nearby_cities, get_activities)
+trip_planner_tools = trip_planner_registry.schemas
 
 
 async def main():
@@ -310,9 +300,6 @@ async def main():
         
         When checking weather, ask Weather-Bot: "What's the weather in [city name]?"
         
-        Available tools:
-        {json.dumps(trip_planner_tools, indent=2)}
-        
         Remember: Always check weather with Weather-Bot via NATS before making recommendations!
         """,
         model="qwen/qwen3-32b",
@@ -0,0 +1,267 @@
+"""
+Workflow Orchestrator
+
+Runs multi-agent plans declared as a DAG of steps instead of driving every hop
+through sequential LLM turns. Each step either asks another agent over NATS or
+calls a local tool, and declares which steps' results it needs.
+
+- Independent steps run concurrently (bounded by max_concurrency)
+- A step can fan out over a list (e.g. weather for each candidate city); the items run concurrently
+- Every finished step (and fan-out item) is checkpointed, so re-running a failed
+  workflow with the same run_id only re-runs what did not finish
+
+Example:
+
+    workflow = Workflow("day-trip", [
+        Step("nearby", tool=lambda r: get_nearby_cities(r["from_city"])),
+        Step("weather", agent="Weather-Bot", depends_on=["nearby"],
+             foreach=lambda r: json.loads(r["nearby"])["nearby_cities"],
+             prompt="What's the weather in {item}?"),
+    ])
+    results = await WorkflowRunner(agent).run(workflow, {"from_city": "Boston"})
+"""
+
+import os
+import json
+import uuid
+import asyncio
+import logging
+import functools
+import contextvars
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from agent_jobs import JOB_SUCCEEDED
+from agent_tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class WorkflowError(Exception):
+    """Raised when a workflow is invalid or some of its steps failed"""
+
+    def __init__(self, message: str, run_id: Optional[str] = None, failed: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.run_id = run_id
+        self.failed = failed or {}
+
+
+@dataclass
+class Step:
+    """
+    One node of a workflow.
+
+    Exactly one of `agent` (send `prompt` to that agent with request_from_agent)
+    or `tool` (call `tool(results)` locally, sync or async) must be set. `results`
+    holds the workflow inputs, the results of `depends_on` steps and, for
+    fan-out steps, the current `item`.
+    """
+
+    name: str
+    agent: Optional[str] = None
+    prompt: Optional[Union[str, Callable[[Dict[str, Any]], str]]] = None
+    tool: Optional[Callable[[Dict[str, Any]], Any]] = None
+    depends_on: List[str] = field(default_factory=list)
+    foreach: Optional[Callable[[Dict[str, Any]], List[Any]]] = None  # fan out over the returned items
+    retries: int = 0
+    timeout: float = 60.0
+    as_job: bool = False  # delegate via submit_job/wait_for_job, for long-running agent steps
+
+
+@dataclass
+class Workflow:
+    """A named DAG of steps"""
+
+    name: str
+    steps: List[Step]
+
+    def __post_init__(self):
+        self.by_name: Dict[str, Step] = {}
+        for step in self.steps:
+            if step.name in self.by_name:
+                raise WorkflowError(f"Duplicate step name '{step.name}'")
+            if (step.agent is None) == (step.tool is None):
+                raise WorkflowError(f"Step '{step.name}' needs exactly one of agent or tool")
+            self.by_name[step.name] = step
+        for step in self.steps:
+            for dependency in step.depends_on:
+                if dependency not in self.by_name:
+                    raise WorkflowError(f"Step '{step.name}' depends on unknown step '{dependency}'")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> List[str]:
+        """Kahn's algorithm; raises on cycles"""
+        remaining = {step.name: set(step.depends_on) for step in self.steps}
+        order = []
+        while remaining:
+            ready = sorted(name for name, deps in remaining.items() if not deps)
+            if not ready:
+                raise WorkflowError(f"Workflow '{self.name}' has a cycle among {sorted(remaining)}")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return order
+
+
+class CheckpointStore:
+    """Completed step results per run; in memory, or one JSON file per run under `directory`"""
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._runs: Dict[str, Dict[str, Any]] = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, run_id: str) -> str:
+        return os.path.join(self.directory, f"{run_id}.json")
+
+    def load(self, run_id: str) -> Dict[str, Any]:
+        if run_id in self._runs:
+            return self._runs[run_id]
+        checkpoint = {"results": {}, "failed": {}}
+        if self.directory and os.path.exists(self._path(run_id)):
+            with open(self._path(run_id), "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        self._runs[run_id] = checkpoint
+        return checkpoint
+
+    def save(self, run_id: str):
+        if not self.directory:
+            return
+        temp_path = self._path(run_id) + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self._runs[run_id], f, indent=2, default=str)
+        os.replace(temp_path, self._path(run_id))
+
+
+class WorkflowRunner:
+    """Executes workflows, using `agent` (a connected NATSAgentMixin) to reach other agents"""
+
+    def __init__(self, agent, checkpoints: Optional[CheckpointStore] = None, max_concurrency: int = 8):
+        self.agent = agent
+        self.checkpoints = checkpoints or CheckpointStore()
+        self.max_concurrency = max_concurrency
+
+    async def run(self, workflow: Workflow, inputs: Optional[Dict[str, Any]] = None,
+                  run_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Run (or resume) a workflow and return every step's result.
+
+        Raises WorkflowError listing the failed steps; independent branches still
+        finish and are checkpointed, so calling run() again with the same run_id
+        retries only the failed steps and those downstream of them.
+        """
+        run_id = run_id or str(uuid.uuid4())
+        checkpoint = self.checkpoints.load(run_id)
+        checkpoint["failed"] = {}
+        results: Dict[str, Any] = checkpoint["results"]
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        inputs = inputs or {}
+
+        agent_name = getattr(getattr(self.agent, "agent_metadata", None), "name", None)
+        with tracer.span("workflow.run", agent=agent_name, workflow=workflow.name, run_id=run_id):
+            pending = {name for name in workflow.order if name not in results}
+            if len(pending) < len(workflow.order):
+                logger.info(f"Resuming workflow '{workflow.name}' run {run_id}: "
+                            f"{len(workflow.order) - len(pending)} step(s) already done")
+            running: Dict[asyncio.Task, str] = {}
+
+            while pending or running:
+                # Launch every step whose dependencies are done
+                for name in [n for n in workflow.order if n in pending]:
+                    step = workflow.by_name[name]
+                    if any(dep in checkpoint["failed"] for dep in step.depends_on):
+                        pending.discard(name)
+                        checkpoint["failed"][name] = "skipped: a dependency failed"
+                    elif all(dep in results for dep in step.depends_on):
+                        pending.discard(name)
+                        context = {**inputs, **{dep: results[dep] for dep in step.depends_on}}
+                        task = asyncio.create_task(self._run_step(step, context, checkpoint, run_id, semaphore))
+                        running[task] = name
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = running.pop(task)
+                    try:
+                        results[name] = task.result()
+                    except Exception as error:
+                        logger.error(f"Workflow '{workflow.name}' step '{name}' failed: {error}")
+                        checkpoint["failed"][name] = str(error) or type(error).__name__
+                    self.checkpoints.save(run_id)
+
+        if checkpoint["failed"]:
+            raise WorkflowError(
+                f"Workflow '{workflow.name}' run {run_id} failed at: {', '.join(checkpoint['failed'])}",
+                run_id=run_id,
+                failed=dict(checkpoint["failed"]),
+            )
+        return {name: results[name] for name in workflow.order}
+
+    async def _run_step(self, step: Step, context: Dict[str, Any], checkpoint: Dict[str, Any],
+                        run_id: str, semaphore: asyncio.Semaphore) -> Any:
+        """Run a step, fanning out over its items if it has any"""
+        if step.foreach is None:
+            return await self._attempt(step, context, semaphore)
+
+        items = list(step.foreach(context))
+        item_results = checkpoint.setdefault("items", {}).setdefault(step.name, {})
+
+        async def run_item(index: int, item: Any):
+            key = str(index)
+            if key not in item_results:
+                item_results[key] = await self._attempt(step, {**context, "item": item}, semaphore)
+                self.checkpoints.save(run_id)
+            return item_results[key]
+
+        outcomes = await asyncio.gather(*(run_item(i, item) for i, item in enumerate(items)),
+                                        return_exceptions=True)
+        errors = [o for o in outcomes if isinstance(o, Exception)]
+        if errors:
+            raise WorkflowError(f"{len(errors)} of {len(items)} item(s) failed: {errors[0]}")
+        checkpoint["items"].pop(step.name, None)
+        return outcomes
+
+    async def _attempt(self, step: Step, context: Dict[str, Any], semaphore: asyncio.Semaphore) -> Any:
+        """Run one unit of work with retries"""
+        last_error: Optional[Exception] = None
+        for attempt in range(step.retries + 1):
+            async with semaphore:
+                with tracer.span("workflow.step", step=step.name, attempt=attempt,
+                                 target=step.agent or getattr(step.tool, "__name__", "tool")):
+                    try:
+                        return await asyncio.wait_for(self._execute(step, context), step.timeout)
+                    except asyncio.TimeoutError:
+                        last_error = WorkflowError(f"Step '{step.name}' timed out after {step.timeout}s")
+                    except Exception as error:
+                        last_error = error
+            if attempt < step.retries:
+                logger.warning(f"Step '{step.name}' attempt {attempt + 1} failed ({last_error}), retrying")
+        raise last_error
+
+    async def _execute(self, step: Step, context: Dict[str, Any]) -> Any:
+        if step.tool is not None:
+            if asyncio.iscoroutinefunction(step.tool):
+                return await step.tool(context)
+            # Blocking tools run in a worker thread, keeping the trace context
+            loop = asyncio.get_running_loop()
+            call = functools.partial(contextvars.copy_context().run, step.tool, context)
+            return await loop.run_in_executor(None, call)
+
+        prompt = step.prompt(context) if callable(step.prompt) else (step.prompt or "").format(**context)
+        if step.as_job:
+            job_id = await self.agent.submit_job(step.agent, prompt)
+            if job_id is None:
+                raise WorkflowError(f"Agent '{step.agent}' did not accept the job")
+            job = await self.agent.wait_for_job(job_id, timeout=step.timeout)
+            if job is None or job.status != JOB_SUCCEEDED:
+                raise WorkflowError(f"Job for '{step.agent}' ended as {job.status if job else 'timeout'}")
+            return job.result
+
+        response = await self.agent.request_from_agent(step.agent, prompt, timeout=step.timeout)
+        if response is None:
+            raise WorkflowError(f"No response from agent '{step.agent}'")
+        return response